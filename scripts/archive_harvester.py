@@ -0,0 +1,488 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import argparse
+import itertools
+from urllib.parse import urlsplit, urlencode, quote
+from xml.etree import ElementTree as ET
+
+import aiohttp
+from aiohttp import web
+
+from rate_limiter import with_rate_limit_async, set_rate
+from image_downloader import DownloadResult, probe_image_header, HEADERS
+from normalize_images import save_download
+from metrics import metrics
+
+# Async harvester for the zero-auth archives of scraper_plan_v1.md:
+# NASA images-assets, Gallica, NYPL map warper and archive.org.
+# Each source adapter only knows its own search pages and how to turn one
+# search hit into image records; the Harvester does the HTTP, pagination and
+# concurrency. Page N+1 is requested as soon as page N arrives, and up to
+# `concurrency` hits resolve (manifest, info.json, image) at once, so records
+# stream out while later pages are still in flight.
+# Images are requested at the target long edge, never as full-size masters:
+# IIIF services get a size from their `sizes` list or a scaled w,h capped by
+# maxWidth / maxHeight / maxArea, NASA and NYPL get the nearest rendition.
+# --record DIR stores every response under DIR; --replay DIR serves them back
+# from a local server, so a harvest can be re-run offline against fixtures.
+
+OUTPUT_PATH = "../metadata/archive_harvest.jsonl"
+IMAGES_DIR = "../raw_images/archives"
+
+TARGET_SIZE = 1600  # long edge, px
+PAGE_SIZE = 50
+MAX_PAGES = 20
+MAX_CANVASES = 1  # pages taken from each multi-page item
+CONCURRENCY = 16
+PER_HOST = 8
+CHUNK_SIZE = 64 * 1024
+MAX_MANIFEST_BYTES = 32 * 1024 * 1024
+MAX_IMAGE_BYTES = 50 * 1024 * 1024
+
+SRW = "{http://www.loc.gov/zing/srw/}"
+DC = "{http://purl.org/dc/elements/1.1/}"
+
+# --- IIIF Image API size negotiation (v1.1, v2 and v3 services) ---
+def iiif_id(service):
+    return (service.get("id") or service.get("@id")).rstrip("/")
+
+def iiif_version(service):
+    context = str(service.get("@context", ""))
+    profile = str(service.get("profile", ""))
+    if "/image/3" in context or service.get("type") == "ImageService3":
+        return 3
+    if "/image/1" in context or "image-api/1" in profile:
+        return 1
+    return 2
+
+def is_level0(service):
+    profile = service.get("profile")
+    names = profile if isinstance(profile, list) else [profile]
+    return any(isinstance(name, str) and "level0" in name for name in names)
+
+def iiif_limits(service):
+    limits = {}
+    profile = service.get("profile")
+    for entry in (profile if isinstance(profile, list) else [profile]) + [service]:
+        if isinstance(entry, dict):
+            limits.update({k: entry[k] for k in ("maxWidth", "maxHeight", "maxArea") if k in entry})
+    if "maxWidth" in limits:
+        limits.setdefault("maxHeight", limits["maxWidth"])
+    return limits
+
+# Smallest pre-rendered size covering the target, else a scaled w,h within the service limits
+def iiif_size(service, width, height, target):
+    sizes = sorted(service.get("sizes") or [], key=lambda s: max(s["width"], s["height"]))
+    for size in sizes:
+        if max(size["width"], size["height"]) >= target:
+            return size["width"], size["height"]
+    if sizes and is_level0(service):
+        return sizes[-1]["width"], sizes[-1]["height"]
+
+    scale = min(1.0, target / max(width, height))
+    limits = iiif_limits(service)
+    if "maxWidth" in limits:
+        scale = min(scale, limits["maxWidth"] / width, limits["maxHeight"] / height)
+    if "maxArea" in limits:
+        scale = min(scale, (limits["maxArea"] / (width * height)) ** 0.5)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def iiif_image_url(service, width, height, target, format="jpg"):
+    version = iiif_version(service)
+    w, h = iiif_size(service, width, height, target)
+    if (w, h) == (width, height):
+        size = "max" if version == 3 else "full"
+    else:
+        size = f"{w},{h}" if version == 3 else f"{w},"
+    quality = "native" if version == 1 else "default"
+    return f"{iiif_id(service)}/full/{size}/0/{quality}.{format}", w, h
+
+# --- IIIF Presentation manifests (v2 sequences, v3 items) ---
+def label_text(label):
+    if isinstance(label, dict):
+        label = next(iter(label.values()), None)
+    if isinstance(label, list):
+        label = label[0] if label else None
+    if isinstance(label, dict):
+        label = label.get("@value")
+    return label
+
+def canvas_image(canvas, resource):
+    service = resource.get("service")
+    if isinstance(service, list):
+        service = service[0] if service else None
+    return {
+        "service": service,
+        "url": resource.get("@id") or resource.get("id"),
+        "width": resource.get("width") or canvas.get("width"),
+        "height": resource.get("height") or canvas.get("height"),
+        "label": label_text(canvas.get("label")),
+    }
+
+# First image of each canvas, lazily
+def manifest_canvases(manifest):
+    if "sequences" in manifest:
+        for canvas in (manifest["sequences"] or [{}])[0].get("canvases", []):
+            for image in canvas.get("images", [])[:1]:
+                yield canvas_image(canvas, image.get("resource", {}))
+    else:
+        for canvas in manifest.get("items", []):
+            for page in canvas.get("items", [])[:1]:
+                for annotation in page.get("items", [])[:1]:
+                    yield canvas_image(canvas, annotation.get("body", {}))
+
+# --- Fixtures: responses stored by host/path (+ query hash) ---
+def with_query(url, params):
+    if not params:
+        return url
+    return url + ("&" if "?" in url else "?") + urlencode(params, doseq=True)
+
+# Path segments are percent-encoded so keys such as IIIF's "ark:/..." and
+# "full/1000,/..." stay valid file names on every OS
+def fixture_key(url):
+    parts = urlsplit(url)
+    segments = [parts.netloc] + (parts.path.strip("/") or "index").split("/")
+    key = "/".join(quote(segment, safe="") or "_" for segment in segments)
+    if parts.query:
+        key += "@" + hashlib.sha1(parts.query.encode("utf-8")).hexdigest()[:12]
+    return key
+
+def write_fixture(root, url, body):
+    path = os.path.join(root, fixture_key(url))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(body)
+    os.replace(path + ".tmp", path)
+
+class FixtureServer:
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.runner = None
+        self.url = None
+
+    async def handle(self, request):
+        path = os.path.realpath(os.path.join(self.root, request.match_info["key"]))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return web.Response(status=404)
+        return web.FileResponse(path)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/{key:.+}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.url = f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+
+    async def close(self):
+        await self.runner.cleanup()
+
+# --- Harvester ---
+class Harvester:
+    def __init__(self, session, target=TARGET_SIZE, max_canvases=MAX_CANVASES, images_dir=None,
+                 fixtures_url=None, record_dir=None):
+        self.session = session
+        self.target = target
+        self.max_canvases = max_canvases
+        self.images_dir = images_dir
+        self.fixtures_url = fixtures_url
+        self.record_dir = record_dir
+
+    # Bodies are read in chunks and abandoned once they pass max_bytes
+    async def _request(self, url, max_bytes):
+        if self.fixtures_url:
+            url = f"{self.fixtures_url}/{quote(fixture_key(url))}"
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            buf = bytearray()
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                buf.extend(chunk)
+                if len(buf) > max_bytes:
+                    raise ValueError(f"response over {max_bytes} bytes")
+        return bytes(buf)
+
+    async def get(self, provider, url, params=None, max_bytes=MAX_MANIFEST_BYTES):
+        url = with_query(url, params)
+        body = await with_rate_limit_async(provider, self._request, url, max_bytes)
+        metrics.count("harvest_bytes", len(body), source=provider)
+        if self.record_dir:
+            write_fixture(self.record_dir, url, body)
+        return body
+
+    async def get_json(self, provider, url, params=None):
+        return json.loads(await self.get(provider, url, params))
+
+    async def _page(self, source, request):
+        url, params = request
+        body = await self.get(source.name, url, params)
+        metrics.count("harvest_pages", source=source.name)
+        return source.parse_page(body, request)
+
+    # Search hits page by page; the next page is already in flight while this one is consumed
+    async def hits(self, source, query, max_pages=MAX_PAGES):
+        task = asyncio.ensure_future(self._page(source, source.first_page(query)))
+        fetched = 1
+        try:
+            while task is not None:
+                items, request = await task
+                task = None
+                if request is not None and fetched < max_pages:
+                    task = asyncio.ensure_future(self._page(source, request))
+                    fetched += 1
+                for item in items:
+                    yield item
+        finally:
+            if task is not None:
+                task.cancel()
+
+    # One record per canvas, up to max_canvases, at the target size
+    async def iiif_records(self, provider, manifest_url, item):
+        manifest = await self.get_json(provider, manifest_url)
+        records = []
+        for n, canvas in enumerate(itertools.islice(manifest_canvases(manifest), self.max_canvases), 1):
+            service, width, height = canvas["service"], canvas["width"], canvas["height"]
+            if service and (not width or not height or (is_level0(service) and not service.get("sizes"))):
+                service = await self.get_json(provider, iiif_id(service) + "/info.json")
+                width, height = service["width"], service["height"]
+            if service:
+                url, width, height = iiif_image_url(service, width, height, self.target)
+            elif canvas["url"]:
+                url = canvas["url"]
+            else:
+                continue
+            records.append(dict(item, page=n, label=canvas["label"], url=url, width=width, height=height,
+                                manifest=manifest_url))
+        return records
+
+    async def download(self, record):
+        body = await self.get(record["source"], record["url"], max_bytes=MAX_IMAGE_BYTES)
+        header = probe_image_header(body)
+        if header is None:
+            raise ValueError(f"not an image: {record['url']}")
+        stem = os.path.join(self.images_dir, record["source"],
+                            hashlib.sha1(record["url"].encode("utf-8")).hexdigest()[:16])
+        path = await asyncio.to_thread(save_download, DownloadResult(record["url"], body, *header), stem)
+        return dict(record, file=os.path.abspath(path), width=header[1], height=header[2])
+
+    async def _resolve(self, source, item):
+        try:
+            records = await source.resolve(self, item)
+            if self.images_dir:
+                records = [await self.download(record) for record in records]
+        except Exception as e:
+            print(f"⚠️ {source.name} {item.get('id')}: {e}")
+            metrics.count("harvest_errors", source=source.name)
+            return []
+        metrics.count("harvest_records", len(records), source=source.name)
+        return records
+
+    # Records in completion order, with up to `concurrency` hits resolving at once
+    async def harvest(self, source, query, limit=None, max_pages=MAX_PAGES, concurrency=CONCURRENCY):
+        hits = self.hits(source, query, max_pages)
+        pending = set()
+        taken = 0
+        try:
+            async for item in hits:
+                if limit and taken >= limit:
+                    break
+                taken += 1
+                pending.add(asyncio.ensure_future(self._resolve(source, item)))
+                if len(pending) >= concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        for record in task.result():
+                            yield record
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for record in task.result():
+                        yield record
+        finally:
+            await hits.aclose()
+            for task in pending:
+                task.cancel()
+
+# --- Source adapters: first_page(query), parse_page(body, request) -> (items, next request), resolve() ---
+# NASA renditions by nominal long edge, smallest first
+NASA_RENDITIONS = [("thumb", 156), ("small", 640), ("medium", 1280), ("large", 1920), ("orig", None)]
+
+def pick_rendition(urls, target):
+    by_name = {}
+    for url in urls:
+        stem, _, ext = url.rsplit("/", 1)[-1].rpartition(".")
+        if "~" in stem and ext.lower() in ("jpg", "jpeg", "png", "tif", "tiff"):
+            by_name[stem.rsplit("~", 1)[1]] = url
+    available = [(name, size) for name, size in NASA_RENDITIONS if name in by_name]
+    for name, size in available:
+        if size is None or size >= target:
+            return by_name[name]
+    return by_name[available[-1][0]] if available else None
+
+class NasaSource:
+    name = "nasa"
+    search_url = "https://images-api.nasa.gov/search"
+
+    def first_page(self, query):
+        return self.search_url, {"q": query, "media_type": "image", "page": 1, "page_size": PAGE_SIZE}
+
+    def parse_page(self, body, request):
+        collection = json.loads(body)["collection"]
+        items = []
+        for entry in collection.get("items", []):
+            data = (entry.get("data") or [{}])[0]
+            items.append({"source": self.name, "id": data.get("nasa_id"), "title": data.get("title"),
+                          "date": data.get("date_created"), "assets": entry.get("href")})
+        next_url = next((link["href"] for link in collection.get("links", []) if link.get("rel") == "next"), None)
+        return items, ((next_url, None) if next_url else None)
+
+    async def resolve(self, harvester, item):
+        assets = await harvester.get_json(self.name, item["assets"])
+        url = pick_rendition(assets, harvester.target)
+        return [dict(item, url=url)] if url else []
+
+class GallicaSource:
+    name = "gallica"
+    sru_url = "https://gallica.bnf.fr/SRU"
+    iiif_url = "https://gallica.bnf.fr/iiif"
+
+    def first_page(self, query):
+        return self.sru_url, {"operation": "searchRetrieve", "version": "1.2",
+                              "query": f'gallica all "{query}" and dc.type all "image"',
+                              "startRecord": 1, "maximumRecords": PAGE_SIZE}
+
+    def parse_page(self, body, request):
+        root = ET.fromstring(body)
+        items = []
+        for record in root.iter(f"{SRW}record"):
+            arks = [m.group(0) for e in record.iter(f"{DC}identifier")
+                    for m in [re.search(r"ark:/\d+/\w+", e.text or "")] if m]
+            if arks:
+                items.append({"source": self.name, "id": arks[0],
+                              "title": record.findtext(f".//{DC}title"), "date": record.findtext(f".//{DC}date")})
+        url, params = request
+        start = params["startRecord"] + params["maximumRecords"]
+        total = int(root.findtext(f"{SRW}numberOfRecords") or 0)
+        return items, ((url, dict(params, startRecord=start)) if items and start <= total else None)
+
+    async def resolve(self, harvester, item):
+        return await harvester.iiif_records(self.name, f"{self.iiif_url}/{item['id']}/manifest.json", item)
+
+class ArchiveSource:
+    name = "archive"
+    search_url = "https://archive.org/advancedsearch.php"
+    iiif_url = "https://iiif.archive.org/iiif"
+
+    def first_page(self, query):
+        return self.search_url, {"q": f"({query}) AND mediatype:(image)", "fl[]": ["identifier", "title", "date"],
+                                 "rows": PAGE_SIZE, "page": 1, "output": "json"}
+
+    def parse_page(self, body, request):
+        response = json.loads(body)["response"]
+        items = [{"source": self.name, "id": doc["identifier"], "title": doc.get("title"), "date": doc.get("date")}
+                 for doc in response.get("docs", [])]
+        url, params = request
+        more = items and params["page"] * params["rows"] < response.get("numFound", 0)
+        return items, ((url, dict(params, page=params["page"] + 1)) if more else None)
+
+    async def resolve(self, harvester, item):
+        return await harvester.iiif_records(self.name, f"{self.iiif_url}/{item['id']}/manifest.json", item)
+
+# images.nypl.org derivatives by long edge; "g" is the original
+NYPL_DERIVATIVES = [("r", 300), ("w", 760), ("q", 1600), ("v", 2560), ("g", None)]
+
+class NyplSource:
+    name = "nypl"
+    warper_url = "https://maps.nypl.org/warper"
+    images_url = "https://images.nypl.org/index.php"
+
+    def first_page(self, query):
+        return f"{self.warper_url}/maps.json", {"field": "title", "query": query, "page": 1, "per_page": PAGE_SIZE}
+
+    def parse_page(self, body, request):
+        data = json.loads(body)
+        items = [{"source": self.name, "id": m["id"], "title": m.get("title"), "date": m.get("date_depicted"),
+                  "digital_id": m.get("nypl_digital_id")}
+                 for m in data.get("items", [])]
+        url, params = request
+        more = items and params["page"] < data.get("total_pages", 0)
+        return items, ((url, dict(params, page=params["page"] + 1)) if more else None)
+
+    async def resolve(self, harvester, item):
+        if item.get("digital_id"):
+            code = next(code for code, size in NYPL_DERIVATIVES if size is None or size >= harvester.target)
+            url = f"{self.images_url}?id={item['digital_id']}&t={code}"
+        else:
+            url = f"{self.warper_url}/maps/{item['id']}/export?format=jpg"
+        return [dict(item, url=url)]
+
+SOURCES = {source.name: source for source in (NasaSource(), GallicaSource(), NyplSource(), ArchiveSource())}
+
+async def harvest_archives(sources, query, out_path=OUTPUT_PATH, images_dir=None, limit=None, max_pages=MAX_PAGES,
+                           target=TARGET_SIZE, max_canvases=MAX_CANVASES, concurrency=CONCURRENCY,
+                           record_dir=None, replay_dir=None):
+    server = None
+    if replay_dir:
+        server = FixtureServer(replay_dir)
+        await server.start()
+        for source in sources:
+            set_rate(source.name, 1000.0, 100)
+        print(f"📼 Replaying fixtures from {replay_dir}")
+
+    counts = {source.name: 0 for source in sources}
+    folder = os.path.dirname(out_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    try:
+        async with aiohttp.ClientSession(
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=60),
+            connector=aiohttp.TCPConnector(limit=concurrency * len(sources), limit_per_host=PER_HOST)
+        ) as session:
+            harvester = Harvester(session, target, max_canvases, images_dir,
+                                  server.url if server else None, record_dir)
+            with open(out_path, "a", encoding="utf-8") as out:
+                async def run(source):
+                    print(f"🔍 {source.name}: searching '{query}'")
+                    async for record in harvester.harvest(source, query, limit, max_pages, concurrency):
+                        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        counts[source.name] += 1
+                    print(f"✅ {source.name}: {counts[source.name]} records")
+
+                await asyncio.gather(*[run(source) for source in sources])
+    finally:
+        if server is not None:
+            await server.close()
+
+    print(f"🎉 {sum(counts.values())} records appended to {out_path}")
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Harvest images from NASA, Gallica, NYPL and archive.org")
+    parser.add_argument("query")
+    parser.add_argument("--source", action="append", choices=sorted(SOURCES),
+                        help="Repeat to pick sources (default: all)")
+    parser.add_argument("--out", default=OUTPUT_PATH)
+    parser.add_argument("--download", nargs="?", const=IMAGES_DIR, default=None, metavar="DIR",
+                        help=f"Also download the images (default dir: {IMAGES_DIR})")
+    parser.add_argument("--limit", type=int, default=None, help="Max search hits per source")
+    parser.add_argument("--pages", type=int, default=MAX_PAGES, help="Max search pages per source")
+    parser.add_argument("--target", type=int, default=TARGET_SIZE, help="Long edge to request, px")
+    parser.add_argument("--canvases", type=int, default=MAX_CANVASES, help="Pages taken from each IIIF item")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    fixtures = parser.add_mutually_exclusive_group()
+    fixtures.add_argument("--record", metavar="DIR", help="Store every response under DIR")
+    fixtures.add_argument("--replay", metavar="DIR", help="Serve responses from DIR instead of the network")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    metrics.start_run("archive_harvester")
+    sources = [SOURCES[name] for name in (args.source or SOURCES)]
+    asyncio.run(harvest_archives(
+        sources, args.query, args.out, args.download, args.limit, args.pages, args.target,
+        args.canvases, args.concurrency, args.record, args.replay
+    ))
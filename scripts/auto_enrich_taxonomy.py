@@ -1,8 +1,11 @@
 import os
-import json
-import time
 from dotenv import load_dotenv
 from groq import Groq
+from response_cache import cache
+from llm_batch import extract_json, is_gem_list
+from rate_limiter import with_rate_limit
+from metrics import metrics
+from gems_store import open_store
 
 load_dotenv()
 client = Groq(api_key=os.getenv("GROQ_API_KEY"))
@@ -10,6 +13,15 @@ client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 LANGUAGE = "Arabic"  # Change for other batches
 taxonomy_path = "../metadata/domain_image_gems.json"  # Update if path differs
 
+def request_image_gems(prompt):
+    res = client.chat.completions.create(
+        model="llama3-70b-8192",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.5
+    )
+    raw = res.choices[0].message.content.strip()
+    return extract_json(raw, expect=is_gem_list)
+
 def get_image_gems(Physics, Optics, Arabic):
     prompt = f"""
 You're helping build a rare image dataset. We need annotated images (text embedded in image) from rare sources.
@@ -28,33 +40,32 @@ Return in JSON format:
 ]
 """
     try:
-        res = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5
+        return cache.get_or_call(
+            "groq", "llama3-70b-8192", prompt, {"temperature": 0.5},
+            lambda: with_rate_limit("groq", request_image_gems, prompt)
         )
-        raw = res.choices[0].message.content.strip()
-        return json.loads(raw)
     except Exception as e:
         print(f"❌ Failed for {domain} > {subdomain}: {e}")
         return []
 
-def enrich_domains(data):
+def enrich_domains(store):
+    data = store.to_dict("nested")
     for domain, subdomains in data.items():
         for subdomain in subdomains:
             if isinstance(subdomains[subdomain], list) and not subdomains[subdomain]:  # only if empty
+                if store.has_gems((domain, subdomain)):  # filled by another run meanwhile
+                    continue
                 print(f"🔍 Enriching: {domain} > {subdomain}")
                 sources = get_image_gems(domain, subdomain, LANGUAGE)
-                data[domain][subdomain] = sources
-                time.sleep(3)
+                store.upsert_gems((domain, subdomain), sources, source="groq")
 
 if __name__ == "__main__":
-    with open(taxonomy_path, "r") as f:
-        data = json.load(f)
+    metrics.start_run("auto_enrich_taxonomy")
+    store = open_store(taxonomy_path)
 
-    enrich_domains(data)
+    enrich_domains(store)
 
-    with open(taxonomy_path, "w") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    store.export_json(taxonomy_path)
+    store.close()
 
-    print("✅ domain_image_gems.json updated successfully.")
\ No newline at end of file
+    print("✅ domain_image_gems.json updated successfully.")
@@ -0,0 +1,571 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from aiohttp import web
+from PIL import Image
+
+# Throughput benchmarks against local stand-ins for OpenRouter, SerpAPI, Groq,
+# Entrez and an image host, so enrichment and download speed can be measured
+# without API quota or live services. The fake services run in their own
+# process with configurable latency, 5xx and 429 injection; each scenario runs
+# in a fresh process that points the real code paths at them (through the
+# same *_URL / GROQ_BASE_URL variables used in production) with an empty
+# response cache. Reported per scenario: calls/s, client p50/p99 latency,
+# server requests/s (retries included), images/s, CPU time and peak RSS.
+# Every run is appended to RESULTS_PATH; --compare diffs the last two runs.
+
+RESULTS_PATH = "../benchmarks/results.jsonl"
+SCENARIOS = ["openrouter", "serpapi", "enrich_async", "keywords_batch", "groq", "entrez", "images"]
+COMPARE_METRICS = ["calls_per_s", "p50_ms", "p99_ms", "requests_per_s", "images_per_s", "peak_rss_mb"]
+LOWER_IS_BETTER = {"p50_ms", "p99_ms", "peak_rss_mb"}
+IMAGE_VARIANTS = 8
+HISTORY_COUNT = 100_000
+WORDS = ["manuscript", "diagram", "astrolabe", "optics", "lens", "scroll", "atlas", "chart",
+         "plate", "folio", "map", "anatomy", "geometry", "treatise", "illustration", "table"]
+
+# --- Fake services ---
+class FakeServices:
+    def __init__(self, latency=0.05, jitter=0.5, error_rate=0.0, throttle_rate=0.0, retry_after=0.0,
+                 image_size=(800, 600), images_per_search=10, figures_per_article=4):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.images_per_search = images_per_search
+        self.figures_per_article = figures_per_article
+        self.counts = {}
+        self.images = [self._make_image(image_size, seed) for seed in range(IMAGE_VARIANTS)]
+
+    @staticmethod
+    def _make_image(size, seed):
+        rng = np.random.default_rng(seed)
+        width, height = size
+        pixels = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(pixels).resize((width, height)).save(buf, "JPEG", quality=85)
+        return buf.getvalue()
+
+    def _count(self, route, status):
+        self.counts.setdefault(route, {}).setdefault(str(status), 0)
+        self.counts[route][str(status)] += 1
+
+    # Simulated latency, then maybe a 429 or a 500 instead of the real answer
+    async def _inject(self, route):
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+        roll = random.random()
+        if roll < self.throttle_rate:
+            self._count(route, 429)
+            return web.json_response({"error": "rate limited"}, status=429,
+                                     headers={"Retry-After": str(self.retry_after)})
+        if roll < self.throttle_rate + self.error_rate:
+            self._count(route, 500)
+            return web.json_response({"error": "injected failure"}, status=500)
+        self._count(route, 200)
+        return None
+
+    @staticmethod
+    def _keywords(n=5):
+        return [" ".join(random.sample(WORDS, 3)) for _ in range(n)]
+
+    # Plain keyword list, or one {"id", "result"} per numbered item of a batch prompt
+    def _answer(self, prompt):
+        if "\nItems:\n" not in prompt:
+            return json.dumps(self._keywords())
+        ids = []
+        for line in prompt.split("\nItems:\n", 1)[1].splitlines():
+            number = line.split(".", 1)[0]
+            if number.isdigit():
+                ids.append(int(number))
+        return json.dumps([{"id": i, "result": self._keywords()} for i in ids])
+
+    async def _chat(self, request, route):
+        failure = await self._inject(route)
+        if failure:
+            return failure
+        body = await request.json()
+        content = self._answer(body["messages"][-1]["content"])
+        model = body.get("model", "fake")
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for i in range(0, len(content), 64):
+            delta = {"choices": [{"index": 0, "delta": {"content": content[i:i + 64]}}]}
+            await response.write(f"data: {json.dumps(delta)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def openrouter(self, request):
+        return await self._chat(request, "openrouter")
+
+    async def groq(self, request):
+        return await self._chat(request, "groq")
+
+    async def serpapi(self, request):
+        failure = await self._inject("serpapi")
+        if failure:
+            return failure
+        base = f"{request.scheme}://{request.host}"
+        query = request.query.get("q", "")
+        tag = abs(hash(query)) % 10 ** 8
+        return web.json_response({"images_results": [
+            {"original": f"{base}/images/{tag}_{i}.jpg", "thumbnail": f"{base}/images/{tag}_{i}_t.jpg"}
+            for i in range(self.images_per_search)
+        ]})
+
+    async def esearch(self, request):
+        failure = await self._inject("entrez")
+        if failure:
+            return failure
+        if request.query.get("usehistory") == "y":
+            return web.Response(text=f"<eSearchResult><Count>{HISTORY_COUNT}</Count><QueryKey>1</QueryKey>"
+                                     f"<WebEnv>FAKE_{random.randrange(1_000_000)}</WebEnv></eSearchResult>",
+                                content_type="text/xml")
+        retmax = int(request.query.get("retmax", 20))
+        start = random.randrange(1_000_000, 9_000_000)
+        ids = "".join(f"<Id>{start + i}</Id>" for i in range(retmax))
+        return web.Response(text=f"<eSearchResult><Count>{retmax}</Count><IdList>{ids}</IdList></eSearchResult>",
+                            content_type="text/xml")
+
+    def _article(self, pmc_id):
+        figures = "".join(
+            f'<fig id="F{k}"><label>Figure {k}</label><caption><p>Figure {k} of {pmc_id}</p></caption>'
+            f'<graphic xlink:href="PMC{pmc_id}_f{k}.jpg"/></fig>'
+            for k in range(1, self.figures_per_article + 1)
+        )
+        return (f'<article xmlns:xlink="http://www.w3.org/1999/xlink"><front><article-meta>'
+                f'<article-id pub-id-type="pmc">{pmc_id}</article-id></article-meta></front>'
+                f'<body><sec>{figures}</sec></body></article>')
+
+    # Articles by id list, or by retstart / retmax over a history search
+    async def efetch(self, request):
+        failure = await self._inject("entrez")
+        if failure:
+            return failure
+        if "id" in request.query:
+            ids = request.query["id"].split(",")
+        else:
+            start = int(request.query.get("retstart", 0))
+            ids = [str(1_000_000 + i) for i in range(start, start + int(request.query.get("retmax", 20)))]
+        articles = "".join(self._article(pmc_id) for pmc_id in ids)
+        return web.Response(text=f"<pmc-articleset>{articles}</pmc-articleset>", content_type="text/xml")
+
+    async def image(self, request):
+        failure = await self._inject("images")
+        if failure:
+            return failure
+        data = self.images[abs(hash(request.path)) % len(self.images)]
+        return web.Response(body=data, content_type="image/jpeg")
+
+    async def stats(self, request):
+        return web.json_response(self.counts)
+
+    async def reset(self, request):
+        self.counts = {}
+        return web.json_response({})
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/openrouter/api/v1/chat/completions", self.openrouter)
+        app.router.add_post("/groq/openai/v1/chat/completions", self.groq)
+        app.router.add_get("/serpapi/search", self.serpapi)
+        app.router.add_get("/entrez/esearch.fcgi", self.esearch)
+        app.router.add_get("/entrez/efetch.fcgi", self.efetch)
+        app.router.add_get("/images/{name}", self.image)
+        app.router.add_get("/pmc/articles/{article}/bin/{name}", self.image)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_post("/_reset", self.reset)
+        return app
+
+def serve(config, conn):
+    async def main():
+        runner = web.AppRunner(FakeServices(**config).app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+        await site.start()
+        conn.send(runner.addresses[0][1])
+        await asyncio.Event().wait()
+    asyncio.run(main())
+
+def start_services(config):
+    parent, child = mp.Pipe()
+    process = mp.get_context("spawn").Process(target=serve, args=(config, child), daemon=True)
+    process.start()
+    port = parent.recv()
+    return process, f"http://127.0.0.1:{port}"
+
+# --- Measurement helpers ---
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+# Scenarios record from their worker threads, so every update takes the lock
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.ok = 0
+        self.failed = 0
+        self.images = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add_latency(self, elapsed):
+        with self._lock:
+            self.latencies.append(elapsed)
+
+    # A falsy result counts as a failure
+    def record(self, elapsed, result):
+        with self._lock:
+            self.latencies.append(elapsed)
+            if result:
+                self.ok += 1
+            else:
+                self.failed += 1
+
+    def call(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception:
+            result = None
+        self.record(time.perf_counter() - start, result)
+        return result
+
+    async def call_async(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            result = await fn(*args)
+        except Exception:
+            result = None
+        self.record(time.perf_counter() - start, result)
+        return result
+
+def run_threads(fn, items, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(fn, items))
+
+def subjects(n, nonce):
+    return [(f"Domain {nonce}-{i // 10}", f"Subdomain {i}") for i in range(n)]
+
+# --- Scenarios: each drives a real code path and fills a Recorder ---
+def bench_openrouter(rec, opts):
+    from enrich_domain_image_gems import fetch_keywords_from_openrouter, get_search_prompt
+    prompts = [get_search_prompt(domain, subdomain, "Arabic") for domain, subdomain in subjects(opts["calls"], opts["nonce"])]
+    run_threads(lambda prompt: rec.call(fetch_keywords_from_openrouter, prompt), prompts, opts["concurrency"])
+
+def bench_serpapi(rec, opts):
+    from enrich_domain_image_gems import fetch_images_from_serpapi
+    queries = [f"arabic manuscript {opts['nonce']} {i}" for i in range(opts["calls"])]
+    run_threads(lambda query: rec.call(fetch_images_from_serpapi, query), queries, opts["concurrency"])
+
+# The whole async enrichment (keywords, then every keyword search) per subdomain
+def bench_enrich_async(rec, opts):
+    import enrich_domain_image_gems as gems
+    original = gems.enrich_subdomain_async
+
+    async def timed(*args):
+        return await rec.call_async(original, *args)
+
+    gems.enrich_subdomain_async = timed
+    data = {}
+    for domain, subdomain in subjects(opts["calls"], opts["nonce"]):
+        data.setdefault(domain, {})[subdomain] = {}
+    asyncio.run(gems.enrich_data_async(data, opts["concurrency"], opts["concurrency"], opts["concurrency"]))
+
+def bench_keywords_batch(rec, opts):
+    from enrich_arabic_links import keyword_batcher
+    leaves = subjects(opts["calls"], opts["nonce"])
+    batcher = keyword_batcher()
+    batch = max(1, opts["batch_size"])
+    chunks = [leaves[i:i + batch] for i in range(0, len(leaves), batch)]
+
+    def run_chunk(chunk):
+        start = time.perf_counter()
+        results = batcher.run(chunk)
+        elapsed = time.perf_counter() - start
+        for result in results:
+            rec.record(elapsed, result)
+
+    run_threads(run_chunk, chunks, opts["concurrency"])
+
+def bench_groq(rec, opts):
+    from auto_enrich_taxonomy import get_image_gems
+    leaves = subjects(opts["calls"], opts["nonce"])
+    run_threads(lambda leaf: rec.call(get_image_gems, leaf[0], leaf[1], "Arabic"), leaves, opts["concurrency"])
+
+# pmc_harvester end to end: history esearch, batched streaming efetch and
+# concurrent figure downloads; each article is a call of the scenario
+def bench_entrez(rec, opts):
+    from pmc_harvester import harvest_pmc
+    with tempfile.TemporaryDirectory() as out_dir:
+        counts = harvest_pmc("annotated brain MRI", os.path.join(out_dir, "images"),
+                             os.path.join(out_dir, "figures.jsonl"), max_articles=opts["calls"],
+                             workers=opts["concurrency"])
+    rec.ok, rec.failed = counts["articles"], opts["calls"] - counts["articles"]
+    rec.images, rec.bytes = counts["saved"], counts["bytes"]
+
+def bench_images(rec, opts):
+    base = opts["base_url"]
+    urls = [f"{base}/images/{opts['nonce']}_{i}.jpg" for i in range(opts["calls"])]
+    download_images(rec, urls, opts, timed=True)
+    rec.ok, rec.failed = rec.images, len(urls) - rec.images
+
+# ImageDownloader + save_result, as the scrapers use them; with timed=True
+# every fetch is a call of the scenario
+def download_images(rec, urls, opts, min_size=300, max_aspect=4.0, timed=False):
+    from image_downloader import ImageDownloader, save_result
+    with tempfile.TemporaryDirectory() as out_dir:
+        with ImageDownloader(workers=opts["concurrency"], min_size=min_size, max_aspect=max_aspect) as downloader:
+            if timed:
+                fetch = downloader.fetch
+
+                def timed_fetch(url):
+                    start = time.perf_counter()
+                    result = fetch(url)
+                    rec.add_latency(time.perf_counter() - start)
+                    return result
+
+                downloader.fetch = timed_fetch
+            for i, result in enumerate(downloader.download_all(urls)):
+                if result.ok:
+                    save_result(result, os.path.join(out_dir, f"{i}.jpg"))
+                    rec.images += 1
+                    rec.bytes += len(result.content)
+
+BENCHMARKS = {
+    "openrouter": (bench_openrouter, ["openrouter"]),
+    "serpapi": (bench_serpapi, ["serpapi"]),
+    "enrich_async": (bench_enrich_async, ["openrouter", "serpapi"]),
+    "keywords_batch": (bench_keywords_batch, ["openrouter"]),
+    "groq": (bench_groq, ["groq"]),
+    "entrez": (bench_entrez, ["entrez"]),
+    "images": (bench_images, []),
+}
+
+# Runs in a fresh process so environment, imports, limiter state and peak RSS
+# belong to this scenario only
+def run_scenario(name, opts, conn):
+    base = opts["base_url"]
+    cache_dir = tempfile.mkdtemp(prefix="vqa-bench-")
+    os.environ.update({
+        "OPENROUTER_URL": f"{base}/openrouter/api/v1/chat/completions",
+        "SERPAPI_URL": f"{base}/serpapi/search",
+        "GROQ_BASE_URL": f"{base}/groq",
+        "ENTREZ_URL": f"{base}/entrez",
+        "PMC_ARTICLES_URL": f"{base}/pmc/articles",
+        "OPENROUTER_API_KEY": "bench", "SERPAPI_KEY": "bench", "GROQ_API_KEY": "bench",
+        "VQA_CACHE_PATH": os.path.join(cache_dir, "responses.sqlite"),
+    })
+    fn, providers = BENCHMARKS[name]
+    rec = Recorder()
+    try:
+        import rate_limiter
+        if opts["rate"]:
+            for provider in providers + ["entrez"]:
+                rate_limiter.set_rate(provider, opts["rate"], burst=opts["rate"])
+        output = io.StringIO()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if opts["verbose"] else output):
+            fn(rec, opts)
+        elapsed = time.perf_counter() - start
+    except ImportError as e:
+        conn.send({"skipped": f"{type(e).__name__}: {e}"})
+        return
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    calls = rec.ok + rec.failed
+    conn.send({
+        "calls": calls,
+        "ok": rec.ok,
+        "failed": rec.failed,
+        "elapsed_s": round(elapsed, 3),
+        "calls_per_s": round(calls / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(rec.latencies, 0.50) * 1000, 1) if rec.latencies else None,
+        "p99_ms": round(percentile(rec.latencies, 0.99) * 1000, 1) if rec.latencies else None,
+        "images": rec.images,
+        "images_per_s": round(rec.images / elapsed, 2) if rec.images else None,
+        "mb_per_s": round(rec.bytes / 1e6 / elapsed, 2) if rec.bytes else None,
+        "cpu_s": round(after.ru_utime + after.ru_stime - usage.ru_utime - usage.ru_stime, 2),
+        "peak_rss_mb": round(after.ru_maxrss / 1024, 1),  # KiB on Linux
+    })
+
+def run_benchmark(name, opts):
+    requests.post(f"{opts['base_url']}/_reset", timeout=10)
+    parent, child = mp.Pipe()
+    process = mp.get_context("spawn").Process(target=run_scenario, args=(name, opts, child))
+    process.start()
+    result = parent.recv() if parent.poll(opts["timeout"]) else {"skipped": "timed out"}
+    process.join(5)
+    if process.is_alive():
+        process.kill()
+
+    counts = requests.get(f"{opts['base_url']}/_stats", timeout=10).json()
+    if "skipped" not in result:
+        total = sum(sum(statuses.values()) for statuses in counts.values())
+        result.update({
+            "server_requests": total,
+            "requests_per_s": round(total / result["elapsed_s"], 2) if result["elapsed_s"] else None,
+            "throttled": sum(statuses.get("429", 0) for statuses in counts.values()),
+            "server_errors": sum(statuses.get("500", 0) for statuses in counts.values()),
+            "routes": counts,
+        })
+    return result
+
+# --- Results ---
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def save_run(path, run):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+
+def print_result(name, r):
+    if "skipped" in r:
+        print(f"⏩ {name:<15} skipped ({r['skipped']})")
+        return
+    images = f" | {r['images_per_s']} img/s, {r['mb_per_s']} MB/s" if r["images"] else ""
+    print(f"📊 {name:<15} {r['calls_per_s']:>8} calls/s | {r['requests_per_s']:>8} req/s | "
+          f"p50 {r['p50_ms']} ms, p99 {r['p99_ms']} ms | {r['failed']} failed, {r['throttled']} × 429, "
+          f"{r['server_errors']} × 5xx{images} | CPU {r['cpu_s']}s, peak RSS {r['peak_rss_mb']} MB")
+
+def find_run(runs, run_id):
+    for run in runs:
+        if run["run"] == run_id or run.get("label") == run_id:
+            return run
+    raise SystemExit(f"❌ No run '{run_id}' in the results file")
+
+def compare_runs(runs, baseline_id=None, current_id=None):
+    if len(runs) < 2 and not (baseline_id and current_id):
+        raise SystemExit("❌ Need at least two stored runs to compare")
+    current = find_run(runs, current_id) if current_id else runs[-1]
+    if baseline_id:
+        baseline = find_run(runs, baseline_id)
+    elif runs.index(current) > 0:
+        baseline = runs[runs.index(current) - 1]
+    else:
+        raise SystemExit(f"❌ No run before {current['run']} to compare against")
+    print(f"🔍 {baseline['run']} ({baseline.get('label') or baseline.get('commit')}) → "
+          f"{current['run']} ({current.get('label') or current.get('commit')})")
+    for name, new in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old or "skipped" in old or "skipped" in new:
+            continue
+        cells = []
+        for metric in COMPARE_METRICS:
+            before, after = old.get(metric), new.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            better = change < 0 if metric in LOWER_IS_BETTER else change > 0
+            mark = (" ✅" if better else " ⚠️") if abs(change) >= 5 else ""
+            cells.append(f"{metric} {before}→{after} ({change:+.0f}%){mark}")
+        print(f"   {name:<15} " + " | ".join(cells))
+
+def parse_size(value):
+    width, _, height = value.lower().partition("x")
+    return int(width), int(height)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark API and download paths against local fake services")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"Any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--calls", type=int, default=200, help="Calls (leaves, queries, articles, images) per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=25, help="Leaves per chunk for keywords_batch")
+    parser.add_argument("--latency", type=float, default=50, help="Mean fake service latency in ms")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Latency spread, as a fraction of the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--image-size", type=parse_size, default=(800, 600), metavar="WxH")
+    parser.add_argument("--rate", type=float, default=1000.0,
+                        help="Token bucket rate per provider (req/s); 0 keeps the production rates")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds before a scenario is abandoned")
+    parser.add_argument("--label", default=None, help="Name for this run in the results file")
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="Show the scripts' own output")
+    parser.add_argument("--compare", nargs="*", metavar="RUN",
+                        help="Compare stored runs (default: last two) instead of running")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"❌ Unknown scenario(s): {', '.join(sorted(unknown))}")
+    if args.compare is not None:
+        compare_runs(load_runs(args.results), *args.compare[:2])
+        sys.exit(0)
+
+    config = {
+        "latency": args.latency / 1000, "jitter": args.jitter, "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate, "retry_after": args.retry_after, "image_size": args.image_size,
+    }
+    services, base_url = start_services(config)
+    print(f"🚀 Fake services on {base_url} ({args.latency:.0f} ms ±{args.jitter:.0%}, "
+          f"{args.error_rate:.0%} 5xx, {args.throttle_rate:.0%} 429)")
+    opts = {
+        "base_url": base_url, "calls": args.calls, "concurrency": args.concurrency, "batch_size": args.batch_size,
+        "rate": args.rate, "timeout": args.timeout, "verbose": args.verbose, "nonce": f"{time.time():.0f}",
+    }
+
+    results = {}
+    try:
+        for name in args.scenarios or SCENARIOS:
+            results[name] = run_benchmark(name, opts)
+            print_result(name, results[name])
+    finally:
+        services.kill()
+
+    run = {
+        "run": time.strftime("%Y%m%d-%H%M%S"),
+        "label": args.label,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": dict(config, calls=args.calls, concurrency=args.concurrency, rate=args.rate,
+                       batch_size=args.batch_size),
+        "results": results,
+    }
+    if not args.no_save:
+        save_run(args.results, run)
+        print(f"✅ Saved run {run['run']} to {args.results}")
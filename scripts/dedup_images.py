@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Perceptual near-duplicate index for raw_images/[domain]/[subdomain]/[theme]
+# and scraped batch folders. pHash + dHash are computed in NumPy batches,
+# stored in SQLite, and queried through an in-memory BK-tree so new files
+# are compared against everything seen in earlier runs. Duplicates are
+# marked (duplicate_of) so the OCR stage can skip them.
+
+INDEX_PATH = "../metadata/image_hashes.sqlite"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+PHASH_RADIUS = 6
+DHASH_RADIUS = 10
+BATCH_SIZE = 256
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+DCT_32 = _dct_matrix(32)
+
+def _pack_bits(bits):
+    # (N, 64) bool -> list of 64-bit ints
+    packed = np.packbits(bits.reshape(len(bits), -1), axis=1)
+    return [int.from_bytes(row.tobytes(), "big") for row in packed]
+
+def phash_batch(gray32):
+    # gray32: (N, 32, 32) float32
+    coeffs = np.einsum("ij,njk,lk->nil", DCT_32, gray32, DCT_32)[:, :8, :8].reshape(len(gray32), 64)
+    median = np.median(coeffs[:, 1:], axis=1, keepdims=True)
+    return _pack_bits(coeffs > median)
+
+def dhash_batch(gray9x8):
+    # gray9x8: (N, 8, 9) -> compare horizontally adjacent pixels
+    return _pack_bits(gray9x8[:, :, 1:] > gray9x8[:, :, :-1])
+
+def load_thumbnails(path):
+    with Image.open(path) as img:
+        size = img.size
+        # JPEG draft mode lets libjpeg downscale in the DCT domain
+        img.draft("L", (64, 64))
+        gray = img.convert("L")
+        small32 = np.asarray(gray.resize((32, 32), Image.BILINEAR), dtype=np.float32)
+        small9 = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return size, small32, small9
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            d = hamming(value, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (value, item, {})
+                return
+            node = child
+
+    def query(self, value, radius):
+        found = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.append((d, node[1]))
+            for dist, child in node[2].items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        return sorted(found)
+
+class HashIndex:
+    def __init__(self, path=INDEX_PATH):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime REAL,
+                width INTEGER,
+                height INTEGER,
+                phash TEXT,
+                dhash TEXT,
+                duplicate_of TEXT
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_images_dup ON images(duplicate_of)")
+        self.conn.commit()
+
+        # Tree items are (path, phash); a node counts only while that phash is
+        # still the path's current one, so re-hashed files leave no stale match
+        self.tree = BKTree()
+        self.hashes = {}
+        self.seen = {}
+        for path, size, mtime, phash, dhash, dup in self.conn.execute(
+            "SELECT path, size, mtime, phash, dhash, duplicate_of FROM images"
+        ):
+            self.seen[path] = (size, mtime)
+            if dup is None:
+                self.tree.add(int(phash, 16), (path, int(phash, 16)))
+                self.hashes[path] = (int(phash, 16), int(dhash, 16))
+
+    def is_current(self, path, stat):
+        return self.seen.get(path) == (stat.st_size, stat.st_mtime)
+
+    def find_duplicate(self, path, phash, dhash, phash_radius=PHASH_RADIUS, dhash_radius=DHASH_RADIUS):
+        for _, (match, value) in self.tree.query(phash, phash_radius):
+            current = self.hashes.get(match)
+            if match == path or current is None or current[0] != value:
+                continue
+            if hamming(dhash, current[1]) <= dhash_radius:
+                return match
+        return None
+
+    def add(self, path, stat, width, height, phash, dhash, duplicate_of):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime, width, height,
+             f"{phash:016x}", f"{dhash:016x}", duplicate_of)
+        )
+        self.seen[path] = (stat.st_size, stat.st_mtime)
+        if duplicate_of is None:
+            self.tree.add(phash, (path, phash))
+            self.hashes[path] = (phash, dhash)
+        else:
+            self.hashes.pop(path, None)
+
+    def duplicate_of(self, path):
+        row = self.conn.execute("SELECT duplicate_of FROM images WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else None
+
+    def duplicates(self):
+        return {path for (path,) in self.conn.execute(
+            "SELECT path FROM images WHERE duplicate_of IS NOT NULL"
+        )}
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+# Paths flagged as near-duplicates, for stages that should skip them (e.g. OCR)
+def load_duplicates(index_path=INDEX_PATH):
+    if not os.path.exists(index_path):
+        return set()
+    index = HashIndex(index_path)
+    try:
+        return index.duplicates()
+    finally:
+        index.close()
+
+def iter_image_files(roots):
+    for root_dir in roots:
+        for root, _, files in os.walk(root_dir):
+            for fname in sorted(files):
+                if fname.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.abspath(os.path.join(root, fname))
+
+def _load(path):
+    try:
+        return path, os.stat(path), load_thumbnails(path)
+    except Exception as e:
+        print(f"❌ Error reading {path}: {e}")
+        return path, None, None
+
+def process_batch(index, paths, pool, phash_radius, dhash_radius):
+    loaded = [item for item in pool.map(_load, paths) if item[2] is not None]
+    if not loaded:
+        return 0, 0
+    # Largest images first so the best copy in a batch becomes the canonical one
+    loaded.sort(key=lambda item: item[2][0][0] * item[2][0][1], reverse=True)
+
+    phashes = phash_batch(np.stack([thumbs[1] for _, _, thumbs in loaded]))
+    dhashes = dhash_batch(np.stack([thumbs[2] for _, _, thumbs in loaded]))
+
+    duplicates = 0
+    for (path, stat, thumbs), phash, dhash in zip(loaded, phashes, dhashes):
+        match = index.find_duplicate(path, phash, dhash, phash_radius, dhash_radius)
+        if match is not None:
+            duplicates += 1
+        width, height = thumbs[0]
+        index.add(path, stat, width, height, phash, dhash, match)
+    index.commit()
+    return len(loaded), duplicates
+
+def dedup_folders(roots, index_path=INDEX_PATH, phash_radius=PHASH_RADIUS,
+                  dhash_radius=DHASH_RADIUS, batch_size=BATCH_SIZE, workers=os.cpu_count()):
+    index = HashIndex(index_path)
+    hashed = duplicates = skipped = 0
+    batch = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path in iter_image_files(roots):
+            try:
+                if index.is_current(path, os.stat(path)):
+                    skipped += 1
+                    continue
+            except OSError:
+                continue
+            batch.append(path)
+            if len(batch) >= batch_size:
+                n, d = process_batch(index, batch, pool, phash_radius, dhash_radius)
+                hashed += n
+                duplicates += d
+                batch = []
+                print(f"🔁 Hashed {hashed} images, {duplicates} near-duplicates so far")
+        if batch:
+            n, d = process_batch(index, batch, pool, phash_radius, dhash_radius)
+            hashed += n
+            duplicates += d
+
+    index.close()
+    print(f"✅ Hashed {hashed} new images ({skipped} unchanged), {duplicates} marked as near-duplicates")
+    return hashed, duplicates
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mark perceptual near-duplicate images before OCR")
+    parser.add_argument("folders", nargs="*", default=["../raw_images"])
+    parser.add_argument("--index", default=INDEX_PATH)
+    parser.add_argument("--phash-radius", type=int, default=PHASH_RADIUS)
+    parser.add_argument("--dhash-radius", type=int, default=DHASH_RADIUS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    dedup_folders(args.folders, args.index, args.phash_radius, args.dhash_radius, args.batch_size)
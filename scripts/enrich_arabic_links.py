@@ -1,19 +1,44 @@
 import os
-import json
+import argparse
 import requests
 from dotenv import load_dotenv
+from response_cache import cache
+from rate_limiter import with_rate_limit
+from enrich_journal import LeafJournal
+from taxonomy_index import load_index
+from metrics import metrics
+from llm_batch import BatchPrompter, extract_json, is_string_list, openrouter_stream, MAX_BATCH, OPENROUTER_URL
 
 # Load API keys
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 SERPAPI_KEY = os.getenv("SERPAPI_KEY")
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search")
 
 LINK_DATASET_PATH = "../metadata/link_dataset.json"
 OUTPUT_PATH = "../metadata/domain_image_gems_arabic.json"
+JOURNAL_PATH = "../metadata/domain_image_gems_arabic.journal.jsonl"
 
 # OpenRouter Keyword Generator
-def generate_keywords(domain, subdomain):
-    prompt = f"""You are helping build a rare Arabic image dataset.
+def request_keywords(prompt):
+    response = requests.post(
+        OPENROUTER_URL,
+        headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        json={
+            "model": "openai/gpt-3.5-turbo",
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.7
+        }
+    )
+    response.raise_for_status()
+    content = response.json()["choices"][0]["message"]["content"]
+    return extract_json(content, expect=is_string_list)
+
+def keyword_prompt(domain, subdomain):
+    return f"""You are helping build a rare Arabic image dataset.
 Suggest 3–5 search keywords in English that could retrieve Arabic-language diagrams or illustrations related to:
 
 - Domain: {domain}
@@ -22,74 +47,114 @@ Suggest 3–5 search keywords in English that could retrieve Arabic-language dia
 The output must be a JSON list like:
 ["Arabic optics manuscript", "historical Arabic physics diagrams", "Islamic optics texts"]"""
 
+KEYWORD_BATCH_INSTRUCTIONS = """You are helping build a rare Arabic image dataset.
+For each item below, suggest 3–5 search keywords in English that could retrieve Arabic-language diagrams or illustrations related to its domain and subdomain.
+The result for each item must be a JSON list like:
+["Arabic optics manuscript", "historical Arabic physics diagrams", "Islamic optics texts"]"""
+
+def generate_keywords(domain, subdomain):
+    prompt = keyword_prompt(domain, subdomain)
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": "openai/gpt-3.5-turbo",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.7
-            }
+        return cache.get_or_call(
+            "openrouter", "openai/gpt-3.5-turbo", prompt, {"temperature": 0.7},
+            lambda: with_rate_limit("openrouter", request_keywords, prompt)
         )
-        response.raise_for_status()
-        content = response.json()["choices"][0]["message"]["content"]
-        return json.loads(content.strip())
     except Exception as e:
         print(f"❌ OpenRouter error for {domain} > {subdomain}: {e}")
         return []
 
 # SerpAPI Image Fetcher
+def request_images_from_serpapi(query):
+    params = {
+        "engine": "google",
+        "q": query,
+        "tbm": "isch",
+        "api_key": SERPAPI_KEY
+    }
+    response = requests.get(SERPAPI_URL, params=params)
+    response.raise_for_status()
+    return {"images_results": response.json().get("images_results", [])}
+
 def fetch_images_from_serpapi(query):
     try:
-        params = {
-            "engine": "google",
-            "q": query,
-            "tbm": "isch",
-            "api_key": SERPAPI_KEY
-        }
-        response = requests.get("https://serpapi.com/search", params=params)
-        response.raise_for_status()
-        images = response.json().get("images_results", [])[:5]
+        results = cache.get_or_call(
+            "serpapi", "google", query, {"tbm": "isch"},
+            lambda: with_rate_limit("serpapi", request_images_from_serpapi, query)
+        )
+        images = results.get("images_results", [])[:5]
         return [{"url": img["original"], "desc": f"Image for query: {query}"} for img in images]
     except Exception as e:
         print(f"❌ SerpAPI error for '{query}': {e}")
         return []
 
-# Recursive Enrichment
-def enrich_links(data, out_data, path=[]):
-    for key, value in data.items():
-        if isinstance(value, dict) and value == {}:
-            domain, subdomain = path[0], " > ".join(path[1:] + [key])
-            print(f"🔍 {domain} > {subdomain}")
+# One streamed OpenRouter call generates keywords for a whole batch of leaves
+def keyword_batcher(max_batch=MAX_BATCH):
+    return BatchPrompter(
+        "openrouter", "openai/gpt-3.5-turbo", openrouter_stream, KEYWORD_BATCH_INSTRUCTIONS,
+        describe=lambda leaf: f"Domain: {leaf[0]} | Subdomain: {leaf[1]}",
+        single_prompt=lambda leaf: keyword_prompt(*leaf),
+        single=lambda leaf: generate_keywords(*leaf),
+        params={"temperature": 0.7},
+        max_batch=max_batch,
+    )
+
+# Leaf Enrichment
+def enrich_links(index, journal, done=frozenset(), batch_size=MAX_BATCH):
+    leaves = index.pending_leaves(done)
+    paths = [index.path(leaf) for leaf in leaves]
+    batcher = keyword_batcher(batch_size) if batch_size > 1 else None
+
+    # One keyword batch at a time, journaled before the next is prompted,
+    # so an interrupted run keeps every leaf it already paid for
+    chunk = max(1, batch_size)
+    for start in range(0, len(paths), chunk):
+        chunk_paths = paths[start:start + chunk]
+        subjects = [(path[0], " > ".join(path[1:])) for path in chunk_paths]
+        with metrics.timer("stage", stage="keywords"):
+            if batcher:
+                keyword_lists = batcher.run(subjects)
+            else:
+                keyword_lists = [generate_keywords(domain, subdomain) for domain, subdomain in subjects]
+
+        for leaf_path, keywords in zip(chunk_paths, keyword_lists):
+            leaf_key = " > ".join(leaf_path)
+            print(f"🔍 {leaf_key}")
 
-            keywords = generate_keywords(domain, subdomain)
             images = []
-            for kw in keywords:
-                images.extend(fetch_images_from_serpapi(kw))
-
-            # Create nested path
-            curr = out_data
-            for p in path + [key]:
-                curr = curr.setdefault(p, {})
-            curr["image_gems"] = images
-
-        elif isinstance(value, dict):
-            enrich_links(value, out_data, path + [key])
+            with metrics.timer("stage", stage="search"):
+                for kw in keywords:
+                    images.extend(fetch_images_from_serpapi(kw))
+
+            journal.append(leaf_key, leaf_path, images)
+            metrics.count("leaves", result="found" if images else "empty")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Enrich link_dataset.json leaves with SerpAPI image gems")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip leaves already recorded in the journal")
+    parser.add_argument("--compact-only", action="store_true",
+                        help="Only rebuild the output JSON from the journal")
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH,
+                        help="Max leaves per keyword prompt; 1 sends one prompt per leaf")
+    return parser.parse_args()
 
 def main():
-    with open(LINK_DATASET_PATH, "r", encoding="utf-8") as f:
-        link_data = json.load(f)
-
-    enriched_data = {}
-    enrich_links(link_data, enriched_data)
-
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(enriched_data, f, indent=2, ensure_ascii=False)
-
+    args = parse_args()
+    metrics.start_run("enrich_arabic_links")
+    journal = LeafJournal(args.journal)
+
+    if not args.compact_only:
+        index = load_index(LINK_DATASET_PATH)
+        done = set()
+        if args.resume:
+            done = journal.completed()
+            print(f"⏩ Resuming: {len(done)} leaves already in journal")
+        else:
+            journal.reset()
+        enrich_links(index, journal, done, args.batch_size)
+
+    journal.compact_nested(OUTPUT_PATH)
     print(f"\n🎉 Arabic enrichment complete → {OUTPUT_PATH}")
 
 if __name__ == "__main__":
@@ -1,7 +1,15 @@
 import os
-import json
+import asyncio
+import argparse
+import aiohttp
 import requests
 from dotenv import load_dotenv
+from response_cache import cache
+from llm_batch import extract_json, is_string_list
+from rate_limiter import with_rate_limit, with_rate_limit_async
+from metrics import metrics
+from gems_store import open_store
+from work_queue import WorkQueue, Worker, QUEUE_PATH, RETRY_DELAY
 
 # Load API keys
 load_dotenv()
@@ -11,6 +19,24 @@ SERPAPI_KEY = os.getenv("SERPAPI_KEY")
 TAXONOMY_PATH = "./domain_image_gems.json"
 LANGUAGE = "Arabic"
 
+# Endpoints can be overridden to point at a local stand-in server
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search")
+
+OPENROUTER_MODELS = [
+    "openchat/openchat-3.5-0106",
+    "openai/gpt-3.5-turbo"
+]
+
+# Cache key for image searches: everything but the query and the API key
+SERPAPI_ENGINE = "google"
+SERPAPI_CACHE_PARAMS = {"tbm": "isch"}
+
+# Async mode limits: total in-flight requests, then per provider
+MAX_CONCURRENCY = 32
+OPENROUTER_CONCURRENCY = 8
+SERPAPI_CONCURRENCY = 16
+
 def get_search_prompt(domain, subdomain, language):
     return f"""
 You're helping build a rare image dataset. Suggest 5 creative and unusual image search keyword ideas for:
@@ -23,77 +49,100 @@ Output JSON list like:
 ["Arabic optics manuscripts", "Ibn al-Haytham diagrams", "historical physics scrolls in Arabic"]
 """
 
-def fetch_keywords_from_openrouter(prompt):
-    headers = {
+def openrouter_headers():
+    return {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json"
     }
 
-    models = [
-        "openchat/openchat-3.5-0106",
-        "openai/gpt-3.5-turbo"
+def serpapi_params(query):
+    params = {
+        "engine": SERPAPI_ENGINE,
+        "q": query,
+        "tbm": "isch",
+        "api_key": SERPAPI_KEY
+    }
+    # aiohttp rejects None values, requests silently drops them
+    return {k: v for k, v in params.items() if v is not None}
+
+def parse_serpapi_images(results, query):
+    images = results.get("images_results", [])[:5]
+    return [
+        {
+            "url": img.get("original") or img.get("thumbnail"),
+            "desc": f"Image for query: {query}"
+        }
+        for img in images if img.get("original") or img.get("thumbnail")
     ]
 
-    for model in models:
+# Raises on any failure so only good responses end up in the cache
+def request_keywords_from_openrouter(headers, model, prompt):
+    res = requests.post(
+        OPENROUTER_URL,
+        headers=headers,
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}]
+        },
+        timeout=30
+    )
+    res.raise_for_status()
+    data = res.json()
+    if "choices" not in data:
+        raise ValueError("missing 'choices' key")
+    content = data["choices"][0]["message"]["content"]
+    return extract_json(content, expect=is_string_list)
+
+def fetch_keywords_from_openrouter(prompt):
+    headers = openrouter_headers()
+
+    for model in OPENROUTER_MODELS:
         try:
             print(f"🔁 Trying model: {model}")
-            res = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": prompt}]
-                },
-                timeout=30
+            return cache.get_or_call(
+                "openrouter", model, prompt, None,
+                lambda: with_rate_limit("openrouter", request_keywords_from_openrouter, headers, model, prompt)
             )
-            res.raise_for_status()
-            data = res.json()
-            if "choices" not in data:
-                continue
-            content = data["choices"][0]["message"]["content"]
-            return json.loads(content.strip())
         except Exception as e:
             print(f"❌ OpenRouter error: {e}")
             continue
 
     return []
 
+def request_images_from_serpapi(query):
+    response = requests.get(SERPAPI_URL, params=serpapi_params(query))
+    response.raise_for_status()
+    return {"images_results": response.json().get("images_results", [])}
+
+# Raises on failure; queue tasks use it so a failed search is retried instead
+# of being recorded as done with no images
+def search_images_from_serpapi(query):
+    results = cache.get_or_call(
+        "serpapi", SERPAPI_ENGINE, query, SERPAPI_CACHE_PARAMS,
+        lambda: with_rate_limit("serpapi", request_images_from_serpapi, query)
+    )
+    return parse_serpapi_images(results, query)
+
 def fetch_images_from_serpapi(query):
     try:
-        params = {
-            "engine": "google",
-            "q": query,
-            "tbm": "isch",
-            "api_key": SERPAPI_KEY
-        }
-        response = requests.get("https://serpapi.com/search", params=params)
-        response.raise_for_status()
-        results = response.json()
-        images = results.get("images_results", [])[:5]
-
-        return [
-            {
-                "url": img.get("original") or img.get("thumbnail"),
-                "desc": f"Image for query: {query}"
-            }
-            for img in images if img.get("original") or img.get("thumbnail")
-        ]
-
+        return search_images_from_serpapi(query)
     except Exception as e:
         print(f"❌ SerpAPI error for query '{query}': {e}")
         return []
 
-def enrich_domain_image_gems():
+# Each subdomain is upserted into the SQLite store as soon as it is enriched, so
+# runs in parallel never clobber each other; the JSON is exported at the end
+def enrich_domain_image_gems(taxonomy_path=TAXONOMY_PATH):
     try:
-        with open(TAXONOMY_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        store = open_store(taxonomy_path)
+        data = store.to_dict("nested")
     except Exception as e:
         print("❌ Failed to read taxonomy file:", e)
         return
 
     for domain, subdomains in data.items():
-        for subdomain, content in subdomains.items():
-            if isinstance(content, dict) and "image_gems" in content and content["image_gems"]:
+        for subdomain in subdomains:
+            if store.has_gems((domain, subdomain)):
                 print(f"✅ Already enriched: {domain} > {subdomain} — Skipping.")
                 continue
 
@@ -113,15 +162,226 @@ def enrich_domain_image_gems():
                     all_images.extend(images)
 
             if all_images:
-                data[domain][subdomain]["image_gems"] = all_images
+                store.upsert_gems((domain, subdomain), all_images, source="serpapi", replace=True)
                 print(f"✅ Added {len(all_images)} images to {domain} > {subdomain}")
             else:
                 print(f"⚠️ No valid images found for {domain} > {subdomain}")
 
-    with open(TAXONOMY_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    store.export_json(taxonomy_path)
+    store.close()
+
+    print("🎉 Finished enriching all subdomains.")
+
+# --- Async mode ---
+# Every subdomain runs at once; requests are bounded by one global semaphore
+# plus one per provider, and each provider keeps its own pooled session.
+class ProviderLimits:
+    def __init__(self, concurrency, openrouter_concurrency, serpapi_concurrency):
+        self.total = asyncio.Semaphore(concurrency)
+        self.openrouter = asyncio.Semaphore(openrouter_concurrency)
+        self.serpapi = asyncio.Semaphore(serpapi_concurrency)
+
+async def request_keywords_from_openrouter_async(session, limits, model, prompt):
+    async with limits.openrouter, limits.total:
+        async with session.post(
+            OPENROUTER_URL,
+            json={
+                "model": model,
+                "messages": [{"role": "user", "content": prompt}]
+            }
+        ) as res:
+            res.raise_for_status()
+            data = await res.json(content_type=None)
+    if "choices" not in data:
+        raise ValueError("missing 'choices' key")
+    content = data["choices"][0]["message"]["content"]
+    return extract_json(content, expect=is_string_list)
+
+async def fetch_keywords_from_openrouter_async(session, limits, prompt):
+    for model in OPENROUTER_MODELS:
+        try:
+            return await cache.get_or_call_async(
+                "openrouter", model, prompt, None,
+                lambda: with_rate_limit_async(
+                    "openrouter", request_keywords_from_openrouter_async, session, limits, model, prompt
+                )
+            )
+        except Exception as e:
+            print(f"❌ OpenRouter error ({model}): {e}")
+            continue
+
+    return []
+
+async def request_images_from_serpapi_async(session, limits, query):
+    async with limits.serpapi, limits.total:
+        async with session.get(SERPAPI_URL, params=serpapi_params(query)) as response:
+            response.raise_for_status()
+            results = await response.json(content_type=None)
+    return {"images_results": results.get("images_results", [])}
+
+async def fetch_images_from_serpapi_async(session, limits, query):
+    try:
+        results = await cache.get_or_call_async(
+            "serpapi", SERPAPI_ENGINE, query, SERPAPI_CACHE_PARAMS,
+            lambda: with_rate_limit_async("serpapi", request_images_from_serpapi_async, session, limits, query)
+        )
+        return parse_serpapi_images(results, query)
+    except Exception as e:
+        print(f"❌ SerpAPI error for query '{query}': {e}")
+        return []
+
+async def enrich_subdomain_async(openrouter, serpapi, limits, domain, subdomain):
+    print(f"🔍 Enriching {domain} > {subdomain}...")
+
+    prompt = get_search_prompt(domain, subdomain, LANGUAGE)
+    keywords = await fetch_keywords_from_openrouter_async(openrouter, limits, prompt)
+    if not keywords:
+        print(f"⚠️ No keywords for {domain} > {subdomain}. Skipping.")
+        return []
+
+    results = await asyncio.gather(*[
+        fetch_images_from_serpapi_async(serpapi, limits, kw) for kw in keywords
+    ])
+    return [img for images in results for img in images]
+
+# With a store, each subdomain's results are upserted into it as soon as that
+# subdomain finishes, as well as written into data
+async def enrich_data_async(data, concurrency=MAX_CONCURRENCY,
+                            openrouter_concurrency=OPENROUTER_CONCURRENCY,
+                            serpapi_concurrency=SERPAPI_CONCURRENCY, store=None):
+    limits = ProviderLimits(concurrency, openrouter_concurrency, serpapi_concurrency)
+    timeout = aiohttp.ClientTimeout(total=30)
+
+    pending = []
+    for domain, subdomains in data.items():
+        for subdomain, content in subdomains.items():
+            if isinstance(content, dict) and "image_gems" in content and content["image_gems"]:
+                print(f"✅ Already enriched: {domain} > {subdomain} — Skipping.")
+                continue
+            pending.append((domain, subdomain))
+
+    async def enrich_and_save(openrouter, serpapi, domain, subdomain):
+        all_images = await enrich_subdomain_async(openrouter, serpapi, limits, domain, subdomain)
+        if not all_images:
+            print(f"⚠️ No valid images found for {domain} > {subdomain}")
+            return
+        if isinstance(data[domain][subdomain], dict):
+            data[domain][subdomain]["image_gems"] = all_images
+        else:
+            data[domain][subdomain] = all_images
+        if store is not None:
+            store.upsert_gems((domain, subdomain), all_images, source="serpapi", replace=True)
+        print(f"✅ Added {len(all_images)} images to {domain} > {subdomain}")
+
+    async with aiohttp.ClientSession(
+        headers=openrouter_headers(),
+        timeout=timeout,
+        connector=aiohttp.TCPConnector(limit=openrouter_concurrency)
+    ) as openrouter, aiohttp.ClientSession(
+        timeout=timeout,
+        connector=aiohttp.TCPConnector(limit=serpapi_concurrency)
+    ) as serpapi:
+        await asyncio.gather(*[
+            enrich_and_save(openrouter, serpapi, domain, subdomain)
+            for domain, subdomain in pending
+        ])
+
+    return data
+
+def enrich_domain_image_gems_async(taxonomy_path=TAXONOMY_PATH, concurrency=MAX_CONCURRENCY,
+                                   openrouter_concurrency=OPENROUTER_CONCURRENCY,
+                                   serpapi_concurrency=SERPAPI_CONCURRENCY):
+    try:
+        store = open_store(taxonomy_path)
+        data = store.to_dict("nested")
+    except Exception as e:
+        print("❌ Failed to read taxonomy file:", e)
+        return
+
+    asyncio.run(enrich_data_async(
+        data, concurrency, openrouter_concurrency, serpapi_concurrency, store
+    ))
+
+    store.export_json(taxonomy_path)
+    store.close()
 
     print("🎉 Finished enriching all subdomains.")
 
+# --- Queue mode ---
+# Leaves and their keyword searches are tasks in a shared work queue, so any
+# number of workers, on this box or others sharing the directory, split the
+# taxonomy without doing a leaf twice. A leaf task asks for keywords and queues
+# one search task per keyword; a search appends its images to the leaf.
+def leaf_key(path):
+    return " > ".join(path)
+
+def enqueue_leaves(store, queue):
+    data = store.to_dict("nested")
+    leaves = [[domain, subdomain] for domain, subdomains in data.items() for subdomain in subdomains]
+    return queue.add("leaves", [(leaf_key(path), {"path": path}) for path in leaves if not store.has_gems(path)])
+
+def run_leaf_task(queue, task):
+    domain, subdomain = task.payload["path"]
+    print(f"🔍 Enriching {domain} > {subdomain}...")
+    keywords = fetch_keywords_from_openrouter(get_search_prompt(domain, subdomain, LANGUAGE))
+    if not keywords:
+        raise ValueError("no keywords")
+    queue.add("queries", [(f"{task.key} | {kw}", {"path": task.payload["path"], "query": str(kw)})
+                          for kw in keywords])
+    return len(keywords)
+
+def run_query_task(store, task):
+    print(f"🔎 Searching for: {task.payload['query']}")
+    images = search_images_from_serpapi(task.payload["query"])
+    if images:
+        store.upsert_gems(task.payload["path"], images, source="serpapi")
+    return len(images)
+
+def enrich_domain_image_gems_queue(taxonomy_path=TAXONOMY_PATH, queue_path=QUEUE_PATH, retry_delay=RETRY_DELAY):
+    store = open_store(taxonomy_path)
+    queue = WorkQueue(queue_path)
+    added = enqueue_leaves(store, queue)
+    print(f"🧭 Queued {added} new leaves in {queue_path}")
+
+    # Searches first, so each leaf's queries finish before more leaves are opened
+    with Worker(queue, ("queries", "leaves"), retry_delay=retry_delay) as worker:
+        for task in worker.tasks():
+            try:
+                if task.kind == "leaves":
+                    result = run_leaf_task(queue, task)
+                else:
+                    result = run_query_task(store, task)
+                worker.done(task, result)
+            except Exception as e:
+                print(f"❌ {task.key}: {e}")
+                worker.failed(task, e)
+
+    store.export_json(taxonomy_path)
+    store.close()
+    queue.close()
+    print("🎉 Queue drained: " + ", ".join(f"{n} {name}" for name, n in worker.counts.items()))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Enrich domain_image_gems.json via OpenRouter + SerpAPI")
+    parser.add_argument("--taxonomy", default=TAXONOMY_PATH)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run all subdomains and keyword searches concurrently")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--openrouter-concurrency", type=int, default=OPENROUTER_CONCURRENCY)
+    parser.add_argument("--serpapi-concurrency", type=int, default=SERPAPI_CONCURRENCY)
+    parser.add_argument("--queue", nargs="?", const=QUEUE_PATH, default=None,
+                        help="Pull leaves from a shared work queue; run as many workers as you like")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    enrich_domain_image_gems()
\ No newline at end of file
+    args = parse_args()
+    metrics.start_run("enrich_domain_image_gems")
+    if args.queue:
+        enrich_domain_image_gems_queue(args.taxonomy, args.queue)
+    elif args.use_async:
+        enrich_domain_image_gems_async(
+            args.taxonomy, args.concurrency,
+            args.openrouter_concurrency, args.serpapi_concurrency
+        )
+    else:
+        enrich_domain_image_gems(args.taxonomy)
\ No newline at end of file
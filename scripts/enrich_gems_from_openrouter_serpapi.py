@@ -1,12 +1,17 @@
 import os
-import json
 import requests
 from dotenv import load_dotenv
+from response_cache import cache
+from llm_batch import extract_json, is_string_list, OPENROUTER_URL
+from rate_limiter import with_rate_limit
+from metrics import metrics
+from gems_store import open_store
 
 # Load environment variables
 load_dotenv()
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 SERPAPI_KEY = os.getenv("SERPAPI_KEY")
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search")
 
 # Editable parameters
 TAXONOMY_PATH = "./domain_image_gems.json"
@@ -28,6 +33,24 @@ Output JSON list like:
 """
 
 # Use OpenRouter to generate keyword list
+def request_keywords_from_openrouter(headers, model, prompt):
+    res = requests.post(
+        OPENROUTER_URL,
+        headers=headers,
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}]
+        },
+        timeout=30
+    )
+    res.raise_for_status()
+    data = res.json()
+    if "choices" not in data:
+        raise ValueError("OpenRouter missing 'choices' key.")
+
+    content = data["choices"][0]["message"]["content"]
+    return extract_json(content, expect=is_string_list)
+
 def fetch_keywords_from_openrouter(prompt):
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -42,23 +65,10 @@ def fetch_keywords_from_openrouter(prompt):
     for model in models:
         try:
             print(f"🔁 Trying model: {model}")
-            res = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": prompt}]
-                },
-                timeout=30
+            return cache.get_or_call(
+                "openrouter", model, prompt, None,
+                lambda: with_rate_limit("openrouter", request_keywords_from_openrouter, headers, model, prompt)
             )
-            res.raise_for_status()
-            data = res.json()
-            if "choices" not in data:
-                print("❌ OpenRouter missing 'choices' key.")
-                continue
-
-            content = data["choices"][0]["message"]["content"]
-            return json.loads(content.strip())
         except Exception as e:
             print(f"❌ OpenRouter error: {e}")
             continue
@@ -66,17 +76,23 @@ def fetch_keywords_from_openrouter(prompt):
     return []
 
 # Use SerpAPI to search for images
+def request_images_from_serpapi(query):
+    params = {
+        "engine": "google",
+        "q": query,
+        "tbm": "isch",
+        "api_key": SERPAPI_KEY
+    }
+    response = requests.get(SERPAPI_URL, params=params)
+    response.raise_for_status()
+    return {"images_results": response.json().get("images_results", [])}
+
 def fetch_images_from_serpapi(query):
     try:
-        params = {
-            "engine": "google",
-            "q": query,
-            "tbm": "isch",
-            "api_key": SERPAPI_KEY
-        }
-        response = requests.get("https://serpapi.com/search", params=params)
-        response.raise_for_status()
-        results = response.json()
+        results = cache.get_or_call(
+            "serpapi", "google", query, {"tbm": "isch"},
+            lambda: with_rate_limit("serpapi", request_images_from_serpapi, query)
+        )
         images = results.get("images_results", [])[:5]
 
         return [
@@ -91,18 +107,14 @@ def fetch_images_from_serpapi(query):
         print(f"❌ SerpAPI error for query '{query}':", e)
         return []
 
-# Update domain_image_gems.json
+# Update domain_image_gems.json: upsert the node in its SQLite store, then export
 def update_json_file(domain, subdomain, image_gems):
+    store = open_store(TAXONOMY_PATH)
     try:
-        with open(TAXONOMY_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except Exception:
-        data = {}
-
-    data.setdefault(domain, {}).setdefault(subdomain, {})["image_gems"] = image_gems
-
-    with open(TAXONOMY_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+        store.upsert_gems((domain, subdomain), image_gems, source="serpapi", replace=True)
+        store.export_json(TAXONOMY_PATH)
+    finally:
+        store.close()
 
     print(f"✅ Updated {domain} > {subdomain} successfully with {len(image_gems)} images.")
     print("👉 File saved at:", os.path.abspath(TAXONOMY_PATH))
@@ -130,4 +142,5 @@ def main():
         print("⚠️ No valid images found.")
 
 if __name__ == "__main__":
+    metrics.start_run("enrich_gems_from_openrouter_serpapi")
     main()
\ No newline at end of file
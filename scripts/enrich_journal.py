@@ -0,0 +1,114 @@
+import os
+import json
+
+# Append-only JSONL journal for taxonomy enrichment runs.
+# Each finished leaf is written (and fsynced) as one line, so a crash loses at
+# most the leaf in progress; --resume skips every leaf already journaled and
+# compaction turns the journal into the final JSON without holding it all in memory.
+# A torn last line left by a killed run is cut off before the first append of
+# the next one, so the new record is not glued onto it.
+
+class LeafJournal:
+    def __init__(self, path):
+        self.path = path
+        self._tail_checked = False
+
+    def reset(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        open(self.path, "w", encoding="utf-8").close()
+        self._tail_checked = True
+
+    # Truncate back to the last newline; returns the number of bytes dropped
+    def repair_tail(self, chunk_size=64 * 1024):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                start = max(0, end - chunk_size)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+        return size - end
+
+    def append(self, key, path, images):
+        if not self._tail_checked:
+            self.repair_tail()
+            self._tail_checked = True
+        line = json.dumps({"key": key, "path": path, "images": images}, ensure_ascii=False)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # key -> byte offset of its latest line, in first-seen order.
+    # A torn last line from a killed run is ignored.
+    def _index(self):
+        offsets = {}
+        if not os.path.exists(self.path):
+            return offsets
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    offsets[record["key"]] = offset
+                except (ValueError, KeyError):
+                    pass
+                offset += len(line)
+        return offsets
+
+    def completed(self):
+        return set(self._index())
+
+    def records(self):
+        offsets = self._index()
+        if not offsets:
+            return
+        with open(self.path, "rb") as f:
+            for offset in offsets.values():
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+    # {"A > B > C": [...images]} written entry by entry, same layout as json.dump(indent=2)
+    def compact_flat(self, output_path, skip_empty=True):
+        tmp_path = output_path + ".tmp"
+        count = 0
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            out.write("{")
+            for record in self.records():
+                if skip_empty and not record["images"]:
+                    continue
+                entry = json.dumps({record["key"]: record["images"]}, indent=2, ensure_ascii=False)
+                out.write(("," if count else "") + "\n" + entry[2:-2])
+                count += 1
+            out.write("\n}" if count else "}")
+        os.replace(tmp_path, output_path)
+        return count
+
+    # Nested {domain: {...: {leaf: {"image_gems": [...]}}}} shape
+    def compact_nested(self, output_path):
+        data = {}
+        count = 0
+        for record in self.records():
+            curr = data
+            for p in record["path"]:
+                curr = curr.setdefault(p, {})
+            curr["image_gems"] = record["images"]
+            count += 1
+
+        tmp_path = output_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, output_path)
+        return count
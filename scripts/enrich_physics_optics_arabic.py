@@ -1,8 +1,11 @@
 import os
-import json
-import re
 from dotenv import load_dotenv
 from groq import Groq
+from response_cache import cache
+from llm_batch import extract_json, is_gem_list
+from rate_limiter import with_rate_limit
+from metrics import metrics
+from gems_store import open_store
 
 # Load your .env credentials
 load_dotenv()
@@ -14,19 +17,19 @@ LANGUAGE = "Arabic"
 DOMAIN = "Physics"
 SUBDOMAIN = "Optics"
 
-# --- Helper to extract valid JSON from LLM response ---
-def extract_json_block(text):
-    try:
-        match = re.search(r"\[\s*{.*?}\s*\]", text, re.DOTALL)
-        if match:
-            return json.loads(match.group(0))
-        else:
-            raise ValueError("No valid JSON array found in the response.")
-    except Exception as e:
-        print(f"❌ JSON extraction error: {e}")
-        return []
-
 # --- Call Groq API with prompt ---
+def request_image_gems(prompt):
+    res = client.chat.completions.create(
+        model="llama3-70b-8192",
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.5
+    )
+    content = res.choices[0].message.content.strip()
+    image_gems = extract_json(content, expect=is_gem_list)
+    if not is_gem_list(image_gems):
+        raise ValueError("No image_gems in the response.")
+    return image_gems
+
 def get_image_gems(domain, subdomain, language):
     prompt = f"""
 You're helping build a rare image dataset. We need annotated images (text embedded in the image) from rare sources.
@@ -45,38 +48,27 @@ Return in JSON format only:
 ]
 """
     try:
-        res = client.chat.completions.create(
-            model="llama3-70b-8192",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.5
+        return cache.get_or_call(
+            "groq", "llama3-70b-8192", prompt, {"temperature": 0.5},
+            lambda: with_rate_limit("groq", request_image_gems, prompt)
         )
-        content = res.choices[0].message.content.strip()
-        return extract_json_block(content)
     except Exception as e:
         print(f"❌ Error while fetching image_gems: {e}")
         return []
 
 # --- Update the taxonomy JSON file ---
 def update_json_file():
-    with open(taxonomy_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     print(f"🔍 Enriching {DOMAIN} > {SUBDOMAIN} in {LANGUAGE}...")
     image_links = get_image_gems(DOMAIN, SUBDOMAIN, LANGUAGE)
 
     if image_links:
-        if DOMAIN not in data:
-            data[DOMAIN] = {}
-        if SUBDOMAIN not in data[DOMAIN]:
-            data[DOMAIN][SUBDOMAIN] = {}
-
-        # Add language-specific image gems
-        data[DOMAIN][SUBDOMAIN][LANGUAGE] = {
-            "image_gems": image_links
-        }
-
-        with open(taxonomy_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        store = open_store(taxonomy_path)
+        try:
+            # Add language-specific image gems
+            store.upsert_gems((DOMAIN, SUBDOMAIN), image_links, language=LANGUAGE, source="groq", replace=True)
+            store.export_json(taxonomy_path)
+        finally:
+            store.close()
 
         print(f"✅ Updated {DOMAIN} > {SUBDOMAIN} in {LANGUAGE}.")
     else:
@@ -84,4 +76,5 @@ def update_json_file():
 
 # --- Run script ---
 if __name__ == "__main__":
+    metrics.start_run("enrich_physics_optics_arabic")
     update_json_file()
\ No newline at end of file
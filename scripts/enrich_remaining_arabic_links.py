@@ -1,10 +1,15 @@
 import os
-import json
-import time
+import argparse
 import requests
 from dotenv import load_dotenv
 from bs4 import BeautifulSoup
 import urllib.parse
+from response_cache import cache
+from rate_limiter import with_rate_limit
+from enrich_journal import LeafJournal
+from taxonomy_index import load_index
+from metrics import metrics
+from llm_batch import BatchPrompter, extract_json, is_string_list, openrouter_stream, MAX_BATCH, OPENROUTER_URL
 
 # Load API keys
 load_dotenv()
@@ -13,13 +18,40 @@ OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 # Paths
 TAXONOMY_PATH = "../metadata/link_dataset.json"
 OUTPUT_PATH = "../metadata/arabic_image_links.json"
+JOURNAL_PATH = "../metadata/arabic_image_links.journal.jsonl"
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"
 }
 
-def generate_keywords(domain, subdomain):
-    prompt = f"""
+def request_keywords(model, prompt):
+    res = requests.post(
+        OPENROUTER_URL,
+        headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": 0.7
+        },
+        timeout=30
+    )
+    res.raise_for_status()
+    data = res.json()
+    if "choices" not in data:
+        raise ValueError(f"No 'choices' in response: {data}")
+    content = data["choices"][0]["message"]["content"].strip()
+    return extract_json(content, expect=is_string_list)
+
+KEYWORD_MODELS = [
+    "openai/gpt-3.5-turbo",
+    "mistralai/mistral-7b-instruct"
+]
+
+def keyword_prompt(domain, subdomain):
+    return f"""
 Generate 3 to 5 creative Arabic search queries to find image-based resources (illustrations, diagrams, manuscripts) on:
 Domain: {domain}
 Subdomain: {subdomain}
@@ -28,40 +60,33 @@ Return only JSON array like:
 ["arabic {subdomain.lower()} illustrations", "arabic {subdomain.lower()} historical manuscripts"]
 """
 
-    models = [
-        "openai/gpt-3.5-turbo",
-        "mistralai/mistral-7b-instruct"
-    ]
+KEYWORD_BATCH_INSTRUCTIONS = """
+Generate 3 to 5 creative Arabic search queries to find image-based resources (illustrations, diagrams, manuscripts) for each item below.
+The result for each item must be a JSON array like:
+["arabic <subdomain> illustrations", "arabic <subdomain> historical manuscripts"]
+""".strip()
 
-    for model in models:
+def generate_keywords(domain, subdomain):
+    prompt = keyword_prompt(domain, subdomain)
+    for model in KEYWORD_MODELS:
         try:
-            res = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": model,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "temperature": 0.7
-                },
-                timeout=30
+            return cache.get_or_call(
+                "openrouter", model, prompt, {"temperature": 0.7},
+                lambda: with_rate_limit("openrouter", request_keywords, model, prompt)
             )
-            data = res.json()
-            if "choices" not in data:
-                print(f"❌ No 'choices' in response:", data)
-                continue
-            content = data["choices"][0]["message"]["content"].strip()
-            return json.loads(content)
         except Exception as e:
             print(f"❌ OpenRouter error ({model}): {e}")
     return []
 
+def request_google_images(search_url):
+    response = requests.get(search_url, headers=HEADERS, timeout=10)
+    response.raise_for_status()
+    return response
+
 def google_image_scrape(query, limit=5):
     try:
         search_url = f"https://www.google.com/search?tbm=isch&q={urllib.parse.quote(query)}"
-        response = requests.get(search_url, headers=HEADERS, timeout=10)
+        response = with_rate_limit("google", request_google_images, search_url)
         soup = BeautifulSoup(response.text, "html.parser")
         images = soup.select("img")
         urls = []
@@ -76,42 +101,78 @@ def google_image_scrape(query, limit=5):
         print(f"❌ Google scrape failed for '{query}':", e)
         return []
 
-def load_taxonomy(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+# One streamed call generates queries for a whole batch of leaves
+def keyword_batcher(max_batch=MAX_BATCH):
+    return BatchPrompter(
+        "openrouter", KEYWORD_MODELS[0], openrouter_stream, KEYWORD_BATCH_INSTRUCTIONS,
+        describe=lambda leaf: f"Domain: {leaf[0]} | Subdomain: {leaf[1]}",
+        single_prompt=lambda leaf: keyword_prompt(*leaf),
+        single=lambda leaf: generate_keywords(*leaf),
+        params={"temperature": 0.7},
+        max_batch=max_batch,
+    )
+
+def enrich_leaves(index, journal, done=frozenset(), batch_size=MAX_BATCH):
+    paths = [index.path(leaf) for leaf in index.pending_leaves(done)]
+    batcher = keyword_batcher(batch_size) if batch_size > 1 else None
 
-def save_output(data):
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    # One keyword batch at a time, journaled before the next is prompted,
+    # so an interrupted run keeps every leaf it already paid for
+    chunk = max(1, batch_size)
+    for start in range(0, len(paths), chunk):
+        chunk_paths = paths[start:start + chunk]
+        subjects = [(path[-2] if len(path) > 1 else "", path[-1]) for path in chunk_paths]
+        with metrics.timer("stage", stage="keywords"):
+            if batcher:
+                keyword_lists = batcher.run(subjects)
+            else:
+                keyword_lists = [generate_keywords(domain, subdomain) for domain, subdomain in subjects]
 
-def recursive_enrich(node, path, output):
-    for key, value in node.items():
-        current_path = path + [key]
-        if not value:  # Leaf node
+        for current_path, keywords in zip(chunk_paths, keyword_lists):
             domain_path = " > ".join(current_path)
             print(f"🔍 Enriching: {domain_path}")
 
-            keywords = generate_keywords(current_path[-2] if len(current_path) > 1 else "", key)
             all_images = []
-            for kw in keywords:
-                images = google_image_scrape(kw)
-                all_images.extend(images)
-                time.sleep(1)
+            with metrics.timer("stage", stage="search"):
+                for kw in keywords:
+                    images = google_image_scrape(kw)
+                    all_images.extend(images)
 
+            journal.append(domain_path, current_path, all_images)
+            metrics.count("leaves", result="found" if all_images else "empty")
             if all_images:
-                output[domain_path] = all_images
                 print(f"✅ Saved {len(all_images)} images for {domain_path}")
             else:
                 print(f"⚠️ No images found for {domain_path}")
-        else:
-            recursive_enrich(value, current_path, output)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape Arabic image links for every taxonomy leaf")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip leaves already recorded in the journal")
+    parser.add_argument("--compact-only", action="store_true",
+                        help="Only rebuild the output JSON from the journal")
+    parser.add_argument("--journal", default=JOURNAL_PATH)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH,
+                        help="Max leaves per keyword prompt; 1 sends one prompt per leaf")
+    return parser.parse_args()
 
 def main():
-    taxonomy = load_taxonomy(TAXONOMY_PATH)
-    enriched_data = {}
-    recursive_enrich(taxonomy, [], enriched_data)
-    save_output(enriched_data)
-    print("🎉 All done.")
+    args = parse_args()
+    metrics.start_run("enrich_remaining_arabic_links")
+    journal = LeafJournal(args.journal)
+
+    if not args.compact_only:
+        index = load_index(TAXONOMY_PATH)
+        done = set()
+        if args.resume:
+            done = journal.completed()
+            print(f"⏩ Resuming: {len(done)} leaves already in journal")
+        else:
+            journal.reset()
+        enrich_leaves(index, journal, done, args.batch_size)
+
+    count = journal.compact_flat(OUTPUT_PATH)
+    print(f"🎉 All done. {count} leaves written to {OUTPUT_PATH}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,11 @@
 import os
 from dotenv import load_dotenv
 from groq import Groq
+from rate_limiter import with_rate_limit
+from metrics import metrics
 
 load_dotenv()
+metrics.start_run("fetch_sources_groq")
 
 api_key = os.getenv("GROQ_API_KEY")
 if not api_key:
@@ -37,7 +40,9 @@ Return only in JSON format like this:
 ]
 """
 
-chat_completion = client.chat.completions.create(
+chat_completion = with_rate_limit(
+    "groq",
+    client.chat.completions.create,
     messages=[{"role": "user", "content": prompt}],
     model="llama3-70b-8192"
 )
@@ -0,0 +1,472 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+# SQLite store for image gems, so enrichment scripts stop rewriting the whole
+# gems JSON on every update. Taxonomy nodes, languages and gems are tables;
+# a gem is unique per (node, language, url) and is upserted on that index.
+# That dedup is intended: the same URL listed twice under one node is one
+# image, so seeding collapses such repeats (keeping the first position and
+# the last description) and reports how many it dropped.
+# Every write is one BEGIN IMMEDIATE transaction and the database runs in WAL
+# mode, so several enrichment processes can write while others read.
+# The JSON files stay the interchange format: open_store() seeds a store from
+# its JSON on first use, and export_json() writes it back on demand in the
+# shapes in use: nested "image_gems" dicts, per-language dicts and bare lists
+# (all three mixed within one file, remembered per node), or flat "A > B" keys.
+# The store remembers the mtime of every JSON it read or wrote. open_store()
+# re-reads a JSON that changed since (e.g. rewritten by an enrich journal) and
+# takes its contents, and export_json() refuses to overwrite one that changed
+# behind its back.
+
+SEP = " > "
+LAYOUTS = ("nested", "flat")
+# Language keys used by enrich_physics_optics_arabic: {..: {"Arabic": {"image_gems": [...]}}}
+LANGUAGES = {"Arabic", "English", "French", "Spanish", "Portuguese", "German", "Korean", "Japanese", "Chinese"}
+GEM_FIELDS = ("url", "desc")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER REFERENCES nodes(id),
+    name TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'dict'
+);
+CREATE INDEX IF NOT EXISTS nodes_parent ON nodes(parent_id, position);
+CREATE TABLE IF NOT EXISTS languages (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS gems (
+    id INTEGER PRIMARY KEY,
+    node_id INTEGER NOT NULL REFERENCES nodes(id),
+    language_id INTEGER NOT NULL REFERENCES languages(id),
+    url TEXT NOT NULL,
+    description TEXT,
+    extra TEXT,
+    position INTEGER NOT NULL,
+    source TEXT,
+    added REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (node_id, language_id, url)
+);
+CREATE INDEX IF NOT EXISTS gems_url ON gems(url);
+"""
+
+UPSERT_SQL = """
+INSERT INTO gems (node_id, language_id, url, description, extra, position, source, added, updated)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (node_id, language_id, url) DO UPDATE SET
+    description = excluded.description,
+    extra = COALESCE(excluded.extra, gems.extra),
+    source = COALESCE(excluded.source, gems.source),
+    position = {position},
+    updated = excluded.updated
+"""
+
+# <stem>.gems.sqlite next to the JSON file it mirrors
+def store_path(json_path):
+    return os.path.splitext(json_path)[0] + ".gems.sqlite"
+
+def detect_layout(data):
+    return "flat" if isinstance(data, dict) and any(SEP in key for key in data) else "nested"
+
+def write_json(path, data):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"  # several processes may export at once
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+class GemsStore:
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly below
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._nodes = {}
+        self._languages = {}
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                self._nodes.clear()
+                self._languages.clear()
+                raise
+            self.conn.execute("COMMIT")
+
+    # One snapshot for several SELECTs, without blocking writers
+    @contextmanager
+    def _read(self):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield
+            finally:
+                self.conn.execute("COMMIT")
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    # mtime (ns) of a JSON file when the store last read or wrote it
+    def _synced(self, json_path):
+        value = self._meta("synced:" + os.path.abspath(json_path))
+        return int(value) if value is not None else None
+
+    def _set_synced(self, json_path):
+        self._set_meta("synced:" + os.path.abspath(json_path), str(os.stat(json_path).st_mtime_ns))
+
+    def _changed_since_sync(self, json_path):
+        if not os.path.exists(json_path):
+            return False
+        synced = self._synced(json_path)
+        return synced is None or os.stat(json_path).st_mtime_ns > synced
+
+    @property
+    def layout(self):
+        with self._lock:
+            return self._meta("layout") or "nested"
+
+    # Node id for a path, creating missing ancestors in sibling order.
+    # kind is how the node is written in nested JSON: a "dict", a dict that always has
+    # an "image_gems" key ("gems"), or a bare "list" of gems.
+    def _node_id(self, path, kind=None):
+        parent = None
+        for depth in range(1, len(path) + 1):
+            key = SEP.join(path[:depth])
+            node_id = self._nodes.get(key)
+            if node_id is None:
+                row = self.conn.execute("SELECT id FROM nodes WHERE path = ?", (key,)).fetchone()
+                if row is None:
+                    position = self.conn.execute(
+                        "SELECT COALESCE(MAX(position) + 1, 0) FROM nodes WHERE parent_id IS ?", (parent,)
+                    ).fetchone()[0]
+                    node_id = self.conn.execute(
+                        "INSERT INTO nodes (parent_id, name, path, position) VALUES (?, ?, ?, ?)",
+                        (parent, path[depth - 1], key, position)
+                    ).lastrowid
+                else:
+                    node_id = row[0]
+                self._nodes[key] = node_id
+            parent = node_id
+        if kind is not None and path:
+            self.conn.execute("UPDATE nodes SET kind = ? WHERE id = ? AND kind != ?", (kind, parent, kind))
+        return parent
+
+    def _language_id(self, language):
+        name = language or ""
+        if name not in self._languages:
+            self.conn.execute("INSERT OR IGNORE INTO languages (name) VALUES (?)", (name,))
+            self._languages[name] = self.conn.execute(
+                "SELECT id FROM languages WHERE name = ?", (name,)
+            ).fetchone()[0]
+        return self._languages[name]
+
+    def _upsert(self, path, gems, language, source, replace):
+        node_id = self._node_id(path)
+        language_id = self._language_id(language)
+        gems = [gem for gem in gems if isinstance(gem, dict) and gem.get("url")]
+        if replace:
+            keep = {gem["url"] for gem in gems}
+            stale = [(gem_id,) for gem_id, url in self.conn.execute(
+                "SELECT id, url FROM gems WHERE node_id = ? AND language_id = ?", (node_id, language_id)
+            ) if url not in keep]
+            self.conn.executemany("DELETE FROM gems WHERE id = ?", stale)
+            start = 0
+        else:
+            start = self.conn.execute(
+                "SELECT COALESCE(MAX(position) + 1, 0) FROM gems WHERE node_id = ? AND language_id = ?",
+                (node_id, language_id)
+            ).fetchone()[0]
+
+        now = time.time()
+        rows = []
+        first = {}
+        for i, gem in enumerate(gems):
+            extra = {k: v for k, v in gem.items() if k not in GEM_FIELDS}
+            rows.append((node_id, language_id, gem["url"], gem.get("desc"),
+                         json.dumps(extra, ensure_ascii=False) if extra else None,
+                         start + first.setdefault(gem["url"], i), source, now, now))
+        # A replace takes the new order (a repeated URL keeps its first place);
+        # an append leaves existing gems where they are
+        position = "excluded.position" if replace else "gems.position"
+        self.conn.executemany(UPSERT_SQL.format(position=position), rows)
+        return len(rows)
+
+    # Add or update gems of one node; replace=True also drops gems missing from `gems`
+    def upsert_gems(self, path, gems, language=None, source=None, replace=False):
+        with self._write():
+            return self._upsert(tuple(path), gems, language, source, replace)
+
+    def ensure_node(self, path):
+        with self._write():
+            return self._node_id(tuple(path))
+
+    def gems(self, path, language=None):
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT g.url, g.description, g.extra FROM gems g
+                JOIN nodes n ON n.id = g.node_id
+                JOIN languages l ON l.id = g.language_id
+                WHERE n.path = ? AND l.name = ?
+                ORDER BY g.position
+            """, (SEP.join(path), language or "")).fetchall()
+        return [_gem(*row) for row in rows]
+
+    def has_gems(self, path, language=None):
+        return bool(self.gems(path, language))
+
+    def leaves(self):
+        with self._lock:
+            rows = self.conn.execute("""
+                SELECT path FROM nodes n
+                WHERE NOT EXISTS (SELECT 1 FROM nodes c WHERE c.parent_id = n.id)
+                ORDER BY id
+            """).fetchall()
+        return [tuple(path.split(SEP)) for (path,) in rows]
+
+    # Set extra[key] = annotate(url) on every gem for which it returns a value;
+    # returns the number of gems annotated
+    def annotate(self, key, annotate):
+        with self._write():
+            now = time.time()
+            updates = []
+            for gem_id, url, extra in self.conn.execute("SELECT id, url, extra FROM gems").fetchall():
+                value = annotate(url)
+                if value is not None:
+                    fields = json.loads(extra) if extra else {}
+                    fields[key] = value
+                    updates.append((json.dumps(fields, ensure_ascii=False), now, gem_id))
+            self.conn.executemany("UPDATE gems SET extra = ?, updated = ? WHERE id = ?", updates)
+            return len(updates)
+
+    def stats(self):
+        with self._read():
+            return {
+                "nodes": self.conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0],
+                "languages": self.conn.execute("SELECT COUNT(*) FROM languages WHERE name != ''").fetchone()[0],
+                "gems": self.conn.execute("SELECT COUNT(*) FROM gems").fetchone()[0],
+                "urls": self.conn.execute("SELECT COUNT(DISTINCT url) FROM gems").fetchone()[0],
+            }
+
+    # With replace=True each node/language gem set read takes the file's contents;
+    # `seen` then collects the node paths and (path, language) gem sets read.
+    def _import(self, data, path, language, source, replace=False, seen=None):
+        count = 0
+
+        def upsert(gems, language):
+            if seen is not None:
+                seen["gems"].add((SEP.join(path), language or ""))
+            return self._upsert(path, gems, language, source, replace)
+
+        if path and seen is not None:
+            seen["paths"].add(path)
+        if isinstance(data, list):
+            self._node_id(path, "list")
+            count += upsert(data, language)
+        elif isinstance(data, dict):
+            if path:
+                self._node_id(path, "gems" if "image_gems" in data else "dict")
+            # {"Arabic": {"image_gems": ...}} is a translation only when no sibling is a plain
+            # subtopic; taxonomy nodes such as "Languages" have children named English, French...
+            by_language = bool(path) and all(key == "image_gems" or key in LANGUAGES for key in data)
+            for key, value in data.items():
+                if key == "image_gems":
+                    count += upsert(value, language)
+                elif by_language and isinstance(value, dict) and "image_gems" in value:
+                    count += upsert(value["image_gems"], key)
+                else:
+                    count += self._import(value, path + tuple(key.split(SEP)), language, source, replace, seen)
+        return count
+
+    # Drop the gem sets, nodes and languages a replacing import did not read
+    def _prune(self, seen):
+        keep = {SEP.join(path[:depth]) for path in seen["paths"] for depth in range(1, len(path) + 1)}
+        stale_gems = [(gem_id,) for gem_id, path, language in self.conn.execute("""
+            SELECT g.id, n.path, l.name FROM gems g
+            JOIN nodes n ON n.id = g.node_id
+            JOIN languages l ON l.id = g.language_id
+        """).fetchall() if (path, language) not in seen["gems"]]
+        self.conn.executemany("DELETE FROM gems WHERE id = ?", stale_gems)
+        stale_nodes = [(node_id,) for node_id, path in self.conn.execute("SELECT id, path FROM nodes").fetchall()
+                       if path not in keep]
+        self.conn.executemany("DELETE FROM nodes WHERE id = ?", stale_nodes)
+        self.conn.execute("DELETE FROM languages WHERE id NOT IN (SELECT DISTINCT language_id FROM gems)")
+        self._nodes.clear()
+        self._languages.clear()
+        return len(stale_gems)
+
+    # Load a gems JSON of any layout; returns the number of gems read
+    def import_data(self, data, layout=None, language=None, source=None):
+        with self._write():
+            if self._meta("layout") is None:
+                self._set_meta("layout", layout or detect_layout(data))
+            if self._meta("seeded") is None:
+                self._set_meta("seeded", "import")
+            return self._import(data, (), language, source)
+
+    # Seed an empty store from its JSON file, once; safe when several processes start together.
+    # Returns the number of gems read; repeats of a URL within a node are stored once.
+    def seed(self, json_path, layout=None):
+        with self._write():
+            if self._meta("seeded") is not None:
+                return 0
+            count = 0
+            if os.path.exists(json_path):
+                with open(json_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                layout = layout or detect_layout(data)
+                count = self._import(data, (), None, "import")
+                self._set_synced(json_path)
+            self._set_meta("layout", layout or "nested")
+            self._set_meta("seeded", json_path)
+            return count
+
+    # Re-read a JSON rewritten since the store last synced with it. The file is
+    # authoritative: gems, nodes and languages missing from it are dropped, while
+    # gems still in it keep their annotations. Returns the number of gems read.
+    def refresh(self, json_path):
+        with self._write():
+            if not self._changed_since_sync(json_path):
+                return 0
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            seen = {"paths": set(), "gems": set()}
+            count = self._import(data, (), None, "import", replace=True, seen=seen)
+            self._prune(seen)
+            self._set_synced(json_path)
+            return count
+
+    def to_dict(self, layout=None):
+        layout = layout or self.layout
+        with self._read():
+            nodes = self.conn.execute(
+                "SELECT id, parent_id, name, path, kind FROM nodes ORDER BY parent_id, position"
+            ).fetchall()
+            rows = self.conn.execute("""
+                SELECT g.node_id, l.name, g.url, g.description, g.extra FROM gems g
+                JOIN languages l ON l.id = g.language_id
+                ORDER BY g.node_id, l.id, g.position
+            """).fetchall()
+
+        children = {}
+        kinds = {}
+        for node_id, parent_id, name, path, kind in nodes:
+            children.setdefault(parent_id, []).append((node_id, name, path))
+            kinds[node_id] = kind
+        gems = {}
+        for node_id, language, url, description, extra in rows:
+            gems.setdefault(node_id, {}).setdefault(language, []).append(_gem(url, description, extra))
+
+        def merged(node_id):
+            return [gem for items in gems.get(node_id, {}).values() for gem in items]
+
+        def nested(node_id):
+            if kinds[node_id] == "list" and node_id not in children:
+                return merged(node_id)
+            out = {}
+            by_language = gems.get(node_id, {})
+            if "" in by_language or kinds[node_id] == "gems":
+                out["image_gems"] = by_language.get("", [])
+            for child_id, name, _ in children.get(node_id, []):
+                out[name] = nested(child_id)
+            for language, items in by_language.items():
+                if language:
+                    out[language] = {"image_gems": items}
+            return out
+
+        if layout == "flat":
+            return {path: merged(node_id) for node_id, _, path in
+                    sorted((n for group in children.values() for n in group), key=lambda n: n[0])
+                    if gems.get(node_id)}
+        return {name: nested(node_id) for node_id, name, _ in children.get(None, [])}
+
+    # Write the store in a JSON layout (the seeded file's by default); returns the exported data.
+    # Raises ValueError when the file changed since the store last read or wrote it.
+    def export_json(self, path, layout=None):
+        data = self.to_dict(layout)
+        with self._write():
+            synced = self._synced(path)
+            if synced is not None and os.path.exists(path) and os.stat(path).st_mtime_ns > synced:
+                raise ValueError(f"{path} changed since {self.path} last synced with it; "
+                                 f"open it with open_store() to reload it first")
+            write_json(path, data)
+            self._set_synced(path)
+        return data
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+def _gem(url, description, extra):
+    gem = {"url": url}
+    if description is not None:
+        gem["desc"] = description
+    if extra:
+        gem.update(json.loads(extra))
+    return gem
+
+# Store mirroring a gems JSON file, seeded from it on first use
+def open_store(json_path, layout=None):
+    store = GemsStore(store_path(json_path))
+    count = store.seed(json_path, layout)
+    if count:
+        stored = store.stats()["gems"]
+        print(f"📥 Seeded {store.path} with {stored} gems from {json_path}"
+              + (f" ({count - stored} repeated URLs within a node collapsed)" if count > stored else ""))
+    else:
+        count = store.refresh(json_path)
+        if count:
+            print(f"📥 {json_path} changed since the last sync; reloaded its {count} gems into {store.path}")
+    return store
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import, export and inspect SQLite image-gems stores")
+    parser.add_argument("action", choices=["import", "export", "stats"])
+    parser.add_argument("json_path", help="Gems JSON file the store mirrors")
+    parser.add_argument("--db", help="Store path (default: <json stem>.gems.sqlite)")
+    parser.add_argument("--layout", choices=LAYOUTS, help="Default: detected at import")
+    parser.add_argument("--language", help="Language of the imported gems")
+    parser.add_argument("--out", help="Export here instead of over json_path")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = GemsStore(args.db or store_path(args.json_path))
+    if args.action == "import":
+        with open(args.json_path, "r", encoding="utf-8") as f:
+            count = store.import_data(json.load(f), args.layout, args.language, "import")
+        print(f"✅ Imported {count} gems into {store.path}")
+    elif args.action == "export":
+        out = args.out or args.json_path
+        store.export_json(out, args.layout)
+        print(f"✅ Exported {store.stats()['gems']} gems to {out}")
+    print("📊 " + ", ".join(f"{n} {name}" for name, n in store.stats().items()))
+    store.close()
@@ -1,31 +1,124 @@
-import os, json
+import os, json, time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
+from ocr_store import file_sha256
+from metrics import metrics
 
-def generate_metadata_from_folder(domain, language):
-    folder = f"../raw_images/{domain}_{language}"
-    output_file = f"../metadata/{domain}_{language}.json"
-    meta = []
+# Walks raw_images/[domain]/[subdomain]/[theme]/ recursively and streams one
+# JSONL record per image: taxonomy fields from the path, width/height/format
+# from the image header only, and the SHA-256 of the bytes. Files whose size
+# and mtime match the previous manifest are copied over without being reopened.
+# Per-image extraction time (header + hash, measured in the worker) goes to
+# the metadata_extract histogram.
 
-    for filename in os.listdir(folder):
-        if filename.endswith(".jpg"):
-            filepath = os.path.join(folder, filename)
+IMAGES_ROOT = "../raw_images"
+MANIFEST_PATH = "../metadata/image_manifest.jsonl"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+TAXONOMY_FIELDS = ("domain", "subdomain", "theme")
+
+def extract_record(job):
+    root, rel_path, size, mtime, language = job
+    filepath = os.path.join(root, rel_path)
+    parts = rel_path.split(os.sep)
+    record = {
+        "file_name": parts[-1],
+        "image_path": rel_path.replace(os.sep, "/"),
+        "language": language,
+    }
+    for field, value in zip(TAXONOMY_FIELDS, parts[:-1]):
+        record[field] = value
+    try:
+        with Image.open(filepath) as img:
+            width, height = img.size
+            record.update({"width": width, "height": height, "format": img.format})
+        record.update({"size": size, "mtime": mtime, "sha256": file_sha256(filepath)})
+        return record, None
+    except Exception as e:
+        return None, f"Error reading {rel_path}: {e}"
+
+# extract_record plus its duration, measured in the worker process
+def extract_record_timed(job):
+    start = time.perf_counter()
+    record, error = extract_record(job)
+    return record, error, time.perf_counter() - start
+
+def iter_image_files(root):
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                filepath = os.path.join(dirpath, filename)
+                stat = os.stat(filepath)
+                yield os.path.relpath(filepath, root), stat.st_size, stat.st_mtime
+
+# image_path -> (size, mtime, byte offset of its line) from the last manifest
+def index_manifest(path):
+    index = {}
+    if not os.path.exists(path):
+        return index
+    with open(path, "rb") as f:
+        offset = 0
+        for line in f:
             try:
-                with Image.open(filepath) as img:
-                    width, height = img.size
-                meta.append({
-                    "file_name": filename,
-                    "width": width,
-                    "height": height,
-                    "language": language,
-                    "domain": domain
-                })
-            except Exception as e:
-                print(f"Error reading {filename}: {e}")
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(meta, f, indent=2, ensure_ascii=False)
+                record = json.loads(line)
+                index[record["image_path"]] = (record["size"], record["mtime"], offset)
+            except (ValueError, KeyError):
+                pass
+            offset += len(line)
+    return index
+
+def generate_metadata(root=IMAGES_ROOT, manifest_path=MANIFEST_PATH, language=None, workers=None):
+    folder = os.path.dirname(manifest_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    previous = index_manifest(manifest_path)
+    tmp_path = manifest_path + ".tmp"
+    reused = written = 0
+    changed = []
+
+    with open(tmp_path, "wb") as out:
+        old = open(manifest_path, "rb") if previous else None
+        try:
+            with metrics.timer("metadata_scan"):
+                for rel_path, size, mtime in iter_image_files(root):
+                    key = rel_path.replace(os.sep, "/")
+                    hit = previous.get(key)
+                    if hit and hit[0] == size and hit[1] == mtime:
+                        old.seek(hit[2])
+                        out.write(old.readline())
+                        reused += 1
+                    else:
+                        changed.append((root, rel_path, size, mtime, language))
+        finally:
+            if old:
+                old.close()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for record, error, seconds in pool.map(extract_record_timed, changed, chunksize=64):
+                metrics.observe("metadata_extract", seconds)
+                if error:
+                    print(error)
+                    metrics.count("metadata_errors")
+                    continue
+                out.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                written += 1
+
+    metrics.count("metadata_records", written, source="extracted")
+    metrics.count("metadata_records", reused, source="reused")
+    os.replace(tmp_path, manifest_path)
+    print(f"✅ {manifest_path}: {written} new/changed, {reused} unchanged")
+    return written, reused
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Incrementally build the image metadata manifest (JSONL)")
+    parser.add_argument("--root", default=IMAGES_ROOT)
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--language", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    generate_metadata_from_folder("urban", "ko")
-    generate_metadata_from_folder("urban", "ja")
-    generate_metadata_from_folder("urban", "ar")
\ No newline at end of file
+    args = parse_args()
+    metrics.start_run("generate_metadata")
+    generate_metadata(args.root, args.manifest, args.language, args.workers)
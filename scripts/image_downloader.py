@@ -0,0 +1,147 @@
+import os
+import time
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, UnidentifiedImageError
+
+from metrics import metrics
+
+# Shared parallel image downloader.
+# Bodies are streamed; the first chunks are parsed for the image header only
+# (format + dimensions, no pixel decode) so undersized, oddly shaped or
+# non-image responses are rejected and their connections dropped early.
+# Each fetch is timed into the download histogram as ok / rejected / error.
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64)"
+}
+
+CHUNK_SIZE = 16 * 1024
+HEADER_PROBE_BYTES = 256 * 1024  # large EXIF blocks can push JPEG SOF this far
+ALLOWED_FORMATS = ("JPEG", "PNG", "GIF", "WEBP", "BMP", "TIFF")
+
+class DownloadResult:
+    def __init__(self, url, content=None, format=None, width=None, height=None, error=None):
+        self.url = url
+        self.content = content
+        self.format = format
+        self.width = width
+        self.height = height
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+def probe_image_header(data):
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return img.format, img.width, img.height
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+
+class ImageDownloader:
+    def __init__(self, workers=16, min_size=300, max_aspect=4.0, formats=ALLOWED_FORMATS,
+                 max_bytes=50 * 1024 * 1024, timeout=10, headers=HEADERS):
+        self.workers = workers
+        self.min_size = min_size
+        self.max_aspect = max_aspect
+        self.formats = formats
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def check_header(self, format, width, height):
+        if self.formats and format not in self.formats:
+            return f"format {format} not allowed"
+        if width < self.min_size or height < self.min_size:
+            return f"too small ({width}x{height})"
+        if self.max_aspect and (width > self.max_aspect * height or height > self.max_aspect * width):
+            return f"aspect ratio too extreme ({width}x{height})"
+        return None
+
+    def fetch(self, url):
+        started = time.perf_counter()
+        try:
+            result = self._fetch(url)
+            outcome = "ok" if result.ok else "rejected"
+        except Exception as e:
+            result = DownloadResult(url, error=str(e))
+            outcome = "error"
+        metrics.observe("download", time.perf_counter() - started, outcome=outcome)
+        if result.ok:
+            metrics.count("download_bytes", len(result.content))
+        return result
+
+    def _fetch(self, url):
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                return DownloadResult(url, error=f"HTTP {response.status_code}")
+            content_type = response.headers.get("Content-Type", "")
+            if content_type.startswith("text/"):
+                return DownloadResult(url, error=f"not an image ({content_type})")
+            length = response.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > self.max_bytes:
+                return DownloadResult(url, error=f"too large ({length} bytes)")
+
+            buf = bytearray()
+            header = None
+            for chunk in response.iter_content(CHUNK_SIZE):
+                buf.extend(chunk)
+                if header is None:
+                    header = probe_image_header(bytes(buf))
+                    if header is not None:
+                        reason = self.check_header(*header)
+                        if reason:
+                            # Leaving the with-block closes the connection mid-transfer
+                            return DownloadResult(url, None, *header, error=reason)
+                    elif len(buf) >= HEADER_PROBE_BYTES:
+                        return DownloadResult(url, error="unrecognised image header")
+                if len(buf) > self.max_bytes:
+                    return DownloadResult(url, error="too large")
+
+            if header is None:
+                header = probe_image_header(bytes(buf))
+                if header is None:
+                    return DownloadResult(url, error="unrecognised image header")
+                reason = self.check_header(*header)
+                if reason:
+                    return DownloadResult(url, None, *header, error=reason)
+            return DownloadResult(url, bytes(buf), *header)
+
+    # Results are yielded in input order while up to `workers` transfers run at once;
+    # only a small window of finished bodies is ever held in memory.
+    def download_all(self, urls):
+        window = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for url in urls:
+                window.append(pool.submit(self.fetch, url))
+                if len(window) >= self.workers * 2:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def save_result(result, file_path):
+    folder = os.path.dirname(file_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(result.content)
@@ -1,9 +1,9 @@
 import os
-import requests
 from duckduckgo_search import DDGS
-from PIL import Image
-from io import BytesIO
 from tqdm import tqdm
+from image_downloader import ImageDownloader
+from normalize_images import save_download
+from metrics import metrics
 
 query = "brain MRI scan with annotations"
 domain = "medicine"
@@ -11,32 +11,30 @@ subdomain = "radiology"
 theme = "brain_scan"
 language = "en"
 num_images = 10
+workers = 16
 
 save_dir = f"../raw_images/{domain}/{subdomain}/{theme}"
 os.makedirs(save_dir, exist_ok=True)
+metrics.start_run("image_scraper")
 
 print(f"🔍 Searching: {query}")
 results = []
-with DDGS() as ddgs:
+with metrics.timer("search", provider="duckduckgo"), DDGS() as ddgs:
     for r in ddgs.images(query, max_results=num_images):
         results.append(r)
 
 print(f"📥 Downloading {len(results)} images...")
 count = 1
-for result in tqdm(results):
-    try:
-        image_url = result["image"]
-        response = requests.get(image_url, timeout=10)
-        image = Image.open(BytesIO(response.content))
-
-        if image.width < 300 or image.height < 300:
-            continue
-        if image.width > 4 * image.height or image.height > 4 * image.width:
+with ImageDownloader(workers=workers, min_size=300, max_aspect=4.0) as downloader:
+    urls = [result["image"] for result in results]
+    for download in tqdm(downloader.download_all(urls), total=len(urls)):
+        if not download.ok:
             continue
+        try:
+            # RGBA / palette images are flattened; the extension follows the encoding
+            with metrics.timer("image_convert"):
+                save_download(download, os.path.join(save_dir, f"brain_scan_{count}"))
+            count += 1
 
-        file_path = os.path.join(save_dir, f"brain_scan_{count}.jpg")
-        image.save(file_path)
-        count += 1
-
-    except Exception as e:
-        print(f"Error: {e}")
\ No newline at end of file
+        except Exception as e:
+            print(f"Error: {e}")
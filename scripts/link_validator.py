@@ -0,0 +1,271 @@
+import os
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from url_frontier import Frontier, METADATA_FILES, canonicalize_url, url_key, load_metadata_urls
+from image_downloader import HEADERS, CHUNK_SIZE, HEADER_PROBE_BYTES, probe_image_header
+from gems_store import open_store
+from metrics import metrics
+
+# Liveness check for the URLs in the gems / link metadata files.
+# Each URL gets one small ranged GET (bytes 0-HEADER_PROBE_BYTES) that is
+# read only until the image header parses, or a HEAD with --head; from it we
+# keep status, content type, total length and image dimensions, plus a
+# verdict: ok, small, not_image, dead (4xx, unknown host) or error
+# (network, 429, 5xx).
+# Requests go through url_frontier's per-host scheduler. Results live in a
+# SQLite cache and expire per verdict (errors after a day, good images after
+# a month), so a re-run only probes stale or new URLs. Finally every item in
+# the metadata files gets a "link" annotation, written through the file's
+# gems store, which url_frontier uses to skip dead, non-image and undersized
+# links.
+
+CACHE_PATH = "../metadata/link_checks.sqlite"
+MIN_SIZE = 300
+TIMEOUT = 10
+DAY = 24 * 3600
+CHECK_TTL = {
+    "ok": 30 * DAY,
+    "small": 30 * DAY,
+    "not_image": 14 * DAY,
+    "dead": 7 * DAY,
+    "error": 1 * DAY,
+}
+HOST_NOT_FOUND = "host not found"  # typical of hallucinated links
+FIELDS = ("verdict", "status", "content_type", "length", "format", "width", "height", "error", "checked")
+
+class LinkCache:
+    def __init__(self, path=CACHE_PATH):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS links (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                verdict TEXT NOT NULL,
+                status INTEGER,
+                content_type TEXT,
+                length INTEGER,
+                format TEXT,
+                width INTEGER,
+                height INTEGER,
+                error TEXT,
+                checked REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self._unsaved = 0
+
+    def load(self):
+        with self._lock:
+            rows = self.conn.execute(f"SELECT key, {', '.join(FIELDS)} FROM links").fetchall()
+        return {row[0]: dict(zip(FIELDS, row[1:])) for row in rows}
+
+    def put(self, key, url, check):
+        with self._lock:
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO links (key, url, {', '.join(FIELDS)}) "
+                f"VALUES ({', '.join('?' * (len(FIELDS) + 2))})",
+                (key, url) + tuple(check.get(field) for field in FIELDS)
+            )
+            self._unsaved += 1
+            if self._unsaved >= 100:
+                self.conn.commit()
+                self._unsaved = 0
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+def is_stale(check, now):
+    return now - check["checked"] >= CHECK_TTL.get(check["verdict"], 0)
+
+# Full size from "Content-Range: bytes 0-1023/5000", else Content-Length of a 200
+def total_length(response):
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length", "")
+    return int(length) if response.status_code == 200 and length.isdigit() else None
+
+def verdict(check, min_size):
+    status = check.get("status")
+    if check.get("error") == HOST_NOT_FOUND:
+        return "dead"
+    if status is None or status == 429 or status >= 500:
+        return "error"
+    if status >= 400:
+        return "dead"
+    content_type = check.get("content_type") or ""
+    if check.get("width") is None:
+        # HEAD gives no dimensions; trust an image content type
+        if check.get("method") == "HEAD" and content_type.startswith(("image/", "application/octet-stream")):
+            return "ok"
+        return "not_image"
+    if check["width"] < min_size or check["height"] < min_size:
+        return "small"
+    return "ok"
+
+class LinkProber:
+    def __init__(self, workers=64, min_size=MIN_SIZE, head=False, timeout=TIMEOUT, headers=HEADERS):
+        self.min_size = min_size
+        self.head = head
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _response_fields(self, response, method):
+        return {
+            "method": method,
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", "").split(";")[0].strip().lower(),
+            "length": total_length(response),
+        }
+
+    # Reads only until the image header parses; leaving the with-block drops the rest
+    def _ranged_get(self, url):
+        headers = {"Range": f"bytes=0-{HEADER_PROBE_BYTES - 1}"}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            check = self._response_fields(response, "GET")
+            if response.status_code not in (200, 206) or check["content_type"].startswith("text/"):
+                return check
+            buf = bytearray()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                buf.extend(chunk)
+                header = probe_image_header(bytes(buf))
+                if header is not None:
+                    check["format"], check["width"], check["height"] = header
+                    break
+                if len(buf) >= HEADER_PROBE_BYTES:
+                    break
+            return check
+
+    def _head(self, url):
+        response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+        if response.status_code in (403, 405, 501):  # HEAD refused; some hosts only answer GET
+            return self._ranged_get(url)
+        return self._response_fields(response, "HEAD")
+
+    def probe(self, url):
+        started = time.perf_counter()
+        try:
+            check = self._head(url) if self.head else self._ranged_get(url)
+        except requests.ConnectionError as e:
+            unresolved = "Failed to resolve" in str(e) or "NameResolutionError" in str(e)
+            check = {"error": HOST_NOT_FOUND if unresolved else f"{type(e).__name__}: {e}"[:300]}
+        except requests.RequestException as e:
+            check = {"error": f"{type(e).__name__}: {e}"[:300]}
+        check["verdict"] = verdict(check, self.min_size)
+        check["checked"] = time.time()
+        metrics.observe("link_check", time.perf_counter() - started, verdict=check["verdict"])
+        return check
+
+    def close(self):
+        self.session.close()
+
+def annotation(check):
+    link = {field: check[field] for field in FIELDS if field != "checked" and check.get(field) is not None}
+    link["checked"] = datetime.fromtimestamp(check["checked"], timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return link
+
+# Annotation for a URL with a cached check, else None
+def link_annotation(url, checks):
+    try:
+        check = checks.get(url_key(canonicalize_url(url)))
+    except ValueError:
+        return None
+    return annotation(check) if check is not None else None
+
+# Annotations go through the file's GemsStore (as gem extras) and the file is
+# exported from it, so later exports by the enrichment scripts keep them.
+# Returns how many items were annotated.
+def annotate_file(path, checks):
+    store = open_store(path)
+    try:
+        count = store.annotate("link", lambda url: link_annotation(url, checks))
+        store.export_json(path)
+    finally:
+        store.close()
+    return count
+
+def validate_links(metadata_files=METADATA_FILES, cache_path=CACHE_PATH, workers=64, per_host=4,
+                   min_size=MIN_SIZE, head=False, force=False, write=True):
+    cache = LinkCache(cache_path)
+    checks = cache.load()
+    now = time.time()
+    frontier = Frontier(None, per_host)
+    total = fresh = 0
+    for url, _ in load_metadata_urls(metadata_files, skip_verdicts=()):
+        total += 1
+        try:
+            key = url_key(canonicalize_url(url))
+        except ValueError:
+            continue
+        if not force and key in checks and not is_stale(checks[key], now):
+            fresh += 1
+            continue
+        frontier.add(url)
+    print(f"🔍 {total} URLs: {fresh} cached checks still fresh, {frontier.pending} to probe "
+          f"across {len(frontier.queues)} hosts")
+
+    counts = {name: 0 for name in CHECK_TTL}
+    lock = threading.Lock()
+
+    def on_result(url, context, check):
+        key = url_key(url)
+        cache.put(key, url, check)
+        with lock:
+            checks[key] = check
+            counts[check["verdict"]] += 1
+            probed = sum(counts.values())
+        if probed % 500 == 0:
+            print(f"⏱️ {probed} probed: " + ", ".join(f"{n} {name}" for name, n in counts.items()))
+
+    prober = LinkProber(workers, min_size, head)
+    try:
+        frontier.run(prober.probe, on_result, workers)
+    finally:
+        prober.close()
+        cache.close()
+    for name, n in counts.items():
+        metrics.count("links", n, verdict=name)
+    print("✅ Probed: " + ", ".join(f"{n} {name}" for name, n in counts.items()))
+
+    if write:
+        for path in metadata_files:
+            print(f"💾 Annotated {annotate_file(path, checks)} links in {path}")
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Check metadata URLs for liveness, type and image size")
+    parser.add_argument("metadata", nargs="*", default=METADATA_FILES)
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--workers", type=int, default=64)
+    parser.add_argument("--per-host", type=int, default=4)
+    parser.add_argument("--min-size", type=int, default=MIN_SIZE)
+    parser.add_argument("--head", action="store_true",
+                        help="HEAD only: cheaper, but no dimensions (falls back to GET when refused)")
+    parser.add_argument("--force", action="store_true", help="Re-probe even fresh cached checks")
+    parser.add_argument("--no-write", action="store_true", help="Only fill the cache, leave the JSON files alone")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    metrics.start_run("link_validator")
+    validate_links(args.metadata, args.cache, args.workers, args.per_host, args.min_size, args.head,
+                   args.force, not args.no_write)
@@ -0,0 +1,325 @@
+import os
+import re
+import json
+import threading
+import requests
+from response_cache import cache, make_key, MISSING
+from rate_limiter import with_rate_limit
+from metrics import metrics
+
+# Batched multi-leaf prompting and tolerant JSON extraction for LLM answers.
+# BatchPrompter packs as many taxonomy leaves into one prompt as the model's
+# context allows, asks for a JSON array of {"id", "result"} objects and reads
+# it element by element (JsonArrayStream), so a truncated or partly malformed
+# answer still yields every element that closed. Items missing from the
+# answer fall back to the usual single-leaf call. Each batched result is
+# stored in the response cache under its single-leaf prompt, so re-runs and
+# the single-leaf path both see it. One BatchPrompter may be shared by
+# threads; its adaptive batch size and stats are kept under a lock.
+
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Context windows (tokens) of the models the scripts use
+MODEL_CONTEXT = {
+    "openai/gpt-3.5-turbo": 16385,
+    "mistralai/mistral-7b-instruct": 32768,
+    "openchat/openchat-3.5-0106": 8192,
+    "llama3-70b-8192": 8192,
+}
+DEFAULT_CONTEXT = 4096
+CHARS_PER_TOKEN = 4  # rough estimate, good enough for sizing batches
+MAX_BATCH = 25
+
+_decoder = json.JSONDecoder()
+_FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+# Feed text as it arrives; every top-level array element is returned as soon
+# as it is complete. close() skips over malformed elements and returns what
+# can still be recovered after them.
+class JsonArrayStream:
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.started = False
+        self.done = False
+
+    def feed(self, text):
+        self.buf += text
+        return self._drain(final=False)
+
+    def close(self):
+        return self._drain(final=True)
+
+    def _drain(self, final):
+        items = []
+        if not self.started:
+            start = self.buf.find("[", self.pos)
+            if start == -1:
+                return items
+            self.started = True
+            self.pos = start + 1
+        while not self.done:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n,":
+                self.pos += 1
+            if self.pos >= len(self.buf):
+                break
+            if self.buf[self.pos] == "]":
+                self.done = True
+                break
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not final:
+                    break  # most likely incomplete; wait for more text
+                if not self._resync():
+                    break
+                continue
+            if end == len(self.buf) and not final and not isinstance(value, (dict, list, str)):
+                break  # a number at the very end may still be growing
+            items.append(value)
+            self.pos = end
+        return items
+
+    # Jump to the next element that could start where this one failed
+    def _resync(self):
+        opener = self.buf[self.pos]
+        if opener in "{[":
+            nxt = self.buf.find(opener, self.pos + 1)
+        else:
+            nxt = self.buf.find(",", self.pos + 1)
+        if nxt == -1:
+            return False
+        self.pos = nxt
+        return True
+
+def _clean(text):
+    return _TRAILING_COMMA.sub(r"\1", text)
+
+# Offsets of the "[" / "{" that open a top-level value, outside strings
+def _top_level_starts(text):
+    starts, depth, in_string, escaped = [], 0, False, False
+    for i, c in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = depth > 0  # quotes in the prose around the JSON do not count
+        elif c in "[{":
+            if depth == 0:
+                starts.append(i)
+            depth += 1
+        elif c in "]}" and depth > 0:
+            depth -= 1
+    return starts
+
+# Complete value starting at text[0], else the array elements that can be recovered
+# (as read and with trailing commas removed, whichever yields more), else None
+def _parse_candidate(text):
+    for attempt in (text, _clean(text)):
+        try:
+            return _decoder.raw_decode(attempt)[0]
+        except ValueError:
+            pass
+    if text[0] != "[":
+        return None
+    recovered = []
+    for attempt in (text, _clean(text)):
+        stream = JsonArrayStream()
+        items = stream.feed(attempt) + stream.close()
+        if len(items) > len(recovered):
+            recovered = items
+    return recovered or None
+
+# JSON value of an LLM answer: tolerates code fences, prose around the JSON,
+# trailing commas and arrays cut off mid-element. When the prose holds several
+# values ("see [1] below: [...]"), the last top-level one matching `expect`
+# (e.g. is_gem_list) wins, arrays before objects. Raises ValueError when nothing
+# usable is found, so callers do not cache a bad answer.
+def extract_json(text, expect=None):
+    text = _FENCE.sub("", text or "").strip()
+    for attempt in (text, _clean(text)):
+        try:
+            return json.loads(attempt)
+        except ValueError:
+            pass
+    starts = _top_level_starts(text)
+    if not starts:
+        raise ValueError("no JSON found in the response")
+    values = [value for value in (_parse_candidate(text[start:]) for start in starts) if value is not None]
+    if not values:
+        raise ValueError("no valid JSON array or object in the response")
+    matching = [value for value in values if expect is None or expect(value)] or values
+    arrays = [value for value in matching if isinstance(value, list)]
+    return (arrays or matching)[-1]
+
+def is_string_list(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(v, str) and v.strip() for v in value)
+
+def is_gem_list(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(v, dict) and v.get("url") for v in value)
+
+# Content deltas of an OpenAI-compatible server-sent-event stream
+def iter_sse_content(response):
+    with response:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                delta = json.loads(data)["choices"][0].get("delta", {})
+            except (ValueError, KeyError, IndexError):
+                continue
+            if delta.get("content"):
+                yield delta["content"]
+
+# Streaming OpenRouter call; HTTP errors raise here (inside with_rate_limit),
+# the body is consumed by BatchPrompter chunk by chunk
+def openrouter_stream(model, prompt, temperature=0.7, api_key=None):
+    response = requests.post(
+        OPENROUTER_URL,
+        headers={
+            "Authorization": f"Bearer {api_key or os.getenv('OPENROUTER_API_KEY')}",
+            "Content-Type": "application/json"
+        },
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "stream": True
+        },
+        stream=True,
+        timeout=60
+    )
+    response.raise_for_status()
+    return iter_sse_content(response)
+
+class BatchPrompter:
+    # call(model, prompt) returns the answer text, or an iterator of text chunks.
+    # describe(item) is one line of the batch prompt, single_prompt(item) the
+    # prompt the single-item path would send and single(item) that path itself.
+    def __init__(self, provider, model, call, instructions, describe, single_prompt, single,
+                 params=None, validate=is_string_list, output_tokens=80, max_batch=MAX_BATCH):
+        self.provider = provider
+        self.model = model
+        self.call = call
+        self.instructions = instructions
+        self.describe = describe
+        self.single_prompt = single_prompt
+        self.single = single
+        self.params = params
+        self.validate = validate
+        self.output_tokens = output_tokens
+        self.max_batch = max_batch
+        self.size = None
+        self.stats = {"batch_calls": 0, "batched": 0, "cached": 0, "single": 0}
+        self._lock = threading.Lock()
+
+    # Largest N whose prompt plus expected answer fits in the model's context
+    def fit_batch_size(self, items):
+        context = MODEL_CONTEXT.get(self.model, DEFAULT_CONTEXT)
+        sample = items[:20]
+        per_item = sum(estimate_tokens(self.describe(item)) for item in sample) // max(1, len(sample))
+        budget = context - estimate_tokens(self.instructions) - 64
+        return max(1, min(self.max_batch, budget // (per_item + self.output_tokens + 8)))
+
+    def build_prompt(self, batch):
+        lines = "\n".join(f"{i}. {self.describe(item)}" for i, item in batch)
+        return f"""{self.instructions}
+
+Items:
+{lines}
+
+Answer with only a JSON array, one object per item, in the same order:
+[{{"id": <item number>, "result": <the answer for that item>}}]"""
+
+    def _tally(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
+
+    def _cache_key(self, item):
+        return make_key(self.provider, self.model, self.single_prompt(item), self.params)
+
+    # Timed as llm_batch from the request until the last chunk is read
+    def _ask(self, prompt):
+        stream = JsonArrayStream()
+        with metrics.timer("llm_batch", provider=self.provider):
+            answer = with_rate_limit(self.provider, self.call, self.model, prompt)
+            elements = []
+            try:
+                for chunk in [answer] if isinstance(answer, str) else answer:
+                    elements.extend(stream.feed(chunk))
+            except Exception as e:
+                print(f"⚠️ {self.provider} stream broke off ({e}); keeping the items that completed")
+            elements.extend(stream.close())
+        return elements
+
+    def run(self, items):
+        results, pending = {}, []
+        for i, item in enumerate(items):
+            value = cache.get(self._cache_key(item))
+            if value is not MISSING:
+                results[i] = value
+                self._tally("cached")
+                metrics.count("llm_batch_items", provider=self.provider, source="cached")
+            else:
+                pending.append(i)
+        if not pending:
+            return [results[i] for i in range(len(items))]
+
+        fitted = self.fit_batch_size([items[i] for i in pending])
+        with self._lock:
+            self.size = self.size or fitted
+        retry = []
+        while pending:
+            with self._lock:
+                size = self.size
+            batch, pending = pending[:size], pending[size:]
+            answered = {}
+            try:
+                self._tally("batch_calls")
+                for element in self._ask(self.build_prompt([(i, items[i]) for i in batch])):
+                    if not isinstance(element, dict):
+                        continue
+                    try:
+                        item_id = int(element.get("id"))
+                    except (TypeError, ValueError):
+                        continue
+                    if item_id in batch and self.validate(element.get("result")):
+                        answered[item_id] = element["result"]
+            except Exception as e:
+                print(f"❌ Batch of {len(batch)} failed: {e}")
+
+            for i, result in answered.items():
+                results[i] = result
+                cache.set(self._cache_key(items[i]), result, self.provider)
+            self._tally("batched", len(answered))
+            metrics.count("llm_batch_items", len(answered), provider=self.provider, source="batched")
+            missed = [i for i in batch if i not in answered]
+            retry.extend(missed)
+
+            # Shrink after a mostly-failed batch (likely truncated), grow back after clean ones
+            with self._lock:
+                if len(missed) > len(batch) // 2:
+                    self.size = max(1, self.size // 2)
+                elif not missed:
+                    self.size = min(self.max_batch, self.size + max(1, self.size // 4))
+
+        for i in retry:
+            self._tally("single")
+            metrics.count("llm_batch_items", provider=self.provider, source="single")
+            results[i] = self.single(items[i])
+        with self._lock:
+            stats = dict(self.stats)
+        print(f"⚡ {self.provider}/{self.model}: {stats['batch_calls']} batch calls for "
+              f"{stats['batched']} items, {stats['cached']} cached, {stats['single']} retried singly")
+        return [results[i] for i in range(len(items))]
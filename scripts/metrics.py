@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import functools
+import threading
+import asyncio
+from bisect import bisect_left
+from collections import Counter
+
+# Run instrumentation shared by the scripts: counters and latency histograms
+# in one process-wide registry (`metrics`). Cheap enough for hot paths: one
+# lock, fixed buckets, nothing stored per sample. start_run(name) marks a
+# script run; on exit the registry is written to METRICS_DIR/<name>.prom
+# (Prometheus textfile-collector format) or .json, and a per-stage summary is
+# printed. VQA_PROFILE=cprofile profiles the main thread (pstats dump),
+# VQA_PROFILE=sample samples every thread's stack (folded stacks for flame
+# graphs). Worker processes send snapshot() back to the parent to merge().
+
+METRICS_DIR = os.getenv("VQA_METRICS_DIR", "../metrics")
+METRICS_FORMAT = os.getenv("VQA_METRICS_FORMAT", "prom")  # "prom" or "json"
+PROFILE = os.getenv("VQA_PROFILE", "")  # "", "cprofile" or "sample"
+SAMPLE_INTERVAL = float(os.getenv("VQA_PROFILE_INTERVAL", 0.005))
+PREFIX = "vqa_"
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+TOP_FUNCTIONS = 15
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    # Estimated from the buckets, interpolating inside the one that holds the rank
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = min(BUCKETS[i], self.max)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count, "max": self.max}
+
+    def merge(self, data):
+        self.counts = [a + b for a, b in zip(self.counts, data["counts"])]
+        self.sum += data["sum"]
+        self.count += data["count"]
+        self.max = max(self.max, data["max"])
+
+class Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        self.registry.observe(self.name, self.elapsed, **self.labels)
+        if exc_type is not None:
+            self.registry.count(self.name + "_errors", **self.labels)
+        return False
+
+# Sampling profiler: every interval, the stack of every other thread is
+# counted as one "outer;...;inner" line
+class StackSampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+    def top(self, n=TOP_FUNCTIONS):
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def _metric_name(name):
+    return PREFIX + "".join(c if c.isalnum() else "_" for c in name)
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.run_name = None
+        self.run_started = None
+        self.out_path = None
+        self.profiler = None
+        self.sampler = None
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def count(self, name, n=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(seconds)
+
+    # with metrics.timer("ocr_decode"): ...  (errors are also counted as <name>_errors)
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    # Decorator form of timer(), for plain and async functions
+    def timed(self, name, **labels):
+        def wrap(fn):
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def run_async(*args, **kwargs):
+                    with self.timer(name, **labels):
+                        return await fn(*args, **kwargs)
+                return run_async
+
+            @functools.wraps(fn)
+            def run(*args, **kwargs):
+                with self.timer(name, **labels):
+                    return fn(*args, **kwargs)
+            return run
+        return wrap
+
+    # Plain data that can cross a process boundary
+    def snapshot(self, reset=False):
+        with self._lock:
+            data = {
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "histograms": [[name, list(labels), hist.to_dict()] for (name, labels), hist in self.histograms.items()],
+            }
+            if reset:
+                self.counters = {}
+                self.histograms = {}
+        return data
+
+    def merge(self, data):
+        with self._lock:
+            for name, labels, value in data["counters"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, hist_data in data["histograms"]:
+                key = (name, tuple(tuple(label) for label in labels))
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram()
+                self.histograms[key].merge(hist_data)
+
+    def summary(self):
+        def key_text(name, labels):
+            return name + _label_text(labels)
+
+        with self._lock:
+            timers = {
+                key_text(name, labels): {
+                    "count": hist.count,
+                    "total_s": round(hist.sum, 4),
+                    "mean_ms": round(hist.sum / hist.count * 1000, 2) if hist.count else None,
+                    "p50_ms": round(hist.quantile(0.5) * 1000, 2) if hist.count else None,
+                    "p95_ms": round(hist.quantile(0.95) * 1000, 2) if hist.count else None,
+                    "p99_ms": round(hist.quantile(0.99) * 1000, 2) if hist.count else None,
+                    "max_ms": round(hist.max * 1000, 2),
+                }
+                for (name, labels), hist in sorted(self.histograms.items())
+            }
+            counters = {key_text(name, labels): value for (name, labels), value in sorted(self.counters.items())}
+        return {
+            "script": self.run_name,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.run_started or time.time())),
+            "duration_s": round(time.time() - self.run_started, 3) if self.run_started else None,
+            "counters": counters,
+            "timers": timers,
+        }
+
+    def to_prometheus(self):
+        base = (("script", self.run_name or "unknown"),)
+        lines = []
+        with self._lock:
+            by_name = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                by_name.setdefault(name, []).append((labels, value))
+            for name, series in by_name.items():
+                metric = _metric_name(name) + "_total"
+                lines.append(f"# TYPE {metric} counter")
+                for labels, value in series:
+                    lines.append(f"{metric}{_label_text(base + labels)} {value}")
+
+            by_name = {}
+            for (name, labels), hist in sorted(self.histograms.items()):
+                by_name.setdefault(name, []).append((labels, hist))
+            for name, series in by_name.items():
+                metric = _metric_name(name) + "_seconds"
+                lines.append(f"# TYPE {metric} histogram")
+                for labels, hist in series:
+                    cumulative = 0
+                    for upper, n in zip(BUCKETS, hist.counts):
+                        cumulative += n
+                        le = "+Inf" if upper == float("inf") else repr(upper)
+                        lines.append(f"{metric}_bucket{_label_text(base + labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{metric}_sum{_label_text(base + labels)} {hist.sum:.6f}")
+                    lines.append(f"{metric}_count{_label_text(base + labels)} {hist.count}")
+
+        if self.run_started:
+            lines.append(f"# TYPE {PREFIX}run_duration_seconds gauge")
+            lines.append(f"{PREFIX}run_duration_seconds{_label_text(base)} {time.time() - self.run_started:.3f}")
+            lines.append(f"# TYPE {PREFIX}run_finished_timestamp_seconds gauge")
+            lines.append(f"{PREFIX}run_finished_timestamp_seconds{_label_text(base)} {time.time():.0f}")
+        return "\n".join(lines) + "\n"
+
+    # .json gets the summary, anything else the Prometheus text format
+    def write(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if path.endswith(".json"):
+            text = json.dumps(self.summary(), indent=2, ensure_ascii=False)
+        else:
+            text = self.to_prometheus()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)  # the textfile collector must never see a partial file
+        return path
+
+    def print_summary(self):
+        summary = self.summary()
+        if not summary["timers"] and not summary["counters"]:
+            return
+        print(f"\n📊 {self.run_name}: {summary['duration_s']}s")
+        for name, t in summary["timers"].items():
+            print(f"   ⏱️ {name:<48} ×{t['count']:<7} total {t['total_s']:>9.2f}s  "
+                  f"p50 {t['p50_ms']:>8.1f} ms  p99 {t['p99_ms']:>8.1f} ms")
+        for name, value in summary["counters"].items():
+            print(f"   🔢 {name:<48} {value}")
+
+    def start_run(self, name, out=None, profile=PROFILE):
+        self.run_name = name
+        self.run_started = time.time()
+        self.out_path = out or os.path.join(METRICS_DIR, f"{name}.{METRICS_FORMAT}")
+        if profile == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profile == "sample":
+            self.sampler = StackSampler()
+            self.sampler.start()
+        elif profile:
+            print(f"⚠️ Unknown VQA_PROFILE '{profile}' (use cprofile or sample)")
+        atexit.register(self.finish_run)
+
+    def finish_run(self):
+        if self.run_name is None:
+            return
+        stem = os.path.splitext(self.out_path)[0]
+        if self.profiler is not None:
+            self.profiler.disable()
+            os.makedirs(os.path.dirname(stem) or ".", exist_ok=True)
+            self.profiler.dump_stats(stem + ".prof")
+            print(f"\n🔍 cProfile (main thread) → {stem}.prof")
+            pstats.Stats(self.profiler).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            self.profiler = None
+        if self.sampler is not None:
+            self.sampler.stop()
+            os.makedirs(os.path.dirname(stem) or ".", exist_ok=True)
+            self.sampler.write(stem + ".folded")
+            total = sum(self.sampler.stacks.values()) or 1
+            print(f"\n🔍 Sampled stacks → {stem}.folded; busiest functions:")
+            for function, n in self.sampler.top():
+                print(f"   {n / total:6.1%}  {function}")
+            self.sampler = None
+        self.print_summary()
+        print(f"📊 Metrics written to {self.write(self.out_path)}")
+        self.run_name = None
+
+metrics = Metrics()
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import argparse
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+from metrics import metrics
+
+# Normalizes raw_images in place and builds review / OCR thumbnails.
+# The true format is read from the file header, never from the extension.
+# RGB or greyscale JPEGs are already canonical and keep their bytes; anything
+# else is decoded once, converted to RGB or L in one step (alpha and
+# transparent palettes flattened onto white) and re-encoded: PNG when the
+# image has at most 256 colours (diagrams, scans of text), JPEG at
+# CANONICAL_QUALITY otherwise. A file whose extension lies about its format
+# is renamed, and every rename is appended to RENAME_MAP (one JSON line of
+# old → new path) so the OCR store, harvest JSONL `file` fields and QA
+# `image_path`s can be brought up to date with load_renames(). Thumbnails of
+# JPEGs use draft mode, so libjpeg scales down in the DCT domain and large
+# figures are never decoded at full size; the review thumbnail is cut from
+# the OCR one. Files whose thumbnails are newer than
+# the image are skipped without being opened. Work runs across a process pool.
+
+IMAGES_ROOT = "../raw_images"
+THUMB_ROOT = "../thumbnails"
+RENAME_MAP = "../metadata/image_renames.jsonl"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+CANONICAL_QUALITY = 90
+THUMB_QUALITY = 85
+REVIEW_SIZE = 256
+OCR_SIZE = 1024  # matches ocr_filter --canvas 1024
+PALETTE_COLORS = 256
+EXTENSIONS = {"JPEG": (".jpg", ".jpeg"), "PNG": (".png",)}
+
+def is_canonical(img):
+    return img.format == "JPEG" and img.mode in ("RGB", "L")
+
+# One conversion to RGB or L; transparency is composited onto white
+def flatten(img):
+    if img.mode == "P":
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    if img.mode in ("RGBA", "LA", "PA", "RGBa", "La"):
+        rgba = img.convert("RGBA")
+        board = Image.new("RGB", img.size, "white")
+        board.paste(rgba, mask=rgba.getchannel("A"))
+        return board
+    if img.mode in ("RGB", "L"):
+        return img
+    if img.mode in ("1", "I", "I;16", "F"):
+        return img.convert("L")
+    return img.convert("RGB")
+
+# (bytes, format) of the canonical encoding of an opened image
+def encode_canonical(img, quality=CANONICAL_QUALITY):
+    img = flatten(ImageOps.exif_transpose(img))
+    buf = BytesIO()
+    if img.getcolors(PALETTE_COLORS) is not None:
+        img.save(buf, "PNG", optimize=True)
+        return buf.getvalue(), "PNG"
+    img.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue(), "JPEG"
+
+def canonical_path(path, format):
+    stem, ext = os.path.splitext(path)
+    return path if ext.lower() in EXTENSIONS[format] else stem + EXTENSIONS[format][0]
+
+def write_atomic(path, data):
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+# Save a DownloadResult in canonical form under stem + the right extension
+def save_download(result, stem, quality=CANONICAL_QUALITY):
+    with Image.open(BytesIO(result.content)) as img:
+        if is_canonical(img):
+            data, format = result.content, "JPEG"
+        else:
+            data, format = encode_canonical(img, quality)
+    path = stem + EXTENSIONS[format][0]
+    write_atomic(path, data)
+    return path
+
+def thumb_paths(thumb_root, rel_path):
+    stem = os.path.splitext(rel_path)[0]
+    return (os.path.join(thumb_root, "ocr", stem + ".jpg"),
+            os.path.join(thumb_root, "review", stem + ".jpg"))
+
+# OCR thumbnail first (draft-decoded for JPEGs), the review one cut from it
+def write_thumbnails(img, ocr_path, review_path, ocr_size=OCR_SIZE, review_size=REVIEW_SIZE):
+    if img.format == "JPEG":
+        img.draft("RGB" if img.mode != "L" else "L", (ocr_size, ocr_size))
+    thumb = flatten(ImageOps.exif_transpose(img))
+    for path, size in ((ocr_path, ocr_size), (review_path, review_size)):
+        thumb.thumbnail((size, size), reducing_gap=2.0)
+        buf = BytesIO()
+        thumb.save(buf, "JPEG", quality=THUMB_QUALITY)
+        write_atomic(path, buf.getvalue())
+
+def is_fresh(rel_path, thumb_root, mtime):
+    for thumb in thumb_paths(thumb_root, rel_path):
+        try:
+            if os.stat(thumb).st_mtime < mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+# job = (root, rel_path, thumb_root, quality, force, dry_run); runs in a worker process
+def normalize_file(job):
+    root, rel_path, thumb_root, quality, force, dry_run = job
+    path = os.path.join(root, rel_path)
+    start = time.perf_counter()
+    out = {"path": rel_path, "new_path": rel_path, "status": "skipped", "before": 0, "after": 0, "error": None}
+    try:
+        stat = os.stat(path)
+        out["before"] = out["after"] = stat.st_size
+        if not force and is_fresh(rel_path, thumb_root, stat.st_mtime):
+            out["seconds"] = time.perf_counter() - start
+            return out
+
+        with Image.open(path) as img:
+            source_format = img.format
+            data, format = None, source_format
+            if not is_canonical(img):
+                img.load()
+                data, format = encode_canonical(img, quality)
+                # A lossless re-encode that does not shrink the file is not worth it
+                if format == source_format and len(data) >= stat.st_size:
+                    data = None
+
+        new_path = canonical_path(path, format) if format in EXTENSIONS else path
+        new_rel = os.path.relpath(new_path, root)
+        if data is None and new_path == path:
+            out["status"] = "kept"
+        else:
+            if new_path != path and os.path.exists(new_path):
+                raise FileExistsError(f"{new_rel} already exists")
+            out.update(new_path=new_rel, status="normalized", after=len(data) if data else stat.st_size)
+        if dry_run:
+            out["seconds"] = time.perf_counter() - start
+            return out
+
+        if data is not None:
+            write_atomic(new_path, data)
+            if new_path != path:
+                os.remove(path)
+        elif new_path != path:
+            os.replace(path, new_path)  # right bytes, wrong extension
+        with Image.open(new_path) as img:
+            write_thumbnails(img, *thumb_paths(thumb_root, new_rel))
+    except Exception as e:
+        out.update(status="error", error=f"{type(e).__name__}: {e}")
+    out["seconds"] = time.perf_counter() - start
+    return out
+
+# {old absolute path: current absolute path}, following files renamed more than once
+def load_renames(map_path=RENAME_MAP):
+    renames = {}
+    if not os.path.exists(map_path):
+        return renames
+    with open(map_path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            renames[os.path.join(entry["root"], entry["old"])] = os.path.join(entry["root"], entry["new"])
+    for old, new in renames.items():
+        seen = {old}
+        while new in renames and new not in seen:
+            seen.add(new)
+            new = renames[new]
+        renames[old] = new
+    return renames
+
+def iter_images(root):
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, name), root)
+
+def normalize_images(root=IMAGES_ROOT, thumb_root=THUMB_ROOT, quality=CANONICAL_QUALITY, workers=None,
+                     force=False, dry_run=False, rename_map=RENAME_MAP):
+    jobs = ((root, rel_path, thumb_root, quality, force, dry_run) for rel_path in iter_images(root))
+    counts = {"normalized": 0, "kept": 0, "skipped": 0, "error": 0}
+    before = after = renamed = 0
+    start = time.time()
+    if not dry_run and os.path.dirname(rename_map):
+        os.makedirs(os.path.dirname(rename_map), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            open(os.devnull if dry_run else rename_map, "a", encoding="utf-8") as renames:
+        for out in pool.map(normalize_file, jobs, chunksize=16):
+            counts[out["status"]] += 1
+            metrics.observe("normalize", out["seconds"], status=out["status"])
+            before += out["before"]
+            after += out["after"]
+            if out["error"]:
+                print(f"❌ {out['path']}: {out['error']}")
+            elif out["new_path"] != out["path"]:
+                print(f"🔁 {out['path']} → {out['new_path']}")
+                renamed += 1
+                renames.write(json.dumps({"root": os.path.abspath(root), "old": out["path"],
+                                          "new": out["new_path"], "time": time.time()}, ensure_ascii=False) + "\n")
+                renames.flush()
+    for status, n in counts.items():
+        metrics.count("normalize_images", n, status=status)
+    metrics.count("normalize_bytes", before, stage="before")
+    metrics.count("normalize_bytes", after, stage="after")
+
+    elapsed = time.time() - start
+    total = sum(counts.values())
+    verb = "Would normalize" if dry_run else "Normalized"
+    print(f"✅ {verb} {counts['normalized']}, kept {counts['kept']}, skipped {counts['skipped']} up to date, "
+          f"{counts['error']} errors — {total / elapsed if elapsed else 0:.1f} img/s")
+    print(f"💾 {before / 1e6:.1f} MB → {after / 1e6:.1f} MB")
+    if renamed and not dry_run:
+        print(f"🗺️ {renamed} renames recorded in {rename_map}")
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Normalize raw images in place and build review/OCR thumbnails")
+    parser.add_argument("--root", default=IMAGES_ROOT)
+    parser.add_argument("--thumbs", default=THUMB_ROOT)
+    parser.add_argument("--quality", type=int, default=CANONICAL_QUALITY, help="JPEG quality for re-encoded images")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Re-process images whose thumbnails are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--rename-map", default=RENAME_MAP, help="JSONL file renames are appended to")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    metrics.start_run("normalize_images")
+    normalize_images(args.root, args.thumbs, args.quality, args.workers, args.force, args.dry_run,
+                     args.rename_map)
@@ -0,0 +1,362 @@
+import os
+import time
+import queue
+import shutil
+import argparse
+import threading
+import multiprocessing as mp
+
+import numpy as np
+from PIL import Image
+from langdetect import detect, DetectorFactory
+from dedup_images import load_duplicates
+from text_gate import gate_paths, TEXT_THRESHOLD
+from ocr_store import OcrStore, STORE_PATH
+from metrics import metrics
+
+DetectorFactory.seed = 0  # langdetect is otherwise non-deterministic
+
+# CPU OCR filtering pipeline (port of the OCR_Images_Cleaned_Arabic.ipynb loop).
+# A producer walks SOURCE_DIR into a bounded queue of path batches; each worker
+# process keeps one warm easyocr Reader, caps its BLAS/torch threads so the
+# pool does not oversubscribe the cores, drops images the cheap text gate
+# says have no text, and OCRs the rest.
+# By default every image is OCRed at full resolution with paragraph=True, as in
+# the notebook: downscaling costs recall on small Arabic text, and paragraph
+# grouping decides what text language detection sees. --canvas N instead
+# letterboxes the batch onto N x N and OCRs it in one readtext_batched call,
+# which is faster but misses small text. Results are stored per languages and
+# mode, and --from-store reads the full-resolution ones unless --canvas is given.
+# Raw OCR output goes to the content-addressed OcrStore, so images already
+# OCRed (same bytes, any path) are never OCRed again and --from-store re-runs
+# the filters below over stored results without touching easyocr.
+# Images whose text is Arabic and free of stock-photo watermarks are copied
+# to DEST_DIR. Gate, decode and OCR times are recorded in each worker and sent
+# back to the parent's metrics when the worker finishes.
+
+SOURCE_DIR = "../raw_images"
+DEST_DIR = "../filtered_images/arabic"
+LANGUAGES = ["ar"]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Forbidden terms (watermark checks)
+WATERMARK_TERMS = ["shutterstock", "alamy", "123rf", "dreamstime", "getty", "istock", "depositphotos"]
+
+THREADS_PER_WORKER = 2
+WORKERS = max(1, (os.cpu_count() or 1) // THREADS_PER_WORKER)
+BATCH_SIZE = 8
+QUEUE_SIZE = 4  # batches buffered per worker
+CANVAS_SIZE = None  # full resolution; e.g. 1024 letterboxes batches onto one canvas size
+PARAGRAPH = True
+REPORT_EVERY = 500
+MIN_CONFIDENCE = 0.0  # drop OCR boxes below this confidence before filtering
+
+def contains_arabic(text):
+    return any('\u0600' <= c <= '\u06FF' for c in text)
+
+def is_valid_arabic(text):
+    try:
+        if detect(text) != 'ar':
+            return False
+        for term in WATERMARK_TERMS:
+            if term.lower() in text.lower():
+                return False
+        return True
+    except Exception:
+        return False
+
+def passes_filters(result, min_confidence=MIN_CONFIDENCE):
+    # Paragraph boxes carry no confidence
+    text = " ".join(
+        box[1] for box in result["boxes"] if box[2] is None or box[2] >= min_confidence
+    ).strip()
+    return bool(text) and contains_arabic(text) and is_valid_arabic(text)
+
+def limit_threads(threads):
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"):
+        os.environ[var] = str(threads)
+
+def create_reader(languages, threads):
+    # Thread caps must be in place before torch is imported in this process
+    limit_threads(threads)
+    import torch
+    import easyocr
+    torch.set_num_threads(threads)
+    return easyocr.Reader(languages, gpu=False, verbose=False)
+
+# Validate, downscale (JPEG draft mode) and letterbox onto a fixed canvas so a
+# batch stacks into one array without distorting the text.
+# Returns the array, the original size and the canvas -> original scale.
+def load_letterboxed(path, canvas=CANVAS_SIZE):
+    with Image.open(path) as img:
+        img.verify()
+    with Image.open(path) as img:
+        size = img.size
+        img.draft("RGB", (canvas, canvas))
+        img = img.convert("RGB")
+        img.thumbnail((canvas, canvas))
+        board = Image.new("RGB", (canvas, canvas), "white")
+        board.paste(img, (0, 0))
+    return np.asarray(board), size, size[0] / img.width
+
+# Validate and read the size; easyocr decodes the file itself, as in the notebook
+def load_full(path):
+    with Image.open(path) as img:
+        img.verify()
+    with Image.open(path) as img:
+        return img.size
+
+# OCR settings a stored result was produced with
+def ocr_mode(canvas):
+    return f"{'full' if canvas is None else f'canvas{canvas}'}-{'paragraph' if PARAGRAPH else 'lines'}"
+
+# easyocr detections are [bbox, text, confidence], or [bbox, text] with paragraph=True
+def to_result(detections, languages, size, scale, mode):
+    boxes = [
+        [[[round(float(x) * scale, 1), round(float(y) * scale, 1)] for x, y in detection[0]], detection[1],
+         float(detection[2]) if len(detection) > 2 else None]
+        for detection in detections
+    ]
+    return {
+        "languages": list(languages),
+        "mode": mode,
+        "width": size[0],
+        "height": size[1],
+        "text": " ".join(text for _, text, _ in boxes).strip(),
+        "boxes": boxes,
+    }
+
+# OCR one batch of paths: OCR store first, then the text gate, then easyocr for
+# the rest (one call per image, or one batched call with a canvas).
+# get_reader() builds the Reader on first use.
+# Output per image: (path, stat, content hash, result, status, error)
+# with status one of "cached", "ocr", "gated", "error"
+def ocr_batch(batch, store, get_reader, languages, canvas=CANVAS_SIZE, text_threshold=TEXT_THRESHOLD):
+    out, todo = [], {}
+    for path in batch:
+        try:
+            stat = os.stat(path)
+            content_hash = store.content_hash(path, stat)
+        except OSError as e:
+            out.append((path, None, None, None, "error", str(e)))
+            continue
+        cached = store.get(content_hash, languages, ocr_mode(canvas))
+        if cached is not None:
+            out.append((path, stat, content_hash, cached, "cached", None))
+        else:
+            todo[path] = (stat, content_hash)
+
+    with metrics.timer("ocr_gate"):
+        candidates, no_text = gate_paths(list(todo), text_threshold)
+    out.extend((path, None, None, None, "gated", None) for path in no_text)
+
+    mode = ocr_mode(canvas)
+    if canvas is None:
+        for path in candidates:
+            try:
+                with metrics.timer("ocr_decode"):
+                    size = load_full(path)
+                with metrics.timer("ocr_readtext"):
+                    found = get_reader().readtext(path, detail=1, paragraph=PARAGRAPH)
+                metrics.count("ocr_readtext_images")
+                stat, content_hash = todo[path]
+                out.append((path, stat, content_hash, to_result(found, languages, size, 1.0, mode), "ocr", None))
+            except Exception as e:
+                out.append((path, None, None, None, "error", str(e)))
+        return out
+
+    arrays, loaded = [], []
+    for path in candidates:
+        try:
+            with metrics.timer("ocr_decode"):
+                array, size, scale = load_letterboxed(path, canvas)
+            arrays.append(array)
+            loaded.append((path, size, scale))
+        except Exception as e:
+            out.append((path, None, None, None, "error", str(e)))
+
+    if arrays:
+        try:
+            reader = get_reader()
+            with metrics.timer("ocr_readtext"):
+                detections = reader.readtext_batched(arrays, detail=1, paragraph=PARAGRAPH, batch_size=len(arrays))
+            metrics.count("ocr_readtext_images", len(arrays))
+            for (path, size, scale), found in zip(loaded, detections):
+                stat, content_hash = todo[path]
+                out.append((path, stat, content_hash, to_result(found, languages, size, scale, mode), "ocr", None))
+        except Exception as e:
+            out.extend((path, None, None, None, "error", str(e)) for path, _, _ in loaded)
+    return out
+
+def ocr_worker(tasks, results, languages, threads, canvas, text_threshold, store_path):
+    readers = []
+    store = OcrStore(store_path)
+
+    def get_reader():
+        if not readers:
+            readers.append(create_reader(languages, threads))
+        return readers[0]
+
+    while True:
+        batch = tasks.get()
+        if batch is None:
+            break
+        results.put(ocr_batch(batch, store, get_reader, languages, canvas, text_threshold))
+    store.close()
+    results.put(metrics.snapshot())
+    results.put(None)
+
+def keep_image(path, dest_dir):
+    # Unique filename based on subfolder
+    folder_name = os.path.basename(os.path.dirname(path))
+    shutil.copy(path, os.path.join(dest_dir, f"{folder_name}_{os.path.basename(path)}"))
+
+def iter_images(source_dir, skip=frozenset()):
+    for root, _, files in os.walk(source_dir):
+        for fname in sorted(files):
+            if not fname.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.abspath(os.path.join(root, fname))
+            if path not in skip:
+                yield path
+
+def produce(tasks, paths, batch_size, workers):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) >= batch_size:
+            tasks.put(batch)  # blocks while the queue is full
+            batch = []
+    if batch:
+        tasks.put(batch)
+    for _ in range(workers):
+        tasks.put(None)
+
+def filter_images(source_dir=SOURCE_DIR, dest_dir=DEST_DIR, languages=LANGUAGES, workers=WORKERS,
+                  threads=THREADS_PER_WORKER, batch_size=BATCH_SIZE, canvas=CANVAS_SIZE, skip=frozenset(),
+                  text_threshold=TEXT_THRESHOLD, store_path=STORE_PATH, min_confidence=MIN_CONFIDENCE):
+    os.makedirs(dest_dir, exist_ok=True)
+    store = OcrStore(store_path)
+    ctx = mp.get_context("spawn")
+    tasks = ctx.Queue(maxsize=workers * QUEUE_SIZE)
+    results = ctx.Queue()
+
+    procs = [
+        ctx.Process(target=ocr_worker,
+                    args=(tasks, results, languages, threads, canvas, text_threshold, store_path),
+                    daemon=True)
+        for _ in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    producer = threading.Thread(
+        target=produce, args=(tasks, iter_images(source_dir, skip), batch_size, workers), daemon=True
+    )
+    producer.start()
+
+    print(f"🚀 OCR filtering with {workers} workers × {threads} threads, batches of {batch_size}")
+    start = time.time()
+    counts = {"cached": 0, "ocr": 0, "gated": 0, "error": 0}
+    total = kept = 0
+    finished = 0
+    while finished < workers:
+        try:
+            out = results.get(timeout=5)
+        except queue.Empty:
+            if not any(p.is_alive() for p in procs):
+                print("❌ All OCR workers exited unexpectedly.")
+                break
+            continue
+        if out is None:
+            finished += 1
+            continue
+        if isinstance(out, dict):
+            metrics.merge(out)
+            continue
+
+        for path, stat, content_hash, result, status, error in out:
+            total += 1
+            counts[status] += 1
+            metrics.count("ocr_images", status=status)
+            if result is None:
+                continue
+            if status == "ocr":
+                store.put(content_hash, result)
+            store.link(path, content_hash, stat)
+            if passes_filters(result, min_confidence):
+                keep_image(path, dest_dir)
+                kept += 1
+                metrics.count("ocr_kept")
+            if total % REPORT_EVERY == 0:
+                rate = total / (time.time() - start)
+                print(f"Processed {total} images ({rate:.1f} img/s)... Arabic-only: {kept}")
+        store.commit()
+
+    for p in procs:
+        p.join(timeout=5)
+    store.close()
+    elapsed = time.time() - start
+    rate = total / elapsed if elapsed else 0.0
+    print(f"\n✅ Done! Arabic-only images kept: {kept} / {total} ({counts['error']} unreadable) "
+          f"in {elapsed:.0f}s — {rate:.2f} images/s")
+    print(f"⚡ OCR calls: {counts['ocr']} run, {counts['cached']} served from the OCR store, "
+          f"{counts['gated']} skipped by the text gate")
+    return kept, total
+
+# Re-run the filters over stored OCR results only; no image is decoded or OCRed
+def filter_from_store(source_dir=SOURCE_DIR, dest_dir=DEST_DIR, store_path=STORE_PATH,
+                      min_confidence=MIN_CONFIDENCE, skip=frozenset(), languages=LANGUAGES, canvas=CANVAS_SIZE):
+    os.makedirs(dest_dir, exist_ok=True)
+    store = OcrStore(store_path)
+    total = kept = 0
+    mode = ocr_mode(canvas)
+    print(f"🗂️ Filtering stored {','.join(languages)} results in mode {mode}")
+    for path, result in store.iter_results(os.path.abspath(source_dir), languages, mode):
+        if path in skip or not os.path.exists(path):
+            continue
+        total += 1
+        if passes_filters(result, min_confidence):
+            keep_image(path, dest_dir)
+            kept += 1
+    store.close()
+    print(f"✅ Re-filtered from OCR store: kept {kept} / {total}")
+    return kept, total
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Keep images whose OCR text is Arabic and watermark-free (CPU)")
+    parser.add_argument("--source", default=SOURCE_DIR)
+    parser.add_argument("--dest", default=DEST_DIR)
+    parser.add_argument("--languages", nargs="+", default=LANGUAGES)
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="OCR processes; each holds its own easyocr Reader in memory")
+    parser.add_argument("--threads", type=int, default=THREADS_PER_WORKER,
+                        help="torch/BLAS threads per worker")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--canvas", type=int, default=CANVAS_SIZE,
+                        help="Letterbox batches onto N x N (e.g. 1024) and OCR each in one call: faster, "
+                             "lower recall on small text. Default: full resolution, one image per call")
+    parser.add_argument("--text-threshold", type=float, default=TEXT_THRESHOLD,
+                        help="Pre-OCR text gate threshold; lower keeps more images, 0 disables the gate")
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--from-store", action="store_true",
+                        help="Only re-apply the filters to stored OCR results (no OCR)")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="Skip images marked as near-duplicates by dedup_images.py")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    metrics.start_run("ocr_filter")
+    skip = frozenset()
+    if args.skip_duplicates:
+        skip = frozenset(load_duplicates())
+        print(f"⏩ Skipping {len(skip)} near-duplicate images")
+    if args.from_store:
+        filter_from_store(args.source, args.dest, args.store, args.min_confidence, skip,
+                          args.languages, args.canvas)
+    else:
+        filter_images(args.source, args.dest, args.languages, args.workers, args.threads,
+                      args.batch_size, args.canvas, skip, args.text_threshold,
+                      args.store, args.min_confidence)
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+# Content-addressed store of raw OCR output (boxes, text, confidence, image size).
+# Results are keyed by the SHA-256 of the image bytes, so identical files are
+# OCRed once, and a path table remembers each file's hash by size/mtime so
+# re-runs do not even re-hash. Filters (Arabic detection, watermark terms,
+# confidence) then run as a query over stored results instead of a new OCR pass.
+# Results are keyed by (hash, languages, mode), the mode being the resolution
+# and paragraph grouping they came from, so a run in one mode neither reuses
+# nor overwrites another mode's results.
+
+STORE_PATH = "../metadata/ocr_results.sqlite"
+LEGACY_MODE = "canvas1024-lines"  # results stored before modes were recorded
+
+OCR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr (
+    hash TEXT NOT NULL,
+    languages TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    text TEXT,
+    boxes TEXT,
+    created_at REAL,
+    PRIMARY KEY (hash, languages, mode)
+)
+"""
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class OcrStore:
+    def __init__(self, path=STORE_PATH):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1]: row[5] for row in self.conn.execute("PRAGMA table_info(ocr)")}
+        if columns and "mode" not in columns:
+            self.conn.execute(f"ALTER TABLE ocr ADD COLUMN mode TEXT DEFAULT '{LEGACY_MODE}'")
+        legacy = columns and [name for name, pk in columns.items() if pk] == ["hash"]
+        if legacy:
+            # Stores from before per-mode keys held one result per hash
+            self.conn.execute("ALTER TABLE ocr RENAME TO ocr_by_hash")
+        self.conn.execute(OCR_SCHEMA)
+        if legacy:
+            self.conn.execute(f"""
+                INSERT OR REPLACE INTO ocr (hash, languages, width, height, text, boxes, created_at, mode)
+                SELECT hash, COALESCE(languages, ''), width, height, text, boxes, created_at,
+                       COALESCE(mode, '{LEGACY_MODE}')
+                FROM ocr_by_hash
+            """)
+            self.conn.execute("DROP TABLE ocr_by_hash")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                size INTEGER,
+                mtime REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(hash)")
+        self.conn.commit()
+
+    # Hash of `path` if it is already known and unchanged, else hash it now
+    def content_hash(self, path, stat=None):
+        stat = stat or os.stat(path)
+        row = self.conn.execute("SELECT hash, size, mtime FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime:
+            return row[0]
+        return file_sha256(path)
+
+    # Stored result for these languages and mode; None matches any (newest first)
+    def get(self, content_hash, languages=None, mode=None):
+        row = self.conn.execute(
+            "SELECT languages, width, height, text, boxes, mode FROM ocr "
+            "WHERE hash = ? AND (? IS NULL OR languages = ?) AND (? IS NULL OR mode = ?) "
+            "ORDER BY created_at DESC LIMIT 1",
+            (content_hash, *_filters(languages, mode))
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "languages": row[0].split(","),
+            "mode": row[5],
+            "width": row[1],
+            "height": row[2],
+            "text": row[3],
+            "boxes": json.loads(row[4]),
+        }
+
+    def put(self, content_hash, result):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO ocr (hash, languages, width, height, text, boxes, created_at, mode) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (content_hash, ",".join(result["languages"]), result["width"], result["height"],
+             result["text"], json.dumps(result["boxes"], ensure_ascii=False), time.time(),
+             result.get("mode") or LEGACY_MODE)
+        )
+
+    def link(self, path, content_hash, stat):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (path, content_hash, stat.st_size, stat.st_mtime)
+        )
+
+    # (path, result) for every stored file under `prefix` with a result for these
+    # languages and mode
+    def iter_results(self, prefix="", languages=None, mode=None):
+        rows = self.conn.execute("""
+            SELECT f.path, o.languages, o.width, o.height, o.text, o.boxes, o.mode
+            FROM files f JOIN ocr o ON o.hash = f.hash
+            WHERE f.path >= ? AND f.path < ?
+              AND (? IS NULL OR o.languages = ?) AND (? IS NULL OR o.mode = ?)
+            ORDER BY f.path, o.created_at DESC
+        """, (prefix, prefix + "\uffff", *_filters(languages, mode)))
+        last = None
+        for path, languages, width, height, text, boxes, mode in rows:
+            if path == last:
+                continue  # with a filter left open, only the newest result per file
+            last = path
+            yield path, {
+                "languages": languages.split(","),
+                "mode": mode,
+                "width": width,
+                "height": height,
+                "text": text,
+                "boxes": json.loads(boxes),
+            }
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+def _filters(languages, mode):
+    joined = ",".join(languages) if languages is not None else None
+    return joined, joined, mode, mode
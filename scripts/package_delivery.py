@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import zipfile
+import argparse
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from ocr_store import file_sha256
+
+# Incremental packaging of a cleaned image folder for the daily delivery.
+# Already-compressed formats (JPEG, PNG, ...) are stored as-is instead of being
+# deflated again, files are hashed in parallel, and the delivery can be split
+# into parts written concurrently. Every delivery leaves a manifest of the
+# whole folder (path, size, mtime, sha256, delivery that shipped it); the next
+# run compares against it and packs only new or changed files, re-hashing only
+# those whose size/mtime moved. Files gone since then are listed as removed.
+
+SOURCE_DIR = "../filtered_images/arabic"
+OUT_DIR = "../deliveries"
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".zip", ".gz")
+MANIFEST_SUFFIX = ".manifest.json"
+WORKERS = 8
+
+def compress_type(path):
+    if path.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def iter_files(source_dir):
+    for root, dirnames, files in os.walk(source_dir):
+        dirnames.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, source_dir).replace(os.sep, "/"), os.stat(path)
+
+def latest_manifest(out_dir):
+    if not os.path.isdir(out_dir):
+        return None
+    manifests = sorted(
+        (os.path.join(out_dir, name) for name in os.listdir(out_dir) if name.endswith(MANIFEST_SUFFIX)),
+        key=os.path.getmtime,
+    )
+    return manifests[-1] if manifests else None
+
+def load_manifest(path):
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["files"]
+
+# Current state of source_dir as manifest entries, plus the paths that
+# must ship (new or content changed since `previous`)
+def scan_changes(source_dir, previous, name, workers=WORKERS):
+    files, to_hash = {}, []
+    for rel_path, stat in iter_files(source_dir):
+        old = previous.get(rel_path)
+        if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+            files[rel_path] = old
+        else:
+            to_hash.append((rel_path, stat))
+
+    changed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = pool.map(lambda item: file_sha256(os.path.join(source_dir, item[0])), to_hash)
+        for (rel_path, stat), sha256 in zip(to_hash, hashes):
+            old = previous.get(rel_path)
+            if old and old["sha256"] == sha256:
+                files[rel_path] = dict(old, mtime=stat.st_mtime)  # touched, same bytes
+                continue
+            files[rel_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256, "delivery": name}
+            changed.append(rel_path)
+    return files, sorted(changed)
+
+# Greedy split into `parts` groups of roughly equal byte size
+def split_parts(paths, files, parts):
+    groups = [[] for _ in range(max(1, parts))]
+    sizes = [0] * len(groups)
+    for rel_path in sorted(paths, key=lambda p: -files[p]["size"]):
+        i = sizes.index(min(sizes))
+        groups[i].append(rel_path)
+        sizes[i] += files[rel_path]["size"]
+    return [sorted(group) for group in groups if group]
+
+def write_archive(zip_path, source_dir, paths, files):
+    tmp_path = zip_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", allowZip64=True) as zf:
+        for rel_path in paths:
+            zf.write(os.path.join(source_dir, rel_path), rel_path, compress_type=compress_type(rel_path))
+        members = {p: {"size": files[p]["size"], "sha256": files[p]["sha256"]} for p in paths}
+        zf.writestr("MANIFEST.json", json.dumps(members, indent=2, ensure_ascii=False),
+                    compress_type=zipfile.ZIP_DEFLATED)
+    os.replace(tmp_path, zip_path)
+    return zip_path
+
+def package_delivery(source_dir=SOURCE_DIR, out_dir=OUT_DIR, name=None, previous_path=None,
+                     full=False, parts=1, workers=WORKERS):
+    os.makedirs(out_dir, exist_ok=True)
+    if not name:
+        # A second drop on the same day gets its own name instead of replacing the first
+        base = name = f"delivery_{date.today():%Y%m%d}"
+        n = 1
+        while os.path.exists(os.path.join(out_dir, name + MANIFEST_SUFFIX)):
+            n += 1
+            name = f"{base}_{n}"
+    if not full:
+        previous_path = previous_path or latest_manifest(out_dir)
+    previous = {} if full else load_manifest(previous_path)
+    if previous:
+        print(f"🔍 Comparing against {previous_path} ({len(previous)} files)")
+
+    start = time.time()
+    files, changed = scan_changes(source_dir, previous, name, workers)
+    removed = sorted(set(previous) - set(files))
+    if not changed:
+        print(f"⏩ Nothing new since the last delivery ({len(removed)} files removed)")
+
+    groups = split_parts(changed, files, parts)
+    if len(groups) == 1:
+        zip_paths = [os.path.join(out_dir, f"{name}.zip")]
+    else:
+        zip_paths = [os.path.join(out_dir, f"{name}.part{i + 1}of{len(groups)}.zip") for i in range(len(groups))]
+    with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+        archives = list(pool.map(lambda args: write_archive(args[0], source_dir, args[1], files),
+                                 zip(zip_paths, groups)))
+
+    manifest = {
+        "delivery": name,
+        "previous": os.path.basename(previous_path) if previous else None,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "archives": [os.path.basename(p) for p in archives],
+        "added": changed,
+        "removed": removed,
+        "files": files,
+    }
+    manifest_path = os.path.join(out_dir, name + MANIFEST_SUFFIX)
+    with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    size = sum(files[p]["size"] for p in changed)
+    print(f"✅ {name}: {len(changed)} new/changed files ({size / 1e6:.1f} MB) in {len(archives)} archive(s), "
+          f"{len(files) - len(changed)} unchanged, {len(removed)} removed — {time.time() - start:.1f}s")
+    return manifest_path, archives
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Package new/changed images into a delivery zip plus manifest")
+    parser.add_argument("--source", default=SOURCE_DIR)
+    parser.add_argument("--out", default=OUT_DIR)
+    parser.add_argument("--name", default=None, help="Delivery name (default: delivery_YYYYMMDD)")
+    parser.add_argument("--previous", default=None, help="Manifest to diff against (default: latest in --out)")
+    parser.add_argument("--full", action="store_true", help="Ignore previous manifests and pack everything")
+    parser.add_argument("--parts", type=int, default=1, help="Split into N archives written in parallel")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Hashing threads")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    package_delivery(args.source, args.out, args.name, args.previous, args.full, args.parts, args.workers)
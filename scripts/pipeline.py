@@ -0,0 +1,253 @@
+import time
+import queue
+import asyncio
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor
+
+# Small streaming pipeline engine: stages connected by bounded queues.
+# Each stage has its own executor ("threads", "processes" or "asyncio") and
+# worker count, so a slow stage can be widened without touching the others,
+# and downstream stages start on the first items while upstream is still busy.
+# A stage function takes one item (or a list of items when batch is set) and
+# returns an iterable of outputs, or None. Failed items are logged, counted
+# and dropped, as the standalone scripts do.
+
+QUEUE_SIZE = 256
+BATCH_WAIT = 0.5  # seconds a partial batch waits for more items
+_DONE = object()
+
+class Stage:
+    # finish() runs once after the last item and may return more outputs;
+    # close() releases resources. With the "threads" executor both run on the
+    # stage's own executor (so thread-bound handles like SQLite stay valid);
+    # with "asyncio" they may be coroutines.
+    def __init__(self, name, fn, executor="threads", workers=1, batch=None, queue_size=None,
+                 finish=None, close=None, initializer=None, initargs=()):
+        if executor not in ("threads", "processes", "asyncio"):
+            raise ValueError(f"unknown executor {executor!r} for stage {name}")
+        self.name = name
+        self.fn = fn
+        self.executor = executor
+        self.workers = workers
+        self.batch = batch
+        self.queue_size = queue_size
+        self.finish = finish
+        self.close = close
+        self.initializer = initializer
+        self.initargs = initargs
+        self.stats = {"in": 0, "out": 0, "errors": 0, "busy": 0.0, "first_out": None, "done_at": None}
+        self._lock = threading.Lock()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _read(self, inq):
+        item = inq.get()
+        if item is _DONE or not self.batch:
+            return item
+        items = [item]
+        deadline = time.monotonic() + BATCH_WAIT
+        while len(items) < self.batch:
+            try:
+                item = inq.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _DONE:
+                inq.put(_DONE)  # seen again on the next read
+                break
+            items.append(item)
+        return items
+
+    def _emit(self, outputs, outq, started):
+        if started is not None:
+            self._count("busy", time.monotonic() - started)
+        for output in outputs or ():
+            if self.stats["first_out"] is None:
+                self.stats["first_out"] = time.monotonic()
+            outq.put(output)
+            self._count("out")
+
+    def _fail(self, e):
+        self._count("errors")
+        print(f"❌ [{self.name}] {type(e).__name__}: {e}")
+
+    def run(self, inq, outq):
+        try:
+            if self.executor == "asyncio":
+                asyncio.run(self._run_async(inq, outq))
+            else:
+                self._run_pool(inq, outq)
+        finally:
+            self.stats["done_at"] = time.monotonic()
+            outq.put(_DONE)
+
+    def _run_pool(self, inq, outq):
+        def make_pool():
+            if self.executor == "processes":
+                return ProcessPoolExecutor(self.workers, mp_context=mp.get_context("spawn"),
+                                           initializer=self.initializer, initargs=self.initargs)
+            return ThreadPoolExecutor(self.workers, initializer=self.initializer, initargs=self.initargs)
+
+        pool = make_pool()
+        if self.executor == "processes":
+            local = lambda fn: fn()
+        else:
+            local = lambda fn: pool.submit(fn).result()
+
+        # A worker process that dies (e.g. killed for memory) breaks the whole
+        # pool; its in-flight items fail and a fresh pool takes the rest
+        def submit(item):
+            nonlocal pool
+            try:
+                return pool.submit(self.fn, item)
+            except BrokenExecutor as e:
+                print(f"⚠️ [{self.name}] worker pool broke ({e}); starting a new one")
+                pool.shutdown(wait=False)
+                pool = make_pool()
+                return pool.submit(self.fn, item)
+
+        # Futures are emitted in submission order by a separate thread; the
+        # semaphore bounds how much work is in flight at once
+        slots = threading.Semaphore(self.workers * 2)
+        pending = queue.Queue()
+
+        def emitter():
+            while True:
+                entry = pending.get()
+                if entry is None:
+                    return
+                future, started = entry
+                try:
+                    self._emit(future.result(), outq, started)
+                except Exception as e:
+                    self._fail(e)
+                finally:
+                    slots.release()
+
+        emit_thread = threading.Thread(target=emitter, daemon=True)
+        emit_thread.start()
+        try:
+            try:
+                while True:
+                    item = self._read(inq)
+                    if item is _DONE:
+                        break
+                    self._count("in", len(item) if self.batch else 1)
+                    slots.acquire()
+                    try:
+                        future = submit(item)
+                    except Exception as e:
+                        slots.release()
+                        self._fail(e)
+                        continue
+                    pending.put((future, time.monotonic()))
+            except Exception as e:
+                # Keep reading to the end so upstream stages never block on a full queue
+                self._fail(e)
+                while self._read(inq) is not _DONE:
+                    self._count("errors")
+            finally:
+                pending.put(None)
+                emit_thread.join()
+            if self.finish:
+                try:
+                    self._emit(local(self.finish), outq, None)
+                except Exception as e:
+                    self._fail(e)
+            if self.close:
+                local(self.close)
+        finally:
+            pool.shutdown(wait=True)
+
+    async def _run_async(self, inq, outq):
+        loop = asyncio.get_running_loop()
+        work = asyncio.Queue(maxsize=self.workers)
+
+        async def reader():
+            while True:
+                item = await loop.run_in_executor(None, self._read, inq)
+                if item is _DONE:
+                    break
+                self._count("in", len(item) if self.batch else 1)
+                await work.put(item)
+            for _ in range(self.workers):
+                await work.put(_DONE)
+
+        async def worker():
+            while True:
+                item = await work.get()
+                if item is _DONE:
+                    return
+                started = time.monotonic()
+                try:
+                    outputs = await self.fn(item)
+                except Exception as e:
+                    self._fail(e)
+                    continue
+                await loop.run_in_executor(None, self._emit, outputs, outq, started)
+
+        await asyncio.gather(reader(), *[worker() for _ in range(self.workers)])
+        if self.finish:
+            try:
+                outputs = self.finish()
+                if asyncio.iscoroutine(outputs):
+                    outputs = await outputs
+                self._emit(outputs, outq, None)
+            except Exception as e:
+                self._fail(e)
+        if self.close:
+            result = self.close()
+            if asyncio.iscoroutine(result):
+                await result
+
+class Pipeline:
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+
+    # Feed `source` through every stage; on_output(item) sees what the last
+    # stage emits. Returns the number of final outputs.
+    def run(self, source, on_output=None):
+        queues = [queue.Queue(maxsize=self.queue_size)]
+        for stage in self.stages:
+            queues.append(queue.Queue(maxsize=stage.queue_size or self.queue_size))
+
+        def feed():
+            try:
+                for item in source:
+                    queues[0].put(item)
+            except Exception as e:
+                print(f"❌ [source] {type(e).__name__}: {e}")
+            finally:
+                queues[0].put(_DONE)
+
+        self.started = time.monotonic()
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for stage, inq, outq in zip(self.stages, queues, queues[1:]):
+            threads.append(threading.Thread(target=stage.run, args=(inq, outq), daemon=True))
+        for t in threads:
+            t.start()
+
+        count = 0
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            count += 1
+            if on_output:
+                on_output(item)
+        for t in threads:
+            t.join()
+        self.elapsed = time.monotonic() - self.started
+        return count
+
+    def report(self):
+        print(f"\n📊 Pipeline finished in {self.elapsed:.1f}s")
+        for stage in self.stages:
+            s = stage.stats
+            first = f"{s['first_out'] - self.started:.1f}s" if s["first_out"] else "-"
+            done = f"{s['done_at'] - self.started:.1f}s" if s["done_at"] else "-"
+            print(f"   {stage.name:<10} {stage.executor:<9} ×{stage.workers:<3} in {s['in']:<7} out {s['out']:<7} "
+                  f"errors {s['errors']:<5} first out {first:<7} done {done}")
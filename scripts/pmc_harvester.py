@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from xml.etree import ElementTree as ET
+
+import requests
+from dotenv import load_dotenv
+
+from rate_limiter import with_rate_limit, set_rate
+from image_downloader import ImageDownloader
+from normalize_images import save_download
+from metrics import metrics
+
+# PubMed Central figure harvester for large result sets.
+# One esearch puts the whole result set on the NCBI history server
+# (usehistory=y); efetch then pulls BATCH_SIZE articles per call by
+# WebEnv / query_key. Each efetch body is parsed with iterparse as it streams
+# in: figures are emitted as soon as their </fig> closes and every <article>
+# is cleared once read, so memory stays flat however large the batch.
+# Parsing runs on a background thread a bounded number of figures ahead of
+# the downloads, which go through ImageDownloader's pool. Each saved image gets
+# a line in OUTPUT_PATH with its PMC id, figure label and caption.
+
+load_dotenv()
+ENTREZ_URL = os.getenv("ENTREZ_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils")
+PMC_ARTICLES_URL = os.getenv("PMC_ARTICLES_URL", "https://www.ncbi.nlm.nih.gov/pmc/articles")
+ENTREZ_EMAIL = os.getenv("ENTREZ_EMAIL")
+NCBI_API_KEY = os.getenv("NCBI_API_KEY")
+TOOL = "vqa_dataset_project"
+
+QUERY = "annotated brain MRI"
+SAVE_DIR = "../raw_images/medicine/radiology/pmc"
+OUTPUT_PATH = "../metadata/pmc_figures.jsonl"
+BATCH_SIZE = 100
+WORKERS = 16
+PREFETCH_FIGURES = 500
+BATCH_RETRIES = 3
+RETRY_DELAY = 2.0  # seconds, doubled after each failed attempt
+API_KEY_RATE = 10.0  # NCBI allows 10 req/s with a key, 3 without
+
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+WEB_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
+PRINT_EXTENSIONS = (".tif", ".tiff", ".eps")
+
+def entrez_params(**params):
+    params["tool"] = TOOL
+    if ENTREZ_EMAIL:
+        params["email"] = ENTREZ_EMAIL
+    if NCBI_API_KEY:
+        params["api_key"] = NCBI_API_KEY
+    return params
+
+def request_entrez(session, endpoint, params, stream=False):
+    response = session.get(f"{ENTREZ_URL}/{endpoint}", params=params, stream=stream, timeout=60)
+    response.raise_for_status()
+    return response
+
+# (count, WebEnv, query_key) of a search stored on the history server
+def search_history(session, query):
+    with metrics.timer("entrez_request", op="esearch"):
+        response = with_rate_limit("entrez", request_entrez, session, "esearch.fcgi",
+                                   entrez_params(db="pmc", term=query, usehistory="y", retmax=0))
+    root = ET.fromstring(response.content)
+    if root.findtext("ERROR"):
+        raise ValueError(root.findtext("ERROR"))
+    return int(root.findtext("Count") or 0), root.findtext("WebEnv"), root.findtext("QueryKey")
+
+# PMC serves web renditions of figures as <href>.jpg; hrefs usually carry no extension
+def figure_url(pmc_id, href):
+    stem, ext = os.path.splitext(href)
+    if ext.lower() not in WEB_EXTENSIONS:
+        href = (stem if ext.lower() in PRINT_EXTENSIONS else href) + ".jpg"
+    return f"{PMC_ARTICLES_URL}/PMC{pmc_id}/bin/{href}"
+
+def text_of(elem):
+    return " ".join("".join(elem.itertext()).split()) if elem is not None else None
+
+# Figures of one efetch body as it is parsed
+def iter_figures(stream, counts):
+    events = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(events)
+    pmc_id = None
+    for event, elem in events:
+        if event == "start":
+            continue
+        if elem.tag == "article-id" and pmc_id is None and elem.get("pub-id-type") in ("pmc", "pmcid"):
+            pmc_id = (elem.text or "").strip().removeprefix("PMC")
+        elif elem.tag == "fig":
+            if pmc_id:
+                for graphic in elem.iter("graphic"):
+                    href = graphic.get(XLINK_HREF)
+                    if href:
+                        yield {
+                            "pmc_id": pmc_id,
+                            "figure_id": elem.get("id"),
+                            "label": text_of(elem.find("label")),
+                            "caption": text_of(elem.find("caption")),
+                            "url": figure_url(pmc_id, href),
+                        }
+            elem.clear()
+        elif elem.tag == "article":
+            counts["articles"] += 1
+            pmc_id = None
+            root.clear()
+
+# A batch whose connection drops mid-stream is fetched again; the figures it
+# already yielded are skipped and its article count starts over
+def iter_batches(session, webenv, query_key, total, batch_size, counts,
+                 retries=BATCH_RETRIES, retry_delay=RETRY_DELAY):
+    for start in range(0, total, batch_size):
+        params = entrez_params(db="pmc", WebEnv=webenv, query_key=query_key, retstart=start,
+                               retmax=min(batch_size, total - start), retmode="xml")
+        articles, yielded = counts["articles"], 0
+        for attempt in range(retries + 1):
+            counts["articles"] = articles
+            try:
+                with metrics.timer("entrez_request", op="efetch"):
+                    response = with_rate_limit("entrez", request_entrez, session, "efetch.fcgi", params, stream=True)
+                with response:
+                    response.raw.decode_content = True
+                    for n, figure in enumerate(iter_figures(response.raw, counts)):
+                        if n >= yielded:
+                            yielded += 1
+                            yield figure
+                metrics.count("pmc_articles", counts["articles"] - articles)
+                break
+            except Exception as e:
+                metrics.count("pmc_batch_errors")
+                if attempt == retries:
+                    print(f"⛔ efetch batch at {start} failed: {e}")
+                    break
+                print(f"⚠️ efetch batch at {start} broke off ({type(e).__name__}: {e}), retrying")
+                time.sleep(retry_delay * 2 ** attempt)
+
+# Runs `iterable` on a background thread, at most `size` items ahead of the
+# consumer; an exception on that thread is raised again in the consumer
+def prefetch(iterable, size):
+    items = queue.Queue(size)
+    done = object()
+    failure = []
+
+    def run():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            items.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    while (item := items.get()) is not done:
+        yield item
+    if failure:
+        raise failure[0]
+
+def load_done(out_path):
+    done = set()
+    if os.path.exists(out_path):
+        with open(out_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    done.add(json.loads(line)["url"])
+    return done
+
+def harvest_pmc(query=QUERY, save_dir=SAVE_DIR, out_path=OUTPUT_PATH, max_articles=None, batch_size=BATCH_SIZE,
+                workers=WORKERS, resume=False):
+    if NCBI_API_KEY:
+        set_rate("entrez", API_KEY_RATE)
+    session = requests.Session()
+    count, webenv, query_key = search_history(session, query)
+    total = min(count, max_articles) if max_articles else count
+    print(f"✅ {count} articles match '{query}', fetching {total} in batches of {batch_size}")
+
+    done = load_done(out_path) if resume else set()
+    if done:
+        print(f"⏩ Resuming: {len(done)} figures already saved")
+    counts = {"articles": 0, "figures": 0, "saved": 0, "failed": 0, "bytes": 0}
+    pending = deque()  # download_all yields in input order
+
+    def urls():
+        figures = prefetch(iter_batches(session, webenv, query_key, total, batch_size, counts), PREFETCH_FIGURES)
+        for figure in figures:
+            if figure["url"] in done:
+                continue
+            counts["figures"] += 1
+            pending.append(figure)
+            yield figure["url"]
+
+    os.makedirs(save_dir, exist_ok=True)
+    folder = os.path.dirname(out_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with ImageDownloader(workers=workers, min_size=0, max_aspect=None) as downloader, \
+            open(out_path, "a", encoding="utf-8") as out:
+        for download in downloader.download_all(urls()):
+            figure = pending.popleft()
+            if not download.ok:
+                counts["failed"] += 1
+                print(f"⚠️ Failed to download {download.url}: {download.error}")
+                continue
+            name = os.path.splitext(figure["url"].rsplit("/", 1)[1])[0]
+            path = save_download(download, os.path.join(save_dir, f"PMC{figure['pmc_id']}_{name}"))
+            out.write(json.dumps(dict(figure, query=query, file=os.path.abspath(path),
+                                      width=download.width, height=download.height), ensure_ascii=False) + "\n")
+            counts["saved"] += 1
+            counts["bytes"] += len(download.content)
+            if counts["saved"] % 100 == 0:
+                print(f"📥 {counts['saved']} figures from {counts['articles']} articles")
+    session.close()
+
+    print(f"🎉 {counts['articles']} articles, {counts['saved']} figures saved, {counts['failed']} failed")
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Harvest figures, labels and captions from PubMed Central")
+    parser.add_argument("--query", default=QUERY)
+    parser.add_argument("--max-articles", type=int, default=None, help="Default: every matching article")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Articles per efetch call")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Concurrent figure downloads")
+    parser.add_argument("--save-dir", default=SAVE_DIR)
+    parser.add_argument("--out", default=OUTPUT_PATH)
+    parser.add_argument("--resume", action="store_true", help="Skip figures already listed in --out")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    metrics.start_run("pmc_harvester")
+    harvest_pmc(args.query, args.save_dir, args.out, args.max_articles, args.batch_size, args.workers, args.resume)
@@ -1,30 +1,36 @@
 import os
-import requests
 from tqdm import tqdm
 from xml.etree import ElementTree as ET
 from Bio import Entrez
+from image_downloader import ImageDownloader
+from normalize_images import save_download
+from metrics import metrics
 
 # ---- Config ----
 Entrez.email = "your_email@example.com"  # Replace with your actual email
 query = "annotated brain MRI"
 max_articles = 15
+workers = 16
 save_dir = "../raw_images/medicine/radiology/brain_scan"
 os.makedirs(save_dir, exist_ok=True)
+metrics.start_run("pubmed_scraper")
 
 print("🔍 Searching PubMed Central...")
-handle = Entrez.esearch(db="pmc", term=query, retmax=max_articles)
-record = Entrez.read(handle)
+with metrics.timer("entrez_request", op="esearch"):
+    handle = Entrez.esearch(db="pmc", term=query, retmax=max_articles)
+    record = Entrez.read(handle)
 pmc_ids = record["IdList"]
 
 print(f"✅ Found {len(pmc_ids)} articles")
 
 valid_extensions = [".jpg", ".jpeg", ".png"]
-count = 1
+image_urls = []
 
 for pmc_id in tqdm(pmc_ids):
     try:
-        fetch = Entrez.efetch(db="pmc", id=pmc_id, rettype="full", retmode="xml")
-        tree = ET.parse(fetch)
+        with metrics.timer("entrez_request", op="efetch"):
+            fetch = Entrez.efetch(db="pmc", id=pmc_id, rettype="full", retmode="xml")
+            tree = ET.parse(fetch)
         root = tree.getroot()
 
         for fig in root.findall(".//fig"):
@@ -36,15 +42,18 @@ for pmc_id in tqdm(pmc_ids):
                     if not any(href.lower().endswith(ext) for ext in valid_extensions):
                         continue
 
-                    image_url = f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/bin/{href}"
-                    try:
-                        response = requests.get(image_url, timeout=10)
-                        if response.status_code == 200 and response.content:
-                            file_path = os.path.join(save_dir, f"brain_scan_{count}.jpg")
-                            with open(file_path, "wb") as f:
-                                f.write(response.content)
-                            count += 1
-                    except Exception as err:
-                        print(f"⚠️ Failed to download {image_url}: {err}")
+                    image_urls.append(f"https://www.ncbi.nlm.nih.gov/pmc/articles/PMC{pmc_id}/bin/{href}")
     except Exception as e:
-        print(f"⛔ Error with article {pmc_id}: {e}")
\ No newline at end of file
+        print(f"⛔ Error with article {pmc_id}: {e}")
+
+print(f"📥 Downloading {len(image_urls)} figures...")
+count = 1
+# Figures are kept whatever their size; only non-image responses are dropped
+with ImageDownloader(workers=workers, min_size=0, max_aspect=None) as downloader:
+    for download in tqdm(downloader.download_all(image_urls), total=len(image_urls)):
+        if not download.ok:
+            print(f"⚠️ Failed to download {download.url}: {download.error}")
+            continue
+        # PNG diagrams stay PNG instead of being written as .jpg
+        save_download(download, os.path.join(save_dir, f"brain_scan_{count}"))
+        count += 1
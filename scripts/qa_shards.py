@@ -0,0 +1,300 @@
+import os
+import io
+import json
+import random
+import tarfile
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# torch is optional: with it QAShardDataset is a real IterableDataset
+try:
+    from torch.utils.data import IterableDataset as DatasetBase
+except ImportError:
+    DatasetBase = object
+
+# Sharded tar packing of qa_data for training/evaluation.
+# Every qa_data/*.jsonl record is paired with its image bytes and written as
+# two consecutive tar members, <key>.json and <key>.<ext>, into fixed-size
+# uncompressed shards ordered by taxonomy path (domain, subdomain, theme).
+# index.json lists every shard with its sample count, size and first/last
+# taxonomy path. iter_dataset() streams shards back sequentially with an
+# optional shuffle buffer and splits shards across ranks and loader workers.
+
+QA_DIR = "../qa_data"
+IMAGES_ROOT = "../raw_images"
+SHARD_DIR = "../shards/qa"
+SHARD_BYTES = 256 * 1024 * 1024
+SHARD_PATTERN = "qa-{:06d}.tar"
+INDEX_NAME = "index.json"
+READ_AHEAD = 64  # image files read in parallel ahead of the tar writer
+SHUFFLE_BUFFER = 1000
+
+def taxonomy_sort_key(record):
+    return (record.get("domain") or "", record.get("subdomain") or "",
+            record.get("theme") or "", record.get("image_path") or "")
+
+# (sort key, file, byte offset) for every record; only keys are held in memory
+def scan_records(qa_dir):
+    entries = []
+    for name in sorted(os.listdir(qa_dir)):
+        if not name.endswith(".jsonl"):
+            continue
+        path = os.path.join(qa_dir, name)
+        with open(path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip():
+                    try:
+                        entries.append((taxonomy_sort_key(json.loads(line)), path, offset))
+                    except ValueError:
+                        print(f"⚠️ Skipping malformed line in {name} at byte {offset}")
+                offset += len(line)
+    entries.sort()
+    return entries
+
+def iter_sorted_records(entries):
+    handles = {}
+    try:
+        for _, path, offset in entries:
+            f = handles.get(path) or handles.setdefault(path, open(path, "rb"))
+            f.seek(offset)
+            yield json.loads(f.readline())
+    finally:
+        for f in handles.values():
+            f.close()
+
+# image_path in the README points either into raw_images directly or
+# carries a leading "images/" / "raw_images/" component
+def resolve_image(image_path, images_root):
+    if not image_path:
+        return None
+    if os.path.isabs(image_path):
+        return image_path if os.path.exists(image_path) else None
+    candidate = os.path.join(images_root, image_path)
+    if os.path.exists(candidate):
+        return candidate
+    parts = image_path.replace("\\", "/").split("/", 1)
+    if len(parts) == 2:
+        candidate = os.path.join(images_root, parts[1])
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def read_image(record, images_root):
+    path = resolve_image(record.get("image_path"), images_root)
+    if path is None:
+        return record, None, None
+    with open(path, "rb") as f:
+        data = f.read()
+    ext = os.path.splitext(path)[1].lstrip(".").lower() or "bin"
+    return record, data, ext
+
+# Same order as `records`, with at most READ_AHEAD image reads in flight
+def iter_with_images(records, images_root, workers=8, read_ahead=READ_AHEAD):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        for record in records:
+            window.append(pool.submit(read_image, record, images_root))
+            if len(window) >= read_ahead:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+def _add_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o444
+    info.mtime = 0  # reproducible shards
+    tar.addfile(info, io.BytesIO(data))
+
+class ShardWriter:
+    def __init__(self, out_dir, shard_bytes=SHARD_BYTES):
+        self.out_dir = out_dir
+        self.shard_bytes = shard_bytes
+        self.shards = []
+        self.tar = None
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _open(self):
+        name = SHARD_PATTERN.format(len(self.shards))
+        self.tar = tarfile.open(os.path.join(self.out_dir, name), "w", format=tarfile.USTAR_FORMAT)
+        self.shards.append({"path": name, "samples": 0, "bytes": 0, "first": None, "last": None})
+
+    def _close(self):
+        if self.tar is not None:
+            self.tar.close()
+            shard = self.shards[-1]
+            shard["bytes"] = os.path.getsize(os.path.join(self.out_dir, shard["path"]))
+            self.tar = None
+
+    def write(self, key, record, image, ext):
+        if self.tar is None:
+            self._open()
+        shard = self.shards[-1]
+        taxonomy = " > ".join(p for p in taxonomy_sort_key(record)[:3] if p)
+        _add_member(self.tar, f"{key}.json", json.dumps(record, ensure_ascii=False).encode("utf-8"))
+        _add_member(self.tar, f"{key}.{ext}", image)
+        shard["samples"] += 1
+        shard["first"] = shard["first"] or taxonomy
+        shard["last"] = taxonomy
+        if self.tar.offset >= self.shard_bytes:
+            self._close()
+
+    def close(self):
+        self._close()
+        return self.shards
+
+def pack_qa_shards(qa_dir=QA_DIR, images_root=IMAGES_ROOT, out_dir=SHARD_DIR,
+                   shard_bytes=SHARD_BYTES, workers=8):
+    entries = scan_records(qa_dir)
+    print(f"🔍 {len(entries)} QA records found in {qa_dir}")
+    writer = ShardWriter(out_dir, shard_bytes)
+    written = missing = 0
+    for record, image, ext in iter_with_images(iter_sorted_records(entries), images_root, workers):
+        if image is None:
+            missing += 1
+            print(f"⚠️ Image not found for {record.get('image_id')}: {record.get('image_path')}")
+            continue
+        writer.write(f"{written:09d}", record, image, ext)
+        written += 1
+    shards = writer.close()
+
+    index = {"samples": written, "shard_bytes": shard_bytes, "shards": shards}
+    tmp_path = os.path.join(out_dir, INDEX_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(out_dir, INDEX_NAME))
+    print(f"✅ {written} samples in {len(shards)} shards → {out_dir} ({missing} missing images)")
+    return index
+
+def load_shard_index(shard_dir=SHARD_DIR):
+    with open(os.path.join(shard_dir, INDEX_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# Samples of one shard as {"key", "record", "image", "ext"}, read sequentially
+def iter_shard(path):
+    with tarfile.open(path, "r|") as tar:
+        sample = {}
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, ext = member.name.rsplit(".", 1)
+            if sample and sample["key"] != key:
+                yield sample
+                sample = {}
+            data = tar.extractfile(member).read()
+            sample["key"] = key
+            if ext == "json":
+                sample["record"] = json.loads(data)
+            else:
+                sample["image"] = data
+                sample["ext"] = ext
+        if sample:
+            yield sample
+
+def shuffle_buffer(samples, size=SHUFFLE_BUFFER, rng=None):
+    rng = rng or random.Random()
+    buf = []
+    for sample in samples:
+        if len(buf) < size:
+            buf.append(sample)
+            continue
+        i = rng.randrange(size)
+        yield buf[i]
+        buf[i] = sample
+    rng.shuffle(buf)
+    yield from buf
+
+# (worker id, worker count) of the current torch DataLoader worker, if any
+def loader_worker():
+    try:
+        from torch.utils.data import get_worker_info
+    except ImportError:
+        return 0, 1
+    info = get_worker_info()
+    return (info.id, info.num_workers) if info else (0, 1)
+
+# Shards for this rank/worker; the shard order is shuffled with the same seed
+# everywhere so the split stays disjoint. Ranks split the shards first and each
+# rank's workers split its share, so a rank's shards do not depend on num_workers.
+def select_shards(shards, rank=0, world_size=1, worker=0, num_workers=1, seed=None):
+    shards = list(shards)
+    if seed is not None:
+        random.Random(seed).shuffle(shards)
+    return shards[rank::world_size][worker::num_workers]
+
+def iter_dataset(shard_dir=SHARD_DIR, rank=0, world_size=1, worker=None, num_workers=None,
+                 shuffle=0, seed=None, decode=False):
+    if worker is None or num_workers is None:
+        worker, num_workers = loader_worker()
+    index = load_shard_index(shard_dir)
+    shards = select_shards(index["shards"], rank, world_size, worker, num_workers, seed)
+    samples = (
+        sample
+        for shard in shards
+        for sample in iter_shard(os.path.join(shard_dir, shard["path"]))
+    )
+    if shuffle:
+        rng = random.Random(None if seed is None else f"{seed}-{rank}-{worker}")
+        samples = shuffle_buffer(samples, shuffle, rng)
+    for sample in samples:
+        if decode:
+            sample["image"] = decode_image(sample["image"])
+        yield sample
+
+def decode_image(data):
+    from PIL import Image
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+# A torch IterableDataset when torch is installed (a plain iterable otherwise),
+# so DataLoader(QAShardDataset(...), num_workers=4) streams it; each loader
+# worker picks its own shards through get_worker_info()
+class QAShardDataset(DatasetBase):
+    def __init__(self, shard_dir=SHARD_DIR, rank=0, world_size=1, shuffle=SHUFFLE_BUFFER, seed=0, decode=False):
+        self.shard_dir = shard_dir
+        self.rank = rank
+        self.world_size = world_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.decode = decode
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        seed = None if self.seed is None else self.seed + self.epoch
+        return iter_dataset(self.shard_dir, self.rank, self.world_size,
+                            shuffle=self.shuffle, seed=seed, decode=self.decode)
+
+    # Samples this rank iterates in the current epoch, from the per-shard counts
+    def __len__(self):
+        seed = None if self.seed is None else self.seed + self.epoch
+        shards = select_shards(load_shard_index(self.shard_dir)["shards"], self.rank, self.world_size, seed=seed)
+        return sum(shard["samples"] for shard in shards)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pack qa_data into tar shards, or stream them back")
+    parser.add_argument("--qa-dir", default=QA_DIR)
+    parser.add_argument("--images", default=IMAGES_ROOT)
+    parser.add_argument("--out", default=SHARD_DIR)
+    parser.add_argument("--shard-mb", type=int, default=SHARD_BYTES // (1024 * 1024))
+    parser.add_argument("--workers", type=int, default=8, help="Threads reading image files ahead")
+    parser.add_argument("--read", action="store_true", help="Stream the shards in --out and count samples")
+    parser.add_argument("--rank", type=int, default=0)
+    parser.add_argument("--world-size", type=int, default=1)
+    parser.add_argument("--shuffle", type=int, default=0, help="Shuffle buffer size when reading")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.read:
+        count = 0
+        for sample in iter_dataset(args.out, args.rank, args.world_size, shuffle=args.shuffle):
+            count += 1
+        print(f"✅ Rank {args.rank}/{args.world_size} read {count} samples from {args.out}")
+    else:
+        pack_qa_shards(args.qa_dir, args.images, args.out, args.shard_mb * 1024 * 1024, args.workers)
@@ -0,0 +1,200 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import requests
+
+from metrics import metrics
+
+# Adaptive per-provider token buckets shared by every script that calls
+# Groq, OpenRouter, SerpAPI, Google, Entrez or the open archives. Rates creep
+# up while calls succeed and are halved on 429 / Retry-After, so each run goes
+# as fast as the provider allows. Buckets are thread-safe and have an asyncio entry point.
+# Every attempt is timed into the provider_request histogram (by provider and
+# outcome), and time spent waiting for a token into ratelimit_wait.
+
+# requests per second to start from, per provider
+DEFAULT_RATES = {
+    "openrouter": 5.0,
+    "serpapi": 5.0,
+    "groq": 0.5,
+    "google": 1.0,
+    "entrez": 3.0,
+    "nasa": 5.0,
+    "gallica": 1.0,
+    "nypl": 2.0,
+    "archive": 2.0,
+}
+DEFAULT_RATE = 2.0
+
+DECREASE_COOLDOWN = 1.0
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    aiohttp.ClientConnectionError,
+    asyncio.TimeoutError,
+)
+
+class TokenBucket:
+    def __init__(self, rate, burst=None, min_rate=None, max_rate=None, increase=0.05):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.min_rate = min_rate or rate / 20
+        self.max_rate = max_rate or rate * 4
+        self.increase = increase
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    # Take a token if one is available (returns 0), else return how long to wait.
+    # Nothing is reserved ahead, so waiters pick up rate changes on their next try.
+    def _try_take(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self._try_take()
+            if wait <= 0:
+                return
+            time.sleep(wait * random.uniform(1.0, 1.2))
+
+    async def acquire_async(self):
+        while True:
+            wait = self._try_take()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait * random.uniform(1.0, 1.2))
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * (1 + self.increase))
+
+    # Concurrent callers hitting the same 429 burst only halve the rate once
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            if now - self.last_decrease >= DECREASE_COOLDOWN:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.last_decrease = now
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_limiter(provider):
+    with _buckets_lock:
+        if provider not in _buckets:
+            _buckets[provider] = TokenBucket(DEFAULT_RATES.get(provider, DEFAULT_RATE))
+        return _buckets[provider]
+
+# Replace a provider's bucket, e.g. to lift the limits for local benchmarks
+def set_rate(provider, rate, burst=None):
+    with _buckets_lock:
+        _buckets[provider] = TokenBucket(rate, burst)
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# (status, headers) from requests, aiohttp and SDK (Groq) exceptions
+def _error_status(e):
+    response = getattr(e, "response", None)
+    status = getattr(e, "status_code", None) or getattr(e, "status", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    headers = getattr(e, "headers", None)
+    if headers is None and response is not None:
+        headers = getattr(response, "headers", None)
+    return status, headers or {}
+
+def _should_retry(e):
+    status, headers = _error_status(e)
+    if status in RETRY_STATUSES:
+        return True, status, parse_retry_after(headers.get("Retry-After"))
+    return isinstance(e, RETRY_ERRORS), status, None
+
+def _record_attempt(provider, started, retrying, status):
+    outcome = "retry" if retrying else "error"
+    metrics.observe("provider_request", time.perf_counter() - started, provider=provider, outcome=outcome)
+    if status:
+        metrics.count("provider_status", provider=provider, status=status)
+
+def with_rate_limit(provider, fn, *args, max_attempts=MAX_ATTEMPTS, **kwargs):
+    bucket = get_limiter(provider)
+    for attempt in range(max_attempts):
+        waited = time.perf_counter()
+        bucket.acquire()
+        started = time.perf_counter()
+        metrics.observe("ratelimit_wait", started - waited, provider=provider)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            retry, status, retry_after = _should_retry(e)
+            _record_attempt(provider, started, retry and attempt < max_attempts - 1, status)
+            if not retry or attempt == max_attempts - 1:
+                raise
+            if status == 429:
+                bucket.on_throttle(retry_after)
+            delay = max(retry_after or 0, backoff_delay(attempt))
+            print(f"⏳ {provider} throttled ({status or type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        metrics.observe("provider_request", time.perf_counter() - started, provider=provider, outcome="ok")
+        bucket.on_success()
+        return result
+
+async def with_rate_limit_async(provider, fn, *args, max_attempts=MAX_ATTEMPTS, **kwargs):
+    bucket = get_limiter(provider)
+    for attempt in range(max_attempts):
+        waited = time.perf_counter()
+        await bucket.acquire_async()
+        started = time.perf_counter()
+        metrics.observe("ratelimit_wait", started - waited, provider=provider)
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            retry, status, retry_after = _should_retry(e)
+            _record_attempt(provider, started, retry and attempt < max_attempts - 1, status)
+            if not retry or attempt == max_attempts - 1:
+                raise
+            if status == 429:
+                bucket.on_throttle(retry_after)
+            delay = max(retry_after or 0, backoff_delay(attempt))
+            print(f"⏳ {provider} throttled ({status or type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        metrics.observe("provider_request", time.perf_counter() - started, provider=provider, outcome="ok")
+        bucket.on_success()
+        return result
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+
+from metrics import metrics
+
+# On-disk cache for paid LLM / image-search calls.
+# Entries are keyed by provider, model, prompt (or query) and parameters,
+# expire after a TTL and are evicted least-recently-used past a size budget.
+# get_or_call counts hits, misses and shared in-flight calls per provider.
+CACHE_PATH = os.getenv("VQA_CACHE_PATH", "../.cache/responses.sqlite")
+CACHE_TTL = int(os.getenv("VQA_CACHE_TTL", 30 * 24 * 3600))
+CACHE_MAX_BYTES = int(os.getenv("VQA_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+MISSING = object()
+
+def make_key(provider, model, prompt, params=None):
+    raw = json.dumps([provider, model, prompt, params or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_async = {}
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    provider TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return MISSING
+            value, created_at = row
+            if self.ttl and now - created_at > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                return MISSING
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+        return json.loads(value)
+
+    def set(self, key, value, provider=""):
+        now = time.time()
+        payload = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, provider, payload, len(payload.encode("utf-8")), now, now)
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        if self.ttl:
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    # Return the cached value or call fn() once; concurrent callers asking for
+    # the same key wait for the first call instead of issuing their own.
+    # Only successful calls are stored, so errors are retried next run.
+    def get_or_call(self, provider, model, prompt, params, fn):
+        key = make_key(provider, model, prompt, params)
+        value = self.get(key)
+        if value is not MISSING:
+            metrics.count("cache_lookups", provider=provider, result="hit")
+            return value
+
+        with self._lock:
+            waiter = self._inflight.get(key)
+            if waiter is None:
+                waiter = self._inflight[key] = {"event": threading.Event()}
+                owner = True
+            else:
+                owner = False
+
+        metrics.count("cache_lookups", provider=provider, result="miss" if owner else "shared")
+        if not owner:
+            waiter["event"].wait()
+            if "error" in waiter:
+                raise waiter["error"]
+            if "value" not in waiter:
+                # The call we waited on was interrupted, not us: make the call ourselves
+                return self.get_or_call(provider, model, prompt, params, fn)
+            return waiter["value"]
+
+        try:
+            value = fn()
+            self.set(key, value, provider)
+            waiter["value"] = value
+            return value
+        except Exception as e:
+            waiter["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            waiter["event"].set()
+
+    async def get_or_call_async(self, provider, model, prompt, params, coro_fn):
+        key = make_key(provider, model, prompt, params)
+        value = self.get(key)
+        if value is not MISSING:
+            metrics.count("cache_lookups", provider=provider, result="hit")
+            return value
+
+        future = self._inflight_async.get(key)
+        if future is not None:
+            metrics.count("cache_lookups", provider=provider, result="shared")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The call we waited on was cancelled, not us: make the call ourselves
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    return await self.get_or_call_async(provider, model, prompt, params, coro_fn)
+                raise
+
+        metrics.count("cache_lookups", provider=provider, result="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight_async[key] = future
+        try:
+            value = await coro_fn()
+            self.set(key, value, provider)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited future does not log a warning
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled (or interrupted): release the waiters instead of leaving them hanging
+            if not future.done():
+                future.cancel()
+            raise
+        finally:
+            self._inflight_async.pop(key, None)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+# Shared instance used by the enrichment scripts
+cache = ResponseCache()
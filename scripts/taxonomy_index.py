@@ -0,0 +1,154 @@
+import os
+import json
+import pickle
+import bisect
+import hashlib
+import argparse
+from array import array
+
+# Flat, compiled view of a nested taxonomy JSON (taxonomy.json,
+# taxonomy_structure.json, link_dataset.json, domain_image_gems*.json).
+# Nodes get integer ids in pre-order, so the subtree of node i is exactly the
+# id range [i, end[i]) and its leaves are a slice of the sorted leaf list.
+# One leaf rule for every file: a node is a leaf when it has no child
+# categories; payload keys such as "image_gems" and list values do not count.
+# The compiled arrays are pickled under CACHE_DIR and rebuilt only when the
+# source file's size or mtime changes.
+
+CACHE_DIR = "../.cache/taxonomy"
+PAYLOAD_KEYS = {"image_gems"}
+SEPARATOR = " > "
+CACHE_VERSION = 1
+
+def _child_items(value):
+    if not isinstance(value, dict):
+        return []
+    return [(k, v) for k, v in value.items() if k not in PAYLOAD_KEYS]
+
+class TaxonomyIndex:
+    def __init__(self, names, parent, depth, end, source=None):
+        self.names = names
+        self.parent = parent
+        self.depth = depth
+        self.end = end
+        self.source = source
+        self.leaves = [i for i in range(len(names)) if end[i] == i + 1]
+        self.ids = {self.path_key(i): i for i in range(len(names))}
+
+    @classmethod
+    def compile(cls, data, source=None):
+        names, parent, depth, end = [], array("i"), array("i"), array("i")
+        # Iterative pre-order walk; ("exit", id) markers close each subtree
+        stack = [("enter", k, v, -1, 0) for k, v in reversed(_child_items(data))]
+        while stack:
+            item = stack.pop()
+            if item[0] == "exit":
+                end[item[1]] = len(names)
+                continue
+            _, name, value, parent_id, level = item
+            node = len(names)
+            names.append(name)
+            parent.append(parent_id)
+            depth.append(level)
+            end.append(node + 1)
+            stack.append(("exit", node))
+            stack.extend(("enter", k, v, node, level + 1) for k, v in reversed(_child_items(value)))
+        return cls(names, parent, depth, end, source)
+
+    def __len__(self):
+        return len(self.names)
+
+    def path(self, node):
+        parts = []
+        while node != -1:
+            parts.append(self.names[node])
+            node = self.parent[node]
+        return parts[::-1]
+
+    # " > "-joined path, the same key the enrichment journals use
+    def path_key(self, node):
+        return SEPARATOR.join(self.path(node))
+
+    def id_of(self, path):
+        if not isinstance(path, str):
+            path = SEPARATOR.join(path)
+        return self.ids.get(path)
+
+    def is_leaf(self, node):
+        return self.end[node] == node + 1
+
+    def roots(self):
+        return self.children(-1)
+
+    def children(self, node):
+        child = node + 1
+        stop = self.end[node] if node != -1 else len(self.names)
+        found = []
+        while child < stop:
+            found.append(child)
+            child = self.end[child]
+        return found
+
+    def subtree(self, node):
+        return range(node, self.end[node])
+
+    def leaves_under(self, node=None):
+        if node is None:
+            return list(self.leaves)
+        lo = bisect.bisect_left(self.leaves, node)
+        hi = bisect.bisect_left(self.leaves, self.end[node])
+        return self.leaves[lo:hi]
+
+    # Leaves (optionally under one node) whose path key is not in `done`
+    def pending_leaves(self, done=frozenset(), node=None):
+        return [leaf for leaf in self.leaves_under(node) if self.path_key(leaf) not in done]
+
+def _cache_path(source, cache_dir):
+    digest = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, f"{name}-{digest}.pickle")
+
+def load_index(source, cache_dir=CACHE_DIR):
+    stat = os.stat(source)
+    stamp = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+    cache_path = _cache_path(source, cache_dir)
+    try:
+        with open(cache_path, "rb") as f:
+            cached_stamp, arrays = pickle.load(f)
+        if cached_stamp == stamp:
+            return TaxonomyIndex(*arrays, source=source)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError):
+        pass
+
+    with open(source, "r", encoding="utf-8") as f:
+        index = TaxonomyIndex.compile(json.load(f), source)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        arrays = (index.names, index.parent, index.depth, index.end)
+        pickle.dump((stamp, arrays), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return index
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compile a taxonomy JSON and list its leaves")
+    parser.add_argument("source", nargs="?", default="../taxonomy.json")
+    parser.add_argument("--under", default=None, help='Only this subtree, e.g. "Sciences > Formal Sciences"')
+    parser.add_argument("--journal", default=None, help="Only list leaves not yet in this enrichment journal")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    from enrich_journal import LeafJournal
+
+    args = parse_args()
+    index = load_index(args.source)
+    node = None
+    if args.under:
+        node = index.id_of(args.under)
+        if node is None:
+            raise SystemExit(f"❌ No node '{args.under}' in {args.source}")
+    done = LeafJournal(args.journal).completed() if args.journal else frozenset()
+    leaves = index.pending_leaves(done, node)
+    for leaf in leaves:
+        print(index.path_key(leaf))
+    print(f"✅ {len(index)} nodes, {len(index.leaves)} leaves, {len(leaves)} listed")
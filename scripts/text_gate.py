@@ -0,0 +1,97 @@
+import os
+import argparse
+
+import numpy as np
+from PIL import Image
+
+# Cheap "is there any text at all?" gate that runs before OCR.
+# Images are decoded at reduced size (JPEG draft mode) to a small grayscale
+# square and scored in NumPy batches on features text always produces:
+# dense strong edges and rows with many dark/light transitions (strokes).
+# Images scoring under the threshold skip the easyocr pass entirely.
+# Lower thresholds favour recall; 0 lets everything through.
+
+GATE_SIZE = 320
+TILE = 32  # features are scored per tile so one small caption is enough
+EDGE_STRENGTH = 0.12  # gradient (0..1 scale) that counts as an edge
+TILE_ROW_FLIPS = 3  # dark/light flips for a tile row to look like it crosses strokes
+EDGE_REF = 0.12  # tile edge density that maps to a full score
+ROW_REF = 0.25  # fraction of text-like tile rows that maps to a full score
+TEXT_THRESHOLD = 0.2
+
+def load_gray(path, size=GATE_SIZE):
+    with Image.open(path) as img:
+        img.draft("L", (size, size))
+        gray = img.convert("L").resize((size, size), Image.BILINEAR)
+    return np.asarray(gray, dtype=np.float32) / 255.0
+
+def _tiles(a, tile=TILE):
+    # (N, H, W) -> (N, H/tile, W/tile, tile, tile)
+    n, h, w = a.shape
+    h, w = h - h % tile, w - w % tile
+    return a[:, :h, :w].reshape(n, h // tile, tile, w // tile, tile).swapaxes(2, 3)
+
+def text_scores(gray):
+    # gray: (N, H, W) float32 in [0, 1]; pad the diffs back to full width/height
+    gx = np.abs(np.diff(gray, axis=2, append=gray[:, :, -1:]))
+    gy = np.abs(np.diff(gray, axis=1, append=gray[:, -1:, :]))
+    edges = ((gx > EDGE_STRENGTH) | (gy > EDGE_STRENGTH)).astype(np.float32)
+    edge_density = _tiles(edges).mean(axis=(3, 4))
+
+    # Binarize each tile at its own mean and count real-contrast flips along its rows
+    tiles = _tiles(gray)
+    dark = tiles < tiles.mean(axis=(3, 4), keepdims=True)
+    flips = (dark[..., 1:] != dark[..., :-1]) & (_tiles(gx)[..., :-1] > EDGE_STRENGTH / 2)
+    text_rows = (flips.sum(axis=4) >= TILE_ROW_FLIPS).mean(axis=3)
+
+    score = np.minimum(edge_density / EDGE_REF, 1.0) * 0.5 + np.minimum(text_rows / ROW_REF, 1.0) * 0.5
+    return score.reshape(len(gray), -1).max(axis=1)
+
+def score_images(paths, size=GATE_SIZE):
+    scores = {}
+    arrays, loaded = [], []
+    for path in paths:
+        try:
+            arrays.append(load_gray(path, size))
+            loaded.append(path)
+        except Exception:
+            scores[path] = None
+    if arrays:
+        for path, score in zip(loaded, text_scores(np.stack(arrays))):
+            scores[path] = float(score)
+    return scores
+
+# Split paths into (candidates for OCR, rejected); unreadable files stay
+# candidates so the OCR stage reports them as it always did
+def gate_paths(paths, threshold=TEXT_THRESHOLD, size=GATE_SIZE):
+    if threshold <= 0:
+        return list(paths), []
+    scores = score_images(paths, size)
+    candidates = [p for p in paths if scores[p] is None or scores[p] >= threshold]
+    rejected = [p for p in paths if scores[p] is not None and scores[p] < threshold]
+    return candidates, rejected
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Estimate how many images the pre-OCR text gate would skip")
+    parser.add_argument("folder")
+    parser.add_argument("--threshold", type=float, default=TEXT_THRESHOLD)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--list-rejected", action="store_true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    paths = [
+        os.path.join(root, f)
+        for root, _, files in os.walk(args.folder)
+        for f in sorted(files) if f.lower().endswith((".jpg", ".jpeg", ".png"))
+    ]
+    passed = rejected = 0
+    for i in range(0, len(paths), args.batch_size):
+        candidates, skipped = gate_paths(paths[i:i + args.batch_size], args.threshold)
+        passed += len(candidates)
+        rejected += len(skipped)
+        if args.list_rejected:
+            for path in skipped:
+                print(path)
+    print(f"✅ {passed} images go to OCR, {rejected} OCR calls saved (threshold {args.threshold})")
@@ -0,0 +1,330 @@
+import os
+import re
+import json
+import sqlite3
+import hashlib
+import argparse
+import threading
+import urllib.parse
+from collections import deque
+from image_downloader import ImageDownloader, save_result
+from work_queue import WorkQueue, Worker, QUEUE_PATH
+
+# Crawl frontier for the URLs collected in the metadata JSON files.
+# URLs are canonicalized and checked against a seen-set persisted across
+# runs, then queued per host; the scheduler keeps many hosts busy at once
+# while never running more than `per_host` requests against any one of them.
+
+SEEN_PATH = "../metadata/frontier_seen.sqlite"
+METADATA_FILES = [
+    "../metadata/arabic_image_links.json",
+    "../metadata/domain_image_gems_arabic.json",
+    "../metadata/domain_image_gems.json"
+]
+OUTPUT_DIR = "../raw_images/frontier"
+
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "mc_cid", "mc_eid",
+    "igshid", "ref_src", "_ga", "_gl", "spm"
+}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonicalize_url(url):
+    url = url.strip()
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower().rstrip(".")
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+
+    # Upper-case existing escapes and escape stray characters, without decoding %2F & co.
+    path = re.sub(r"%[0-9a-fA-F]{2}", lambda m: m.group(0).upper(), parts.path)
+    path = urllib.parse.quote(path, safe="/%:@!$&'()*+,;=-._~") or "/"
+
+    # Filter raw "k=v" tokens so the remaining parameters keep their exact encoding
+    query = [
+        token for token in parts.query.split("&")
+        if token and not _is_tracking_param(urllib.parse.unquote_plus(token.split("=", 1)[0]))
+    ]
+    return urllib.parse.urlunsplit((scheme, netloc, path, "&".join(sorted(query)), ""))
+
+def _is_tracking_param(name):
+    name = name.lower()
+    return name.startswith("utm_") or name in TRACKING_PARAMS
+
+# http/https and www/bare copies of the same resource share one seen-set entry
+def url_key(canonical):
+    key = canonical.split("://", 1)[-1]
+    return key[4:] if key.startswith("www.") else key
+
+def url_host(url):
+    return urllib.parse.urlsplit(url).hostname or ""
+
+# Link-check verdicts (see link_validator.py) not worth a download
+SKIP_VERDICTS = ("dead", "not_image", "small")
+
+# Yield (url, context) from both the flat {"A > B": [...]} link files
+# and the nested {domain: {subdomain: {"image_gems": [...]}}} gems files
+def iter_metadata_urls(data, path=(), skip_verdicts=SKIP_VERDICTS):
+    if isinstance(data, list):
+        for item in data:
+            if isinstance(item, dict) and item.get("url"):
+                if item.get("link", {}).get("verdict") in skip_verdicts:
+                    continue
+                yield item["url"], {"path": list(path), "desc": item.get("desc", "")}
+    elif isinstance(data, dict):
+        for key, value in data.items():
+            if key == "image_gems":
+                yield from iter_metadata_urls(value, path, skip_verdicts)
+            else:
+                yield from iter_metadata_urls(value, path + tuple(key.split(" > ")), skip_verdicts)
+
+def load_metadata_urls(paths, skip_verdicts=SKIP_VERDICTS):
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from iter_metadata_urls(json.load(f), skip_verdicts=skip_verdicts)
+
+class SeenSet:
+    def __init__(self, path=SEEN_PATH):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS seen (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status TEXT
+            )
+        """)
+        self.conn.commit()
+        self.keys = {key for (key,) in self.conn.execute("SELECT key FROM seen")}
+        self._unsaved = 0
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def mark(self, key, url, status):
+        with self._lock:
+            self.keys.add(key)
+            self.conn.execute("INSERT OR REPLACE INTO seen VALUES (?, ?, ?)", (key, url, status))
+            self._unsaved += 1
+            if self._unsaved >= 100:
+                self.conn.commit()
+                self._unsaved = 0
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+class Frontier:
+    def __init__(self, seen=None, per_host=4):
+        self.seen = seen
+        self.per_host = per_host
+        self.queues = {}
+        self.active = {}
+        self.rotation = deque()
+        self.queued_keys = set()
+        self.pending = 0
+        self.duplicates = 0
+        self._cond = threading.Condition()
+
+    def add(self, url, context=None):
+        try:
+            canonical = canonicalize_url(url)
+        except ValueError:
+            return False
+        key = url_key(canonical)
+        with self._cond:
+            if key in self.queued_keys or (self.seen is not None and key in self.seen):
+                self.duplicates += 1
+                return False
+            self.queued_keys.add(key)
+            host = url_host(canonical)
+            if host not in self.queues:
+                self.queues[host] = deque()
+                self.active[host] = 0
+                self.rotation.append(host)
+            self.queues[host].append((canonical, key, context))
+            self.pending += 1
+            self._cond.notify()
+        return True
+
+    # Round-robin over hosts, skipping those at their concurrency limit.
+    # Returns None once every queue is drained, or (block=False) as soon as
+    # every queued URL is waiting on a busy host.
+    def _next(self, block=True):
+        with self._cond:
+            while True:
+                if self.pending == 0:
+                    return None
+                for _ in range(len(self.rotation)):
+                    host = self.rotation[0]
+                    self.rotation.rotate(-1)
+                    if self.queues[host] and self.active[host] < self.per_host:
+                        self.active[host] += 1
+                        self.pending -= 1
+                        return (host,) + self.queues[host].popleft()
+                if not block:
+                    return None
+                self._cond.wait()
+
+    def _done(self, host):
+        with self._cond:
+            self.active[host] -= 1
+            self._cond.notify_all()
+
+    # Streaming use (vqa_pipeline): callers add URLs as they arrive and keep
+    # taking ready ones, releasing each host slot when its fetch is over.
+    # A URL left queued always belongs to a host with a fetch in flight, so
+    # the caller that releases that slot and takes again picks it up.
+    def take(self):
+        return self._next(block=False)
+
+    def release(self, host):
+        self._done(host)
+
+    # fetch(url) -> result; on_result(url, context, result) -> status string saved in the seen-set
+    def run(self, fetch, on_result, workers=32):
+        def worker():
+            while True:
+                item = self._next()
+                if item is None:
+                    with self._cond:
+                        self._cond.notify_all()
+                    return
+                host, url, key, context = item
+                try:
+                    status = on_result(url, context, fetch(url))
+                    if self.seen is not None and status:
+                        self.seen.mark(key, url, status)
+                except Exception as e:
+                    print(f"❌ Error on {url}: {e}")
+                finally:
+                    self._done(host)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if self.seen is not None:
+            self.seen.commit()
+
+# Seen-set status for a download result; None leaves the URL for the next run
+# (network errors and 5xx)
+def result_status(result):
+    if result.ok:
+        return "saved"
+    if result.format is None and not result.error.startswith(("HTTP 4", "not an image")):
+        return None
+    return "rejected"
+
+# <output_dir>/<taxonomy path>/<sha1(url)[:16]>.<ext>
+def image_file_path(output_dir, url, path, format):
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    ext = "jpg" if format == "JPEG" else format.lower()
+    folder = os.path.join(output_dir, *[p.replace("/", "_") for p in path])
+    return os.path.join(folder, f"{name}.{ext}")
+
+def download_frontier(metadata_files=METADATA_FILES, output_dir=OUTPUT_DIR, seen_path=SEEN_PATH,
+                      workers=32, per_host=4, min_size=300):
+    seen = SeenSet(seen_path)
+    frontier = Frontier(seen, per_host)
+    total = 0
+    for url, context in load_metadata_urls(metadata_files):
+        total += 1
+        frontier.add(url, context)
+    print(f"🧭 {total} URLs → {frontier.pending} to fetch across {len(frontier.queues)} hosts "
+          f"({frontier.duplicates} duplicates or already seen)")
+
+    counts = {"saved": 0, "rejected": 0}
+    lock = threading.Lock()
+
+    def on_result(url, context, result):
+        if result.ok:
+            save_result(result, image_file_path(output_dir, url, context["path"], result.format))
+        with lock:
+            counts["saved" if result.ok else "rejected"] += 1
+        return result_status(result)
+
+    with ImageDownloader(workers=workers, min_size=min_size) as downloader:
+        frontier.run(downloader.fetch, on_result, workers)
+    seen.close()
+    print(f"✅ Saved {counts['saved']} images, rejected {counts['rejected']}")
+    return counts
+
+# Queue mode: URLs become "images" tasks in a shared work queue and every worker
+# leases a batch at a time, downloading it through its own per-host frontier
+def enqueue_urls(queue, metadata_files=METADATA_FILES):
+    tasks = {}
+    for url, context in load_metadata_urls(metadata_files):
+        try:
+            tasks.setdefault(url_key(canonicalize_url(url)), {"url": url, "context": context})
+        except ValueError:
+            continue
+    return queue.add("images", tasks.items())
+
+def download_queue(metadata_files=METADATA_FILES, output_dir=OUTPUT_DIR, seen_path=SEEN_PATH, queue_path=QUEUE_PATH,
+                   workers=32, per_host=4, min_size=300, batch=500):
+    queue = WorkQueue(queue_path)
+    print(f"🧭 Queued {enqueue_urls(queue, metadata_files)} new URLs in {queue_path}")
+    seen = SeenSet(seen_path)
+    counts = {"saved": 0, "rejected": 0}
+    lock = threading.Lock()
+
+    with ImageDownloader(workers=workers, min_size=min_size) as downloader, \
+            Worker(queue, ("images",), batch=batch) as worker:
+
+        def on_result(url, task, result):
+            if result.ok:
+                save_result(result, image_file_path(output_dir, url, task.payload["context"]["path"], result.format))
+            status = result_status(result)
+            if status is None:
+                worker.failed(task, result.error)
+            else:
+                worker.done(task, status)
+                with lock:
+                    counts[status] += 1
+            return status
+
+        for tasks in worker.batches():
+            frontier = Frontier(seen, per_host)
+            for task in tasks:
+                if not frontier.add(task.payload["url"], task):
+                    worker.done(task, "seen")
+            frontier.run(downloader.fetch, on_result, workers)
+            print(f"📥 {counts['saved']} saved, {counts['rejected']} rejected so far")
+    seen.close()
+    queue.close()
+    print(f"✅ Saved {counts['saved']} images, rejected {counts['rejected']}")
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download metadata URLs through a deduplicating per-host frontier")
+    parser.add_argument("metadata", nargs="*", default=METADATA_FILES)
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--seen", default=SEEN_PATH)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--per-host", type=int, default=4)
+    parser.add_argument("--min-size", type=int, default=300)
+    parser.add_argument("--queue", nargs="?", const=QUEUE_PATH, default=None,
+                        help="Lease URLs from a shared work queue; run as many workers as you like")
+    parser.add_argument("--batch", type=int, default=500, help="URLs leased at a time in --queue mode")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.queue:
+        download_queue(args.metadata, args.output, args.seen, args.queue, args.workers, args.per_host,
+                       args.min_size, args.batch)
+    else:
+        download_frontier(args.metadata, args.output, args.seen, args.workers, args.per_host, args.min_size)
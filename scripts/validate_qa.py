@@ -0,0 +1,253 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from qa_shards import resolve_image, QA_DIR, IMAGES_ROOT
+
+# Validator for the qa_data JSONL format described in the README.
+# Each file is cut into newline-aligned byte ranges that worker processes
+# check in parallel: required fields and types, image_metadata, exactly one
+# question of each QUESTION_TYPES entry, and that image_path resolves to a
+# file. Duplicate image_ids are caught across the whole file.
+# As a side product every file gets a sidecar index, <file>.idx (uint64 line
+# offsets, read through mmap) and <file>.ids (image_id -> position), so
+# QAIndex can fetch any record by position or id without scanning the file.
+
+QUESTION_TYPES = (
+    "object_recognition",
+    "causal_inference",
+    "intermodal",
+    "color_reasoning",
+    "spatial_awareness",
+)
+DIFFICULTIES = ("easy", "medium", "hard")
+STRING_FIELDS = ("image_id", "image_path", "domain", "subdomain", "theme", "language")
+CHUNK_BYTES = 32 * 1024 * 1024
+MAX_REPORTED = 20  # errors printed per file
+INDEX_MAGIC = b"QAIDX1\0\0"
+INDEX_HEADER = struct.Struct("<8sQQQ")  # magic, source size, source mtime_ns, record count
+
+def validate_record(record, images_root=None):
+    if not isinstance(record, dict):
+        return ["record is not an object"]
+    errors = []
+    for field in STRING_FIELDS:
+        if not isinstance(record.get(field), str) or not record[field]:
+            errors.append(f"missing or empty {field}")
+
+    meta = record.get("image_metadata")
+    if not isinstance(meta, dict):
+        errors.append("missing image_metadata")
+    else:
+        for field in ("width", "height"):
+            if not isinstance(meta.get(field), int) or meta[field] <= 0:
+                errors.append(f"image_metadata.{field} must be a positive integer")
+        if not isinstance(meta.get("format"), str):
+            errors.append("image_metadata.format must be a string")
+
+    questions = record.get("questions")
+    if not isinstance(questions, list):
+        errors.append("questions must be a list")
+    else:
+        seen = []
+        for i, q in enumerate(questions):
+            if not isinstance(q, dict):
+                errors.append(f"questions[{i}] is not an object")
+                continue
+            for field in ("question", "answer"):
+                if not isinstance(q.get(field), str) or not q[field].strip():
+                    errors.append(f"questions[{i}].{field} missing or empty")
+            if q.get("type") not in QUESTION_TYPES:
+                errors.append(f"questions[{i}].type {q.get('type')!r} unknown")
+            if "difficulty" in q and q["difficulty"] not in DIFFICULTIES:
+                errors.append(f"questions[{i}].difficulty {q['difficulty']!r} unknown")
+            seen.append(q.get("type"))
+        missing = [t for t in QUESTION_TYPES if t not in seen]
+        if missing:
+            errors.append(f"missing question types: {', '.join(missing)}")
+        if len(seen) != len(set(seen)):
+            errors.append("duplicate question types")
+
+    if images_root and isinstance(record.get("image_path"), str):
+        if resolve_image(record["image_path"], images_root) is None:
+            errors.append(f"image not found: {record['image_path']}")
+    return errors
+
+# Byte ranges of ~chunk_bytes that start right after a newline
+def split_ranges(path, chunk_bytes=CHUNK_BYTES):
+    size = os.path.getsize(path)
+    ranges, start = [], 0
+    with open(path, "rb") as f:
+        while start < size:
+            end = min(size, start + chunk_bytes)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+# Runs in a worker: (offsets, ids, [(offset, message)]) for one byte range
+def validate_range(job):
+    path, start, end, images_root = job
+    offsets, ids, errors = array("Q"), [], []
+    with open(path, "rb") as f:
+        if end == start:
+            return offsets, ids, errors
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = start
+            while pos < end:
+                nl = mm.find(b"\n", pos, end)
+                line_end = end if nl == -1 else nl + 1
+                line = mm[pos:line_end]
+                if line.strip():
+                    offsets.append(pos)
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        errors.append((pos, f"invalid JSON: {e}"))
+                        ids.append(None)
+                    else:
+                        image_id = record.get("image_id") if isinstance(record, dict) else None
+                        ids.append(image_id if isinstance(image_id, str) else None)
+                        errors.extend((pos, message) for message in validate_record(record, images_root))
+                pos = line_end
+    return offsets, ids, errors
+
+def write_index(path, offsets, ids):
+    stat = os.stat(path)
+    tmp_path = path + ".idx.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets)))
+        offsets.append(stat.st_size)  # end sentinel, so record i spans offsets[i]:offsets[i + 1]
+        f.write(offsets.tobytes() if sys.byteorder == "little" else _swapped(offsets))
+        offsets.pop()
+    os.replace(tmp_path, path + ".idx")
+
+    positions = {image_id: i for i, image_id in enumerate(ids) if image_id is not None}
+    tmp_path = path + ".ids.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(positions, f, ensure_ascii=False)
+    os.replace(tmp_path, path + ".ids")
+
+def _swapped(offsets):
+    swapped = array("Q", offsets)
+    swapped.byteswap()
+    return swapped.tobytes()
+
+def validate_file(path, pool, images_root=None, chunk_bytes=CHUNK_BYTES, build_index=True):
+    jobs = [(path, start, end, images_root) for start, end in split_ranges(path, chunk_bytes)]
+    offsets, ids, errors = array("Q"), [], []
+    for chunk_offsets, chunk_ids, chunk_errors in pool.map(validate_range, jobs):
+        offsets.extend(chunk_offsets)
+        ids.extend(chunk_ids)
+        errors.extend(chunk_errors)
+
+    first_seen = {}
+    for offset, image_id in zip(offsets, ids):
+        if image_id is None:
+            continue
+        if image_id in first_seen:
+            errors.append((offset, f"duplicate image_id {image_id!r} (first at byte {first_seen[image_id]})"))
+        else:
+            first_seen[image_id] = offset
+
+    if build_index:
+        write_index(path, offsets, ids)
+    return len(offsets), sorted(errors)
+
+# O(1) record access through the sidecar index
+class QAIndex:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._data = b""  # mmap cannot map an empty file
+        if os.fstat(self._file.fileno()).st_size:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(path + ".idx", "rb") as f:
+            self._idx = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size, mtime_ns, self.count = INDEX_HEADER.unpack_from(self._idx, 0)
+        stat = os.stat(path)
+        if magic != INDEX_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            self.close()
+            raise ValueError(f"{path}.idx is stale; re-run validate_qa.py")
+        self._ids = None
+
+    def __len__(self):
+        return self.count
+
+    def _offset(self, i):
+        return struct.unpack_from("<Q", self._idx, INDEX_HEADER.size + 8 * i)[0]
+
+    def raw(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self._data[self._offset(i):self._offset(i + 1)]
+
+    def __getitem__(self, i):
+        return json.loads(self.raw(i))
+
+    def by_id(self, image_id):
+        if self._ids is None:
+            with open(self.path + ".ids", "r", encoding="utf-8") as f:
+                self._ids = json.load(f)
+        position = self._ids.get(image_id)
+        return None if position is None else self[position]
+
+    def close(self):
+        self._idx.close()
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_qa_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".jsonl"):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Validate qa_data JSONL files and build their offset indexes")
+    parser.add_argument("paths", nargs="*", default=[QA_DIR], help="JSONL files or folders")
+    parser.add_argument("--images", default=IMAGES_ROOT)
+    parser.add_argument("--no-image-check", action="store_true")
+    parser.add_argument("--no-index", action="store_true")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024))
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    images_root = None if args.no_image_check else args.images
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for path in iter_qa_files(args.paths):
+            count, errors = validate_file(path, pool, images_root, args.chunk_mb * 1024 * 1024,
+                                          not args.no_index)
+            bad = len({offset for offset, _ in errors})
+            if errors:
+                failed += 1
+                print(f"❌ {path}: {bad} / {count} records invalid")
+                for offset, message in errors[:MAX_REPORTED]:
+                    print(f"   byte {offset}: {message}")
+                if len(errors) > MAX_REPORTED:
+                    print(f"   ... {len(errors) - MAX_REPORTED} more")
+            else:
+                print(f"✅ {path}: {count} records valid")
+    sys.exit(1 if failed else 0)
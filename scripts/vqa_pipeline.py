@@ -0,0 +1,403 @@
+import os
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from PIL import Image
+
+from pipeline import Stage, Pipeline, QUEUE_SIZE
+from taxonomy_index import load_index
+from llm_batch import MAX_BATCH
+from enrich_arabic_links import keyword_batcher, generate_keywords, LINK_DATASET_PATH
+from enrich_domain_image_gems import ProviderLimits, fetch_images_from_serpapi_async, OPENROUTER_CONCURRENCY
+from url_frontier import Frontier, SeenSet, canonicalize_url, url_key, url_host, result_status, image_file_path, SEEN_PATH
+from image_downloader import ImageDownloader, save_result
+from dedup_images import HashIndex, process_batch, INDEX_PATH, PHASH_RADIUS, DHASH_RADIUS
+from ocr_filter import (ocr_batch, create_reader, passes_filters, keep_image,
+                        DEST_DIR, LANGUAGES, THREADS_PER_WORKER, WORKERS as OCR_WORKERS,
+                        BATCH_SIZE as OCR_BATCH_SIZE, CANVAS_SIZE, MIN_CONFIDENCE)
+from text_gate import TEXT_THRESHOLD
+from ocr_store import OcrStore, STORE_PATH
+from generate_metadata import extract_record, MANIFEST_PATH
+from package_delivery import package_delivery, OUT_DIR
+
+# One command for the whole collection flow, run as a streaming pipeline:
+# keywords → search → frontier → download → validate → dedup → ocr →
+# metadata → qa → package. Leaves of the taxonomy go in at the top; every
+# stage hands its results to the next through a bounded queue, so images are
+# being OCRed while later leaves are still being searched. Each stage has its
+# own executor and worker count (--workers / --executor). Paths, language
+# and the taxonomy subtree are arguments instead of constants in each script.
+#
+# Per-item state lives in a dict that grows along the way:
+#   {"path": [...taxonomy...], "keyword", "url", "key", "host", "file", "record"}
+
+RAW_DIR = "../raw_images"
+QA_PENDING_DIR = "../qa_data/pending"
+STAGE_NAMES = ["keywords", "search", "frontier", "download", "validate",
+               "dedup", "ocr", "metadata", "qa", "package"]
+
+# (default executor, default workers, executors the stage function supports)
+STAGE_DEFAULTS = {
+    "keywords": ("threads", 1, ("threads",)),
+    "search": ("asyncio", 16, ("asyncio",)),
+    "frontier": ("threads", 1, ("threads",)),
+    "download": ("threads", 32, ("threads",)),
+    "validate": ("processes", max(1, (os.cpu_count() or 1) // 2), ("processes", "threads")),
+    "dedup": ("threads", 1, ("threads",)),
+    "ocr": ("processes", OCR_WORKERS, ("processes",)),
+    "metadata": ("threads", 1, ("threads",)),
+    "qa": ("threads", 1, ("threads",)),
+    "package": ("threads", 1, ("threads",)),
+}
+
+DEDUP_BATCH = 64
+PER_HOST = 4
+
+# --- keywords: taxonomy leaves -> (leaf, keyword) ---
+class KeywordStage:
+    def __init__(self, batch_size=MAX_BATCH):
+        self.batcher = keyword_batcher(batch_size) if batch_size > 1 else None
+
+    def __call__(self, leaf_paths):
+        subjects = [(path[0], " > ".join(path[1:])) for path in leaf_paths]
+        if self.batcher:
+            keyword_lists = self.batcher.run(subjects)
+        else:
+            keyword_lists = [generate_keywords(domain, subdomain) for domain, subdomain in subjects]
+        return [
+            {"path": path, "keyword": keyword}
+            for path, keywords in zip(leaf_paths, keyword_lists)
+            for keyword in keywords or [] if isinstance(keyword, str)
+        ]
+
+# --- search: keyword -> image URLs (SerpAPI, asyncio) ---
+class SearchStage:
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.session = None
+
+    async def __call__(self, item):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+            self.limits = ProviderLimits(self.concurrency, OPENROUTER_CONCURRENCY, self.concurrency)
+        images = await fetch_images_from_serpapi_async(self.session, self.limits, item["keyword"])
+        return [dict(item, url=image["url"]) for image in images]
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+# --- frontier: canonicalize and drop URLs seen in this or earlier runs ---
+class FrontierStage:
+    def __init__(self, seen):
+        self.seen = seen
+        self.queued = set()
+
+    def __call__(self, item):
+        try:
+            canonical = canonicalize_url(item["url"])
+        except ValueError:
+            return None
+        key = url_key(canonical)
+        if key in self.queued or key in self.seen:
+            return None
+        self.queued.add(key)
+        return [dict(item, url=canonical, key=key, host=url_host(canonical))]
+
+# --- download: streamed fetch with header checks, at most PER_HOST per host ---
+# Items go through a url_frontier.Frontier; a worker fetches whatever host has
+# a free slot instead of waiting on its own item's host, and URLs for a busy
+# host stay queued for the worker that frees one of its slots.
+class DownloadStage:
+    def __init__(self, seen, raw_dir, workers, per_host=PER_HOST, min_size=300):
+        self.seen = seen
+        self.raw_dir = raw_dir
+        self.downloader = ImageDownloader(workers=workers, min_size=min_size)
+        self.frontier = Frontier(per_host=per_host)
+
+    def __call__(self, item):
+        self.frontier.add(item["url"], item)
+        return self.drain()
+
+    def drain(self):
+        outputs = []
+        while True:
+            entry = self.frontier.take()
+            if entry is None:
+                return outputs
+            host, url, key, item = entry
+            try:
+                outputs.extend(self.download(item) or [])
+            except Exception as e:
+                print(f"❌ Error on {url}: {e}")
+            finally:
+                self.frontier.release(host)
+
+    def download(self, item):
+        result = self.downloader.fetch(item["url"])
+        status = result_status(result)
+        outputs = None
+        if result.ok:
+            file_path = image_file_path(self.raw_dir, item["url"], item["path"], result.format)
+            save_result(result, file_path)
+            outputs = [dict(item, file=os.path.abspath(file_path))]
+        if status:
+            self.seen.mark(item["key"], item["url"], status)
+        return outputs
+
+    def close(self):
+        self.downloader.close()
+        self.seen.close()
+
+# --- validate: full decode; truncated or corrupt files are removed ---
+def validate_image(item):
+    try:
+        with Image.open(item["file"]) as img:
+            img.verify()
+        with Image.open(item["file"]) as img:
+            img.load()
+    except Exception as e:
+        print(f"⚠️ Removing unreadable image {item['file']}: {e}")
+        os.remove(item["file"])
+        return None
+    return [item]
+
+# --- dedup: perceptual hashes against every image seen so far ---
+class DedupStage:
+    def __init__(self, index_path=INDEX_PATH, workers=4):
+        self.index_path = index_path
+        self.index = None  # SQLite handle, created on the stage's own thread
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def __call__(self, items):
+        if self.index is None:
+            self.index = HashIndex(self.index_path)
+        by_file = {item["file"]: item for item in items}
+        process_batch(self.index, list(by_file), self.pool, PHASH_RADIUS, DHASH_RADIUS)
+        return [
+            item for path, item in by_file.items()
+            if path in self.index.seen and self.index.duplicate_of(path) is None
+        ]
+
+    def close(self):
+        self.pool.shutdown()
+        if self.index is not None:
+            self.index.close()
+
+# --- ocr: runs in worker processes, each with one warm Reader and store handle ---
+_ocr_state = {}
+
+def ocr_items(items, languages, threads, canvas, text_threshold, store_path, dest_dir, min_confidence):
+    if "store" not in _ocr_state:
+        _ocr_state["store"] = OcrStore(store_path)
+    store = _ocr_state["store"]
+
+    def get_reader():
+        if "reader" not in _ocr_state:
+            _ocr_state["reader"] = create_reader(languages, threads)
+        return _ocr_state["reader"]
+
+    by_file = {item["file"]: item for item in items}
+    kept = []
+    for path, stat, content_hash, result, status, error in ocr_batch(
+        list(by_file), store, get_reader, languages, canvas, text_threshold
+    ):
+        if result is None:
+            if error:
+                print(f"❌ OCR failed for {path}: {error}")
+            continue
+        if status == "ocr":
+            store.put(content_hash, result)
+        store.link(path, content_hash, stat)
+        if passes_filters(result, min_confidence):
+            keep_image(path, dest_dir)
+            kept.append(by_file[path])
+    store.commit()
+    return kept
+
+# --- metadata: append kept images to the metadata manifest ---
+class MetadataStage:
+    def __init__(self, raw_dir, manifest_path, language):
+        self.raw_dir = os.path.abspath(raw_dir)
+        self.manifest_path = manifest_path
+        self.language = language
+        self.out = None
+
+    def __call__(self, item):
+        stat = os.stat(item["file"])
+        rel_path = os.path.relpath(item["file"], self.raw_dir)
+        record, error = extract_record((self.raw_dir, rel_path, stat.st_size, stat.st_mtime, self.language))
+        if error:
+            raise ValueError(error)
+        if self.out is None:
+            os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+            self.out = open(self.manifest_path, "a", encoding="utf-8")
+        self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.out.flush()
+        return [dict(item, record=record)]
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+
+# --- qa: README-format records awaiting questions, per domain/subdomain ---
+# There is no question generator in the tree yet, so records are written with
+# an empty "questions" list under qa_data/pending/ for annotation.
+class QAStage:
+    def __init__(self, pending_dir, language):
+        self.pending_dir = pending_dir
+        self.language = language
+
+    def __call__(self, item):
+        record = item["record"]
+        qa = {
+            "image_id": os.path.splitext(record["file_name"])[0],
+            "image_path": record["image_path"],
+            "domain": record.get("domain", ""),
+            "subdomain": record.get("subdomain", ""),
+            "theme": record.get("theme", ""),
+            "language": self.language,
+            "image_metadata": {
+                "width": record["width"],
+                "height": record["height"],
+                "format": record["format"]
+            },
+            "questions": []
+        }
+        os.makedirs(self.pending_dir, exist_ok=True)
+        name = f"{qa['domain']}_{qa['subdomain']}.jsonl".replace(" ", "_").replace("/", "_")
+        with open(os.path.join(self.pending_dir, name), "a", encoding="utf-8") as f:
+            f.write(json.dumps(qa, ensure_ascii=False) + "\n")
+        return [dict(item, qa=qa)]
+
+# --- package: one delivery of everything kept, once the stream is drained ---
+class PackageStage:
+    def __init__(self, dest_dir, out_dir):
+        self.dest_dir = dest_dir
+        self.out_dir = out_dir
+        self.count = 0
+
+    def __call__(self, item):
+        self.count += 1
+        return None
+
+    def finish(self):
+        if not self.count:
+            print("⏩ Nothing new to package")
+            return None
+        manifest_path, archives = package_delivery(self.dest_dir, self.out_dir)
+        return [{"manifest": manifest_path, "archives": archives}]
+
+def parse_overrides(values, cast, option):
+    overrides = {}
+    for value in values or []:
+        name, _, setting = value.partition("=")
+        if name not in STAGE_NAMES or not setting:
+            raise SystemExit(f"❌ {option} expects STAGE=VALUE with STAGE in {', '.join(STAGE_NAMES)}")
+        overrides[name] = cast(setting)
+    return overrides
+
+def build_stages(args):
+    workers = parse_overrides(args.workers, int, "--workers")
+    executors = parse_overrides(args.executor, str, "--executor")
+    names = STAGE_NAMES[:STAGE_NAMES.index(args.until) + 1]
+
+    def settings(name):
+        executor, count, supported = STAGE_DEFAULTS[name]
+        executor = executors.get(name, executor)
+        if executor not in supported:
+            raise SystemExit(f"❌ Stage {name} supports {', '.join(supported)}, not {executor}")
+        return executor, workers.get(name, count)
+
+    seen = SeenSet(args.seen)
+    ocr_args = (args.ocr_languages, THREADS_PER_WORKER, CANVAS_SIZE, args.text_threshold,
+                args.store, args.dest, args.min_confidence)
+    factories = {
+        "keywords": lambda: dict(fn=KeywordStage(args.batch_size), batch=args.batch_size),
+        "search": lambda: (lambda s: dict(fn=s, close=s.close))(SearchStage(settings("search")[1])),
+        "frontier": lambda: dict(fn=FrontierStage(seen)),
+        "download": lambda: (lambda s: dict(fn=s, finish=s.drain, close=s.close))(
+            DownloadStage(seen, args.raw_dir, settings("download")[1], args.per_host, args.min_size)),
+        "validate": lambda: dict(fn=validate_image),
+        "dedup": lambda: (lambda s: dict(fn=s, close=s.close, batch=DEDUP_BATCH))(DedupStage(args.hash_index)),
+        "ocr": lambda: dict(fn=_OcrCall(ocr_args), batch=OCR_BATCH_SIZE),
+        "metadata": lambda: (lambda s: dict(fn=s, close=s.close))(
+            MetadataStage(args.raw_dir, args.manifest, args.language)),
+        "qa": lambda: dict(fn=QAStage(args.qa_dir, args.language)),
+        "package": lambda: (lambda s: dict(fn=s, finish=s.finish))(PackageStage(args.dest, args.deliveries)),
+    }
+
+    stages = []
+    for name in names:
+        executor, count = settings(name)
+        stages.append(Stage(name, executor=executor, workers=count, **factories[name]()))
+    if "download" not in names:
+        stages[-1].close = _chain(stages[-1].close, seen.close)
+    return stages
+
+# Picklable OCR stage function for the process pool
+class _OcrCall:
+    def __init__(self, args):
+        self.args = args
+
+    def __call__(self, items):
+        return ocr_items(items, *self.args)
+
+def _chain(first, second):
+    def both():
+        if first:
+            first()
+        second()
+    return both
+
+def iter_leaves(taxonomy, under=None, limit=None):
+    index = load_index(taxonomy)
+    node = None
+    if under:
+        node = index.id_of(under)
+        if node is None:
+            raise SystemExit(f"❌ No node '{under}' in {taxonomy}")
+    leaves = index.leaves_under(node)
+    for leaf in leaves[:limit] if limit else leaves:
+        yield index.path(leaf)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the collection flow as one streaming pipeline")
+    parser.add_argument("--taxonomy", default=LINK_DATASET_PATH)
+    parser.add_argument("--under", default=None, help='Only leaves under this node, e.g. "Sciences > Formal Sciences"')
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N leaves")
+    parser.add_argument("--until", choices=STAGE_NAMES, default=STAGE_NAMES[-1], help="Last stage to run")
+    parser.add_argument("--workers", action="append", metavar="STAGE=N", help="Worker count for a stage")
+    parser.add_argument("--executor", action="append", metavar="STAGE=KIND",
+                        help="threads / processes / asyncio, where the stage supports it")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH, help="Max leaves per keyword prompt")
+    parser.add_argument("--language", default="ar", help="Language code written to metadata and QA records")
+    parser.add_argument("--ocr-languages", nargs="+", default=LANGUAGES)
+    parser.add_argument("--text-threshold", type=float, default=TEXT_THRESHOLD)
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument("--per-host", type=int, default=PER_HOST)
+    parser.add_argument("--min-size", type=int, default=300)
+    parser.add_argument("--raw-dir", default=RAW_DIR)
+    parser.add_argument("--dest", default=DEST_DIR)
+    parser.add_argument("--seen", default=SEEN_PATH)
+    parser.add_argument("--hash-index", default=INDEX_PATH)
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--qa-dir", default=QA_PENDING_DIR)
+    parser.add_argument("--deliveries", default=OUT_DIR)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(args.dest, exist_ok=True)
+    pipeline = Pipeline(build_stages(args), args.queue_size)
+    print(f"🚀 Running {' → '.join(stage.name for stage in pipeline.stages)}")
+    count = pipeline.run(iter_leaves(args.taxonomy, args.under, args.limit))
+    pipeline.report()
+    print(f"🎉 {count} items came out of the last stage ({args.until})")
@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+from metrics import metrics
+
+# Durable task queue shared by any number of worker processes, on one box or
+# several sharing the directory. Tasks (taxonomy leaves, keyword queries,
+# image URLs) are rows keyed by (kind, key), so enqueueing the same work twice
+# is a no-op. A worker leases a batch in one BEGIN IMMEDIATE transaction and
+# a heartbeat thread keeps extending the lease while it works; a worker that
+# dies stops heartbeating, its lease runs out and the next worker to ask takes
+# the task over. Every lease counts as an attempt: failures are retried with
+# exponential backoff and a task that uses up MAX_ATTEMPTS is parked as
+# failed (`work_queue.py retry` puts those back).
+# SQLite's WAL mode needs shared memory, so on a network share set
+# WORK_QUEUE_WAL=0 to fall back to the rollback journal and file locks. Lease
+# deadlines are wall-clock times: machines sharing a queue need synced clocks.
+
+QUEUE_PATH = "../metadata/work_queue.sqlite"
+WAL = os.getenv("WORK_QUEUE_WAL", "1") != "0"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30  # doubled on every further attempt
+POLL_SECONDS = 5
+STATES = ("pending", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (kind, key)
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks(kind, state, available_at);
+CREATE INDEX IF NOT EXISTS tasks_owner ON tasks(owner, state);
+"""
+
+class Task:
+    def __init__(self, id, kind, key, payload, attempts):
+        self.id = id
+        self.kind = kind
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"Task({self.kind}: {self.key}, attempt {self.attempts})"
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    def __init__(self, path=QUEUE_PATH, wal=WAL):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly below
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute(f"PRAGMA journal_mode={'WAL' if wal else 'DELETE'}")
+        self.conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    # tasks: (key, payload) pairs; keys already queued, in any state, are left alone.
+    # Returns how many were new.
+    def add(self, kind, tasks, max_attempts=MAX_ATTEMPTS):
+        now = time.time()
+        rows = [(kind, key, json.dumps(payload, ensure_ascii=False), max_attempts, now, now, now)
+                for key, payload in tasks]
+        with self._write():
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO tasks (kind, key, payload, max_attempts, available_at, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            return self.conn.total_changes - before
+
+    # Up to n ready tasks of one kind: pending ones past their backoff, or leased
+    # ones whose lease ran out (their worker died)
+    def lease(self, kind, owner, n=1, lease=LEASE_SECONDS):
+        now = time.time()
+        with self._write():
+            # A task whose every lease expired most likely kills its worker; park it
+            expired = self.conn.execute(
+                "UPDATE tasks SET state = 'failed', owner = NULL, error = 'lease expired', updated = ? "
+                "WHERE kind = ? AND state = 'leased' AND lease_expires < ? AND attempts >= max_attempts",
+                (now, kind, now)
+            ).rowcount
+            rows = self.conn.execute(
+                "SELECT id, key, payload, attempts, state FROM tasks "
+                "WHERE kind = ? AND ((state = 'pending' AND available_at <= ?) "
+                "OR (state = 'leased' AND lease_expires < ?)) ORDER BY id LIMIT ?",
+                (kind, now, now, n)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE tasks SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated = ? WHERE id = ?",
+                [(owner, now + lease, now, row[0]) for row in rows]
+            )
+        reclaimed = sum(1 for row in rows if row[4] == "leased")
+        if reclaimed:
+            metrics.count("queue_tasks", reclaimed, kind=kind, result="reclaimed")
+        if expired:
+            metrics.count("queue_tasks", expired, kind=kind, result="failed")
+        return [Task(id, kind, key, json.loads(payload), attempts + 1) for id, key, payload, attempts, _ in rows]
+
+    # Extend every lease `owner` holds; returns how many it still holds
+    def heartbeat(self, owner, lease=LEASE_SECONDS):
+        now = time.time()
+        with self._write():
+            return self.conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated = ? WHERE owner = ? AND state = 'leased'",
+                (now + lease, now, owner)
+            ).rowcount
+
+    # False when the lease was lost to another worker in the meantime
+    def complete(self, task, owner, result=None):
+        with self._write():
+            return self.conn.execute(
+                "UPDATE tasks SET state = 'done', owner = NULL, lease_expires = NULL, result = ?, error = NULL, "
+                "updated = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (json.dumps(result, ensure_ascii=False), time.time(), task.id, owner)
+            ).rowcount == 1
+
+    # Back to pending after a backoff, or failed for good once out of attempts.
+    # Returns the new state, or None when the lease was lost.
+    def fail(self, task, owner, error, retry_delay=RETRY_DELAY):
+        now = time.time()
+        with self._write():
+            row = self.conn.execute(
+                "SELECT attempts, max_attempts FROM tasks WHERE id = ? AND owner = ? AND state = 'leased'",
+                (task.id, owner)
+            ).fetchone()
+            if row is None:
+                return None
+            state = "failed" if row[0] >= row[1] else "pending"
+            self.conn.execute(
+                "UPDATE tasks SET state = ?, owner = NULL, lease_expires = NULL, error = ?, available_at = ?, "
+                "updated = ? WHERE id = ?",
+                (state, str(error)[:500], now + retry_delay * 2 ** (row[0] - 1), now, task.id)
+            )
+            return state
+
+    # Hand back every lease of a worker shutting down cleanly, without charging an attempt
+    def release(self, owner):
+        with self._write():
+            return self.conn.execute(
+                "UPDATE tasks SET state = 'pending', owner = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0), updated = ? WHERE owner = ? AND state = 'leased'",
+                (time.time(), owner)
+            ).rowcount
+
+    # Failed tasks back to pending with a fresh set of attempts
+    def retry_failed(self, kind=None):
+        now = time.time()
+        with self._write():
+            return self.conn.execute(
+                "UPDATE tasks SET state = 'pending', attempts = 0, available_at = ?, updated = ? "
+                "WHERE state = 'failed' AND (? IS NULL OR kind = ?)",
+                (now, now, kind, kind)
+            ).rowcount
+
+    # True once no task of these kinds is pending or leased, i.e. nothing is left to wait for
+    def drained(self, kinds):
+        with self._lock:
+            return self.conn.execute(
+                f"SELECT NOT EXISTS (SELECT 1 FROM tasks WHERE kind IN ({', '.join('?' * len(kinds))}) "
+                "AND state IN ('pending', 'leased'))", tuple(kinds)
+            ).fetchone()[0] == 1
+
+    # {kind: {state: count}}
+    def stats(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state").fetchall()
+        out = {}
+        for kind, state, n in rows:
+            out.setdefault(kind, dict.fromkeys(STATES, 0))[state] = n
+        return out
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+# One worker process: leases tasks of `kinds` (earlier kinds first), keeps the leases
+# alive from a heartbeat thread and hands unfinished ones back on exit.
+#   with Worker(queue, ("leaves",)) as worker:
+#       for task in worker.tasks():
+#           ... worker.done(task) or worker.failed(task, error)
+class Worker:
+    def __init__(self, queue, kinds, name=None, batch=1, lease=LEASE_SECONDS, poll=POLL_SECONDS,
+                 retry_delay=RETRY_DELAY):
+        self.queue = queue
+        self.kinds = tuple(kinds)
+        self.name = name or worker_name()
+        self.batch = batch
+        self.lease_seconds = lease
+        self.poll = poll
+        self.retry_delay = retry_delay
+        self.held = set()
+        self.counts = {"done": 0, "retry": 0, "failed": 0, "lost": 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+
+    def __enter__(self):
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._heartbeat.join()
+        released = self.queue.release(self.name)
+        if released:
+            print(f"🔁 Handed back {released} unfinished tasks")
+        return False
+
+    def _beat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.queue.heartbeat(self.name, self.lease_seconds)
+            except sqlite3.Error as e:
+                print(f"⚠️ Heartbeat failed: {e}")
+
+    def _lease(self):
+        for kind in self.kinds:
+            tasks = self.queue.lease(kind, self.name, self.batch, self.lease_seconds)
+            if tasks:
+                with self._lock:
+                    self.held.update(task.id for task in tasks)
+                return tasks
+        return []
+
+    # Batches of leased tasks until every kind is drained; while other workers still
+    # hold leases this polls, so tasks of a worker that dies are picked up here.
+    # Tasks of a batch left neither done nor failed count as failed attempts.
+    def batches(self):
+        while not self._stop.is_set():
+            tasks = self._lease()
+            if not tasks:
+                if self.queue.drained(self.kinds):
+                    return
+                time.sleep(self.poll)
+                continue
+            yield tasks
+            for task in tasks:
+                if task.id in self.held:
+                    self.failed(task, "left unfinished")
+
+    def tasks(self):
+        for batch in self.batches():
+            yield from batch
+
+    def _settle(self, task, result):
+        with self._lock:
+            self.held.discard(task.id)
+            self.counts[result] += 1
+        metrics.count("queue_tasks", kind=task.kind, result=result)
+
+    def done(self, task, result=None):
+        if self.queue.complete(task, self.name, result):
+            self._settle(task, "done")
+        else:
+            print(f"⚠️ Lost the lease on {task.key} before finishing it")
+            self._settle(task, "lost")
+
+    def failed(self, task, error):
+        state = self.queue.fail(task, self.name, error, self.retry_delay)
+        if state is None:
+            self._settle(task, "lost")
+        elif state == "failed":
+            print(f"❌ Giving up on {task.key} after {task.attempts} attempts: {error}")
+            self._settle(task, "failed")
+        else:
+            self._settle(task, "retry")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect and maintain the shared work queue")
+    parser.add_argument("action", choices=["stats", "retry"])
+    parser.add_argument("--queue", default=QUEUE_PATH)
+    parser.add_argument("--kind", help="Only retry failed tasks of this kind")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    queue = WorkQueue(args.queue)
+    if args.action == "retry":
+        print(f"🔁 {queue.retry_failed(args.kind)} failed tasks back to pending")
+    for kind, counts in sorted(queue.stats().items()):
+        print(f"📊 {kind}: " + ", ".join(f"{n} {state}" for state, n in counts.items()))
+    queue.close()
@@ -0,0 +1,21 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The scripts run from scripts/ and import each other as top-level modules
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+# Keep the shared response cache out of the repo's .cache while testing
+os.environ.setdefault("VQA_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "responses.sqlite"))
+
+import rate_limiter
+
+# Lift a provider's rate limit for one test; its bucket is put back afterwards
+@pytest.fixture
+def fast_rate(monkeypatch):
+    def lift(provider, rate=1000.0):
+        monkeypatch.setitem(rate_limiter._buckets, provider, rate_limiter.TokenBucket(rate))
+    return lift
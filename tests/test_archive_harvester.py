@@ -0,0 +1,45 @@
+import os
+import json
+import asyncio
+
+from archive_harvester import harvest_archives, fixture_key, SOURCES
+
+# Laid out as --record writes them: one NASA and one Gallica hit for "astrolabe"
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "archives")
+GALLICA_IMAGE = "https://gallica.bnf.fr/iiif/ark:/12148/btv1b8447300c/f1"
+
+def replay(tmp_path, **kwargs):
+    out = tmp_path / "harvest.jsonl"
+    counts = asyncio.run(harvest_archives([SOURCES["nasa"], SOURCES["gallica"]], "astrolabe", str(out),
+                                          replay_dir=FIXTURES, **kwargs))
+    records = {r["source"]: r for r in map(json.loads, out.read_text(encoding="utf-8").splitlines())}
+    return counts, records
+
+def test_replay_picks_target_sizes(tmp_path):
+    counts, records = replay(tmp_path)
+    assert counts == {"nasa": 1, "gallica": 1}
+
+    # 1920px "large" is the smallest rendition covering the 1600px target
+    assert records["nasa"]["url"] == "https://images-assets.nasa.gov/image/PIA00001/PIA00001~large.jpg"
+
+    # The manifest has no size, so info.json is read; its maxWidth caps the 1600px target
+    gallica = records["gallica"]
+    assert gallica["url"] == f"{GALLICA_IMAGE}/full/1000,/0/default.jpg"
+    assert (gallica["width"], gallica["height"]) == (1000, 750)
+    assert gallica["label"] == "f. 1r"
+
+def test_replay_downloads_images(tmp_path):
+    counts, records = replay(tmp_path, images_dir=str(tmp_path / "images"))
+    assert counts == {"nasa": 1, "gallica": 1}
+    assert (records["nasa"]["width"], records["nasa"]["height"]) == (96, 64)
+    assert (records["gallica"]["width"], records["gallica"]["height"]) == (100, 75)
+    for record in records.values():
+        assert os.path.isfile(record["file"])
+        assert record["file"].startswith(str(tmp_path / "images" / record["source"]))
+
+def test_fixture_keys_are_portable_file_names():
+    key = fixture_key(f"{GALLICA_IMAGE}/full/1000,/0/default.jpg")
+    assert key == "gallica.bnf.fr/iiif/ark%3A/12148/btv1b8447300c/f1/full/1000%2C/0/default.jpg"
+    for folder, _, files in os.walk(FIXTURES):
+        for name in files + folder[len(FIXTURES):].split(os.sep):
+            assert not set(name) & set('<>:"\\|?*,'), name
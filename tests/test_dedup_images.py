@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from dedup_images import HashIndex, dedup_folders
+
+def noise(path, seed, mtime):
+    pixels = np.random.default_rng(seed).integers(0, 256, (64, 64), dtype=np.uint8)
+    Image.fromarray(pixels, "L").resize((256, 256), Image.NEAREST).save(path)
+    os.utime(path, (mtime, mtime))
+    return os.path.abspath(path)
+
+def test_near_duplicates_are_marked(tmp_path):
+    folder = tmp_path / "raw"
+    folder.mkdir()
+    original = noise(folder / "a.png", 1, 1000)
+    Image.open(original).resize((200, 200)).save(folder / "b.png")
+    noise(folder / "c.png", 2, 1000)
+    index_path = str(tmp_path / "hashes.sqlite")
+
+    assert dedup_folders([str(folder)], index_path, workers=2) == (3, 1)
+    index = HashIndex(index_path)
+    assert index.duplicates() == {str(folder / "b.png")}
+    assert index.duplicate_of(str(folder / "b.png")) == original
+    index.close()
+    # Unchanged files are not hashed again
+    assert dedup_folders([str(folder)], index_path, workers=2) == (0, 0)
+
+def test_rehashed_file_leaves_no_stale_match(tmp_path):
+    index = HashIndex(str(tmp_path / "hashes.sqlite"))
+    stat = os.stat(tmp_path)
+    old, new = 0x0F0F0F0F0F0F0F0F, 0xF0F0F0F0F0F0F0F0
+    index.add("/raw/a.png", stat, 8, 8, old, old, None)
+    # a.png changed on disk and was hashed again in the same run
+    index.add("/raw/a.png", stat, 8, 8, new, new, None)
+    assert index.find_duplicate("/raw/b.png", old, old) is None
+    assert index.find_duplicate("/raw/b.png", new, new) == "/raw/a.png"
+
+    # Once a.png is itself a duplicate it is no longer a match either
+    index.add("/raw/c.png", stat, 8, 8, new, new, None)
+    index.add("/raw/a.png", stat, 8, 8, new, new, "/raw/c.png")
+    assert index.find_duplicate("/raw/b.png", new, new) == "/raw/c.png"
+    index.close()
@@ -0,0 +1,25 @@
+import enrich_arabic_links as enrich
+from enrich_journal import LeafJournal
+from taxonomy_index import TaxonomyIndex
+
+class RecordingBatcher:
+    def __init__(self, journal):
+        self.journal = journal
+        self.journaled_before = []
+
+    def run(self, subjects):
+        self.journaled_before.append(len(self.journal.completed()))
+        return [[f"{subdomain} kw"] for _, subdomain in subjects]
+
+def test_each_keyword_batch_is_journaled_before_the_next(tmp_path, monkeypatch):
+    journal = LeafJournal(str(tmp_path / "leaves.journal.jsonl"))
+    journal.reset()
+    batcher = RecordingBatcher(journal)
+    monkeypatch.setattr(enrich, "keyword_batcher", lambda batch_size: batcher)
+    monkeypatch.setattr(enrich, "fetch_images_from_serpapi", lambda kw: [{"url": f"https://x/{kw}.jpg"}])
+
+    index = TaxonomyIndex.compile({"Physics": {name: {} for name in "ABCDE"}})
+    enrich.enrich_links(index, journal, batch_size=2)
+
+    assert batcher.journaled_before == [0, 2, 4]
+    assert len(journal.completed()) == 5
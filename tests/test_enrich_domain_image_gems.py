@@ -0,0 +1,141 @@
+import re
+import json
+import asyncio
+
+from aiohttp import web
+
+import enrich_domain_image_gems as enrich
+from response_cache import ResponseCache
+
+KEYWORDS = ["kw a", "kw b", "kw c"]
+
+# Keywords differ per subdomain, or the response cache would share the searches
+def keywords_for(prompt):
+    subdomain = re.search(r"Subdomain: (.+)", prompt).group(1).strip()
+    return [f"{subdomain} {kw}" for kw in KEYWORDS]
+
+# Local stand-in for OpenRouter and SerpAPI that records peak concurrency
+class StubServices:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = {"openrouter": 0, "serpapi": 0, "total": 0}
+        self.peak = dict(self.active)
+        self.calls = {"openrouter": 0, "serpapi": 0}
+
+    async def _track(self, provider):
+        for name in (provider, "total"):
+            self.active[name] += 1
+            self.peak[name] = max(self.peak[name], self.active[name])
+        self.calls[provider] += 1
+        await asyncio.sleep(self.delay)
+        for name in (provider, "total"):
+            self.active[name] -= 1
+
+    async def openrouter(self, request):
+        body = await request.json()
+        assert request.headers["Authorization"].startswith("Bearer ")
+        assert body["messages"][0]["role"] == "user"
+        await self._track("openrouter")
+        content = json.dumps(keywords_for(body["messages"][0]["content"]))
+        return web.json_response({"choices": [{"message": {"content": content}}]})
+
+    async def serpapi(self, request):
+        query = request.query["q"]
+        assert request.query["tbm"] == "isch"
+        await self._track("serpapi")
+        return web.json_response({"images_results": [
+            {"original": f"https://img.example/{query.replace(' ', '_')}/1.jpg"},
+            {"thumbnail": f"https://img.example/{query.replace(' ', '_')}/2.jpg"},
+        ]})
+
+async def run_enrich(data, services, **limits):
+    app = web.Application()
+    app.router.add_post("/chat", services.openrouter)
+    app.router.add_get("/search", services.serpapi)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        enrich.OPENROUTER_URL = f"http://127.0.0.1:{port}/chat"
+        enrich.SERPAPI_URL = f"http://127.0.0.1:{port}/search"
+        return await enrich.enrich_data_async(data, **limits)
+    finally:
+        await runner.cleanup()
+
+def test_async_enrich_respects_provider_caps(tmp_path, monkeypatch, fast_rate):
+    monkeypatch.setattr(enrich, "cache", ResponseCache(str(tmp_path / "responses.sqlite")))
+    monkeypatch.setattr(enrich, "OPENROUTER_URL", enrich.OPENROUTER_URL)
+    monkeypatch.setattr(enrich, "SERPAPI_URL", enrich.SERPAPI_URL)
+    fast_rate("openrouter")
+    fast_rate("serpapi")
+
+    data = {
+        "Physics": {"Optics": {}, "Mechanics": {"image_gems": []}, "Acoustics": {},
+                    "Done": {"image_gems": [{"url": "https://kept.example/1.jpg"}]}},
+        "Math": {"Algebra": {}, "Geometry": {}, "Topology": {}},
+    }
+    services = StubServices()
+    asyncio.run(run_enrich(data, services, concurrency=4, openrouter_concurrency=2, serpapi_concurrency=3))
+
+    pending = 6
+    assert services.calls == {"openrouter": pending, "serpapi": pending * len(KEYWORDS)}
+    assert services.peak["openrouter"] <= 2
+    assert services.peak["serpapi"] <= 3
+    assert services.peak["total"] <= 4
+    # The caps are reached, so the subdomains really ran concurrently
+    assert services.peak["openrouter"] == 2
+    assert services.peak["total"] == 4
+
+    assert data["Physics"]["Done"]["image_gems"] == [{"url": "https://kept.example/1.jpg"}]
+    gems = data["Math"]["Algebra"]["image_gems"]
+    assert len(gems) == 2 * len(KEYWORDS)
+    assert gems[0] == {"url": "https://img.example/Algebra_kw_a/1.jpg", "desc": "Image for query: Algebra kw a"}
+    assert gems[1]["url"] == "https://img.example/Algebra_kw_a/2.jpg"
+
+def test_queue_retries_a_failed_search(tmp_path, monkeypatch, fast_rate):
+    monkeypatch.setattr(enrich, "cache", ResponseCache(str(tmp_path / "responses.sqlite")))
+    monkeypatch.setattr(enrich, "fetch_keywords_from_openrouter", lambda prompt: ["kw a"])
+    fast_rate("serpapi")
+    calls = []
+
+    def flaky_search(query):
+        calls.append(query)
+        if len(calls) == 1:
+            raise ConnectionError("SerpAPI unreachable")
+        return {"images_results": [{"original": "https://img.example/a.jpg"}]}
+
+    monkeypatch.setattr(enrich, "request_images_from_serpapi", flaky_search)
+    taxonomy = tmp_path / "gems.json"
+    taxonomy.write_text(json.dumps({"Physics": {"Optics": {}}}), encoding="utf-8")
+
+    enrich.enrich_domain_image_gems_queue(str(taxonomy), str(tmp_path / "queue.sqlite"), retry_delay=0)
+
+    assert calls == ["kw a", "kw a"]
+    gems = json.loads(taxonomy.read_text(encoding="utf-8"))["Physics"]["Optics"]["image_gems"]
+    assert gems == [{"url": "https://img.example/a.jpg", "desc": "Image for query: kw a"}]
+
+def test_async_enrich_saves_each_subdomain_as_it_finishes(monkeypatch):
+    upserted = asyncio.Event()
+
+    class Store:
+        def __init__(self):
+            self.saved = []
+
+        def upsert_gems(self, path, gems, source=None, replace=False):
+            self.saved.append(path)
+            upserted.set()
+
+    async def enrich_subdomain(openrouter, serpapi, limits, domain, subdomain):
+        if subdomain == "Slow":
+            # Only finishes once the fast subdomain is already in the store
+            await asyncio.wait_for(upserted.wait(), 5)
+        return [{"url": f"https://img.example/{subdomain}.jpg"}]
+
+    monkeypatch.setattr(enrich, "enrich_subdomain_async", enrich_subdomain)
+    store = Store()
+    data = {"Physics": {"Slow": {}, "Fast": {}}}
+    asyncio.run(enrich.enrich_data_async(data, store=store))
+    assert store.saved == [("Physics", "Fast"), ("Physics", "Slow")]
+    assert data["Physics"]["Slow"]["image_gems"] == [{"url": "https://img.example/Slow.jpg"}]
@@ -0,0 +1,44 @@
+import json
+
+from enrich_journal import LeafJournal
+
+def test_resume_after_torn_tail(tmp_path):
+    path = tmp_path / "leaves.journal.jsonl"
+    journal = LeafJournal(str(path))
+    journal.reset()
+    journal.append("A > B", ["A", "B"], [{"url": "https://x/1.jpg"}])
+    journal.append("A > C", ["A", "C"], [])
+    # A killed run leaves half a record with no newline
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "A > D", "path": ["A", "D"], "ima')
+
+    resumed = LeafJournal(str(path))
+    assert resumed.completed() == {"A > B", "A > C"}
+    resumed.append("A > D", ["A", "D"], [{"url": "https://x/2.jpg"}])
+    resumed.append("A > E", ["A", "E"], [])
+
+    assert resumed.completed() == {"A > B", "A > C", "A > D", "A > E"}
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["key"] for line in lines] == ["A > B", "A > C", "A > D", "A > E"]
+
+    out = tmp_path / "out.json"
+    assert resumed.compact_flat(str(out)) == 2
+    assert json.loads(out.read_text(encoding="utf-8")) == {
+        "A > B": [{"url": "https://x/1.jpg"}],
+        "A > D": [{"url": "https://x/2.jpg"}],
+    }
+
+def test_repair_tail_keeps_complete_journal(tmp_path):
+    path = tmp_path / "leaves.journal.jsonl"
+    journal = LeafJournal(str(path))
+    journal.reset()
+    journal.append("A", ["A"], [])
+    size = path.stat().st_size
+    assert journal.repair_tail() == 0
+    assert path.stat().st_size == size
+
+def test_repair_tail_without_any_newline(tmp_path):
+    path = tmp_path / "leaves.journal.jsonl"
+    path.write_text('{"key": "A", "pa', encoding="utf-8")
+    assert LeafJournal(str(path)).repair_tail(chunk_size=4) == 16
+    assert path.read_bytes() == b""
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+
+import pytest
+
+from gems_store import open_store, store_path
+from link_validator import annotate_file
+from url_frontier import canonicalize_url, url_key
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    # A later mtime than any sync, however coarse the filesystem clock
+    later = time.time() + 5
+    os.utime(path, (later, later))
+
+def check(verdict):
+    return {"verdict": verdict, "status": 200 if verdict == "ok" else 404, "checked": 1_700_000_000.0}
+
+def test_link_annotations_survive_store_exports(tmp_path):
+    path = str(tmp_path / "gems.json")
+    write(path, {"Physics": {"Optics": {"image_gems": [
+        {"url": "https://a.example/1.jpg", "desc": "lens"},
+        {"url": "https://b.example/2.jpg", "desc": "prism"},
+    ]}}})
+    checks = {url_key(canonicalize_url("https://a.example/1.jpg")): check("ok"),
+              url_key(canonicalize_url("https://b.example/2.jpg")): check("dead")}
+
+    assert annotate_file(path, checks) == 2
+    gems = read(path)["Physics"]["Optics"]["image_gems"]
+    assert [gem["link"]["verdict"] for gem in gems] == ["ok", "dead"]
+
+    # An enrichment run exports the store afterwards
+    store = open_store(path)
+    store.upsert_gems(("Physics", "Optics"), [{"url": "https://c.example/3.jpg", "desc": "mirror"}])
+    store.export_json(path)
+    store.close()
+    gems = read(path)["Physics"]["Optics"]["image_gems"]
+    assert [gem.get("link", {}).get("verdict") for gem in gems] == ["ok", "dead", None]
+
+def test_rewritten_json_is_reloaded_not_overwritten(tmp_path):
+    path = str(tmp_path / "links.json")
+    write(path, {"Physics > Optics": [{"url": "https://a.example/1.jpg", "desc": "lens"}]})
+    annotate_file(path, {url_key(canonicalize_url("https://a.example/1.jpg")): check("ok")})
+
+    # A journal compaction rewrites the file without going through the store
+    write(path, {"Physics > Optics": [{"url": "https://a.example/1.jpg", "desc": "lens"},
+                                      {"url": "https://d.example/4.jpg", "desc": "new"}]})
+    store = open_store(path)
+    store.export_json(path)
+    store.close()
+    gems = read(path)["Physics > Optics"]
+    assert [gem["url"] for gem in gems] == ["https://a.example/1.jpg", "https://d.example/4.jpg"]
+    assert gems[0]["link"]["verdict"] == "ok"
+
+def test_export_refuses_to_overwrite_a_newer_json(tmp_path):
+    path = str(tmp_path / "gems.json")
+    write(path, {"Physics": {"image_gems": [{"url": "https://a.example/1.jpg"}]}})
+    store = open_store(path)
+    assert os.path.exists(store_path(path))
+    write(path, {"Physics": {"image_gems": [{"url": "https://e.example/5.jpg"}]}})
+    with pytest.raises(ValueError):
+        store.export_json(path)
+    store.close()
+    assert read(path)["Physics"]["image_gems"] == [{"url": "https://e.example/5.jpg"}]
+
+def test_seed_collapses_repeated_urls_and_says_so(tmp_path, capsys):
+    path = str(tmp_path / "links.json")
+    write(path, {"A > B": [{"url": "https://a.example/1.jpg", "desc": "first"},
+                           {"url": "https://b.example/2.jpg"},
+                           {"url": "https://a.example/1.jpg", "desc": "again"}],
+                 "A > C": [{"url": "https://a.example/1.jpg"}]})
+    store = open_store(path)
+    out = capsys.readouterr().out
+    assert "with 3 gems" in out and "1 repeated URLs within a node collapsed" in out
+    assert [gem["url"] for gem in store.gems(("A", "B"))] == ["https://a.example/1.jpg", "https://b.example/2.jpg"]
+    assert store.gems(("A", "B"))[0]["desc"] == "again"
+    store.close()
+
+def test_refresh_drops_gems_and_nodes_missing_from_the_file(tmp_path):
+    path = str(tmp_path / "gems.json")
+    write(path, {"Physics": {"Optics": {"image_gems": [{"url": "https://a.example/1.jpg"},
+                                                      {"url": "https://a.example/2.jpg"}]},
+                             "Acoustics": {"image_gems": [{"url": "https://c.example/1.jpg"}],
+                                           "Arabic": {"image_gems": [{"url": "https://c.example/ar.jpg"}]}}}})
+    annotate_file(path, {url_key(canonicalize_url("https://c.example/1.jpg")): check("ok")})
+
+    # Rewritten outside the store: Optics lost its gems, Acoustics its Arabic ones, Mechanics is new
+    write(path, {"Physics": {"Optics": {"image_gems": [{"url": "https://b.example/1.jpg"}]},
+                             "Acoustics": {"image_gems": [{"url": "https://c.example/1.jpg"}]}},
+                 "Math": {"Algebra": {"image_gems": []}}})
+    store = open_store(path)
+    store.export_json(path)
+    assert store.stats()["languages"] == 0
+    store.close()
+
+    data = read(path)
+    assert data["Physics"]["Optics"] == {"image_gems": [{"url": "https://b.example/1.jpg"}]}
+    assert [gem["url"] for gem in data["Physics"]["Acoustics"]["image_gems"]] == ["https://c.example/1.jpg"]
+    assert data["Physics"]["Acoustics"]["image_gems"][0]["link"]["verdict"] == "ok"
+    assert "Arabic" not in data["Physics"]["Acoustics"]
+    assert data["Math"] == {"Algebra": {"image_gems": []}}
+
+def test_refresh_drops_removed_flat_keys(tmp_path):
+    path = str(tmp_path / "links.json")
+    write(path, {"A > B": [{"url": "https://a.example/1.jpg"}], "A > C": [{"url": "https://a.example/2.jpg"}]})
+    open_store(path).close()
+    write(path, {"A > C": [{"url": "https://a.example/3.jpg"}]})
+    store = open_store(path)
+    store.export_json(path)
+    store.close()
+    assert read(path) == {"A > C": [{"url": "https://a.example/3.jpg"}]}
@@ -0,0 +1,53 @@
+import json
+import threading
+
+import pytest
+
+import llm_batch
+from llm_batch import BatchPrompter, extract_json, is_string_list
+from response_cache import ResponseCache
+
+def test_trailing_comma_in_one_element_keeps_the_others():
+    text = 'Results: [{"id": 1, "result": ["x"]}, {"id": 2, "result": ["y",]}, {"id": 3, "result": ["z"]}]'
+    assert [item["id"] for item in extract_json(text)] == [1, 2, 3]
+    assert extract_json(text)[1]["result"] == ["y"]
+
+def test_array_after_bracketed_prose_wins():
+    assert extract_json('see [1] below: ["a","b"]') == ["a", "b"]
+
+def test_expected_shape_wins_over_position():
+    assert extract_json('["a", "b"] and footnote [1]', expect=is_string_list) == ["a", "b"]
+
+def test_truncated_array_keeps_complete_elements():
+    text = '```json\n[{"url": "u1"}, {"url": "u2",}, {"url": "u3", "desc": "cut'
+    assert extract_json(text) == [{"url": "u1"}, {"url": "u2"}]
+
+def test_object_and_fences():
+    assert extract_json('```json\n{"a": 1,}\n```') == {"a": 1}
+    assert extract_json('Here you go: {"a": 1} thanks') == {"a": 1}
+
+def test_no_json_raises():
+    with pytest.raises(ValueError):
+        extract_json("no brackets here")
+
+def test_shared_prompter_counts_every_item_across_threads(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_batch, "cache", ResponseCache(str(tmp_path / "responses.sqlite")))
+    monkeypatch.setattr(llm_batch, "with_rate_limit", lambda provider, fn, *args: fn(*args))
+
+    def call(model, prompt):
+        ids = [int(line.split(".")[0]) for line in prompt.split("Items:\n")[1].splitlines() if line[:1].isdigit()]
+        return json.dumps([{"id": i, "result": [f"kw {i}"]} for i in ids])
+
+    prompter = BatchPrompter("stub", "stub-model", call, "Keywords please", describe=str,
+                             single_prompt=lambda item: f"single {item}", single=lambda item: [],
+                             max_batch=4)
+    chunks = [[f"leaf {t}-{i}" for i in range(8)] for t in range(8)]
+    threads = [threading.Thread(target=prompter.run, args=(chunk,)) for chunk in chunks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert prompter.stats["batched"] == 64
+    assert prompter.stats["batch_calls"] == 16
+    assert prompter.stats["single"] == 0
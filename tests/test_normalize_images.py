@@ -0,0 +1,29 @@
+import json
+import os
+
+from PIL import Image
+
+from normalize_images import load_renames, normalize_images
+
+def test_renames_are_recorded(tmp_path):
+    root = tmp_path / "raw_images"
+    root.mkdir()
+    # PNG bytes behind a .jpg name: only the extension changes
+    Image.new("RGB", (16, 16), "red").save(root / "figure.jpg", "PNG")
+    Image.new("RGB", (16, 16), "blue").save(root / "photo.jpg", "JPEG")
+    rename_map = str(tmp_path / "renames.jsonl")
+
+    counts = normalize_images(str(root), str(tmp_path / "thumbs"), workers=1, rename_map=rename_map)
+    assert counts["normalized"] == 1
+    assert sorted(os.listdir(root)) == ["figure.png", "photo.jpg"]
+    with open(rename_map, encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert [(e["old"], e["new"]) for e in entries] == [("figure.jpg", "figure.png")]
+    assert load_renames(rename_map) == {str(root / "figure.jpg"): str(root / "figure.png")}
+
+def test_load_renames_follows_chains(tmp_path):
+    rename_map = tmp_path / "renames.jsonl"
+    rename_map.write_text("".join(json.dumps({"root": "/r", "old": old, "new": new}) + "\n"
+                                  for old, new in [("a.gif", "a.jpg"), ("a.jpg", "a.png")]), encoding="utf-8")
+    assert load_renames(str(rename_map)) == {"/r/a.gif": "/r/a.png", "/r/a.jpg": "/r/a.png"}
+    assert load_renames(str(tmp_path / "missing.jsonl")) == {}
@@ -0,0 +1,114 @@
+from PIL import Image
+
+import ocr_filter
+from ocr_store import OcrStore
+
+class FakeReader:
+    def __init__(self):
+        self.calls = []
+
+    def readtext(self, image, detail=1, paragraph=False):
+        self.calls.append(("readtext", image, paragraph))
+        return [[[[0, 0], [10, 0], [10, 5], [0, 5]], "نص عربي"]]
+
+    def readtext_batched(self, images, detail=1, paragraph=False, batch_size=1):
+        self.calls.append(("batched", [image.shape for image in images], paragraph))
+        return [[[[[0, 0], [10, 0], [10, 5], [0, 5]], "نص عربي"]] for _ in images]
+
+def make_image(path, size):
+    Image.new("RGB", size, "white").save(path)
+    return str(path)
+
+def test_full_resolution_paragraph_by_default(tmp_path):
+    path = make_image(tmp_path / "big.png", (3000, 2000))
+    store = OcrStore(str(tmp_path / "ocr.sqlite"))
+    reader = FakeReader()
+
+    out = ocr_filter.ocr_batch([path], store, lambda: reader, ["ar"], text_threshold=0)
+    (_, _, content_hash, result, status, _), = out
+    # One call per image on the file itself, as in the notebook: no downscaling
+    assert reader.calls == [("readtext", path, True)]
+    assert status == "ocr"
+    assert result["mode"] == "full-paragraph"
+    assert (result["width"], result["height"]) == (3000, 2000)
+    assert result["boxes"][0][1:] == ["نص عربي", None]
+
+    store.put(content_hash, result)
+    assert store.get(content_hash, ["ar"], "full-paragraph")["boxes"] == result["boxes"]
+    # A canvas run does not reuse full-resolution results
+    assert store.get(content_hash, ["ar"], "canvas1024-paragraph") is None
+    store.close()
+
+def test_canvas_batches_opt_in(tmp_path):
+    paths = [make_image(tmp_path / f"{i}.png", (2048, 1024)) for i in range(2)]
+    store = OcrStore(str(tmp_path / "ocr.sqlite"))
+    reader = FakeReader()
+
+    out = ocr_filter.ocr_batch(paths, store, lambda: reader, ["ar"], canvas=1024, text_threshold=0)
+    assert reader.calls == [("batched", [(1024, 1024, 3)] * 2, True)]
+    assert {result["mode"] for _, _, _, result, _, _ in out} == {"canvas1024-paragraph"}
+    # Boxes are scaled back to the original image
+    assert out[0][3]["boxes"][0][0][1] == [20.0, 0.0]
+    store.close()
+
+def test_paragraph_boxes_pass_confidence_filter():
+    result = {"boxes": [[[[0, 0]], "هذا نص عربي طويل بما يكفي", None]]}
+    assert ocr_filter.passes_filters(result, min_confidence=0.5)
+
+def stored(languages, mode, text):
+    return {"languages": languages, "mode": mode, "width": 10, "height": 5, "text": text,
+            "boxes": [[[[0, 0]], text, 0.9]]}
+
+def test_modes_are_stored_side_by_side(tmp_path):
+    path = make_image(tmp_path / "img.png", (10, 5))
+    store = OcrStore(str(tmp_path / "ocr.sqlite"))
+    content_hash = store.content_hash(path)
+    store.link(path, content_hash, (tmp_path / "img.png").stat())
+    store.put(content_hash, stored(["ar"], "full-paragraph", "full"))
+    store.put(content_hash, stored(["ar"], "canvas1024-paragraph", "canvas"))
+    store.put(content_hash, stored(["ar", "en"], "full-paragraph", "bilingual"))
+
+    # A canvas run does not overwrite the full-resolution result
+    assert store.get(content_hash, ["ar"], "full-paragraph")["text"] == "full"
+    assert store.get(content_hash, ["ar"], "canvas1024-paragraph")["text"] == "canvas"
+    assert store.get(content_hash, ["ar", "en"], "full-paragraph")["text"] == "bilingual"
+    assert [r["text"] for _, r in store.iter_results(str(tmp_path), ["ar"], "full-paragraph")] == ["full"]
+    assert [r["text"] for _, r in store.iter_results(str(tmp_path), ["ar"], "canvas1024-paragraph")] == ["canvas"]
+    store.close()
+
+def test_from_store_defaults_to_full_resolution(tmp_path, monkeypatch):
+    source = tmp_path / "src"
+    source.mkdir()
+    path = make_image(source / "img.png", (10, 5))
+    store_path = str(tmp_path / "ocr.sqlite")
+    store = OcrStore(store_path)
+    content_hash = store.content_hash(path)
+    store.link(path, content_hash, (source / "img.png").stat())
+    store.put(content_hash, stored(["ar"], "full-paragraph", "full"))
+    store.put(content_hash, stored(["ar"], "canvas1024-paragraph", "canvas"))
+    store.close()
+
+    seen = []
+    monkeypatch.setattr(ocr_filter, "passes_filters", lambda result, min_confidence: seen.append(result["text"]))
+    ocr_filter.filter_from_store(str(source), str(tmp_path / "out"), store_path)
+    ocr_filter.filter_from_store(str(source), str(tmp_path / "out"), store_path, canvas=1024)
+    assert seen == ["full", "canvas"]
+
+def test_hash_keyed_store_is_migrated(tmp_path):
+    import sqlite3
+    store_path = str(tmp_path / "ocr.sqlite")
+    conn = sqlite3.connect(store_path)
+    conn.execute("""CREATE TABLE ocr (hash TEXT PRIMARY KEY, languages TEXT, width INTEGER, height INTEGER,
+                    text TEXT, boxes TEXT, created_at REAL)""")
+    conn.execute("INSERT INTO ocr VALUES ('h', 'ar', 10, 5, 'old', '[]', 1.0)")
+    conn.commit()
+    conn.close()
+
+    store = OcrStore(store_path)
+    assert store.get("h", ["ar"], "canvas1024-lines")["text"] == "old"
+    store.put("h", stored(["ar"], "full-paragraph", "new"))
+    assert store.get("h", ["ar"], "canvas1024-lines")["text"] == "old"
+    assert store.get("h", ["ar"], "full-paragraph")["text"] == "new"
+    store.close()
+    # Opening it again leaves the migrated table alone
+    assert OcrStore(store_path).get("h", ["ar"], "full-paragraph")["text"] == "new"
@@ -0,0 +1,65 @@
+import json
+import os
+import zipfile
+
+from package_delivery import package_delivery
+
+MTIME = 1_600_000_000
+
+def write(path, data, mtime=MTIME):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+
+def members(zip_path):
+    with zipfile.ZipFile(zip_path) as zf:
+        return {info.filename: info.compress_type for info in zf.infolist()}
+
+def test_only_new_and_changed_files_ship(tmp_path):
+    source, out = tmp_path / "arabic", tmp_path / "deliveries"
+    write(source / "a.jpg", b"a" * 100)
+    write(source / "b.png", b"b" * 100)
+    write(source / "notes" / "c.txt", b"c" * 100)
+
+    manifest_path, archives = package_delivery(str(source), str(out), name="day1")
+    # Compressed image formats are stored, everything else deflated
+    assert members(archives[0]) == {"a.jpg": zipfile.ZIP_STORED, "b.png": zipfile.ZIP_STORED,
+                                    "notes/c.txt": zipfile.ZIP_DEFLATED, "MANIFEST.json": zipfile.ZIP_DEFLATED}
+
+    write(source / "a.jpg", b"a" * 100, mtime=MTIME + 60)  # touched, same bytes
+    write(source / "b.png", b"B" * 100)  # same size and mtime: not even re-hashed
+    write(source / "notes" / "c.txt", b"changed")
+    write(source / "d.jpg", b"d")
+    os.remove(source / "notes" / "c.txt")
+    write(source / "e.txt", b"e")
+
+    manifest_path, archives = package_delivery(str(source), str(out), name="day2")
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    assert manifest["previous"] == "day1.manifest.json"
+    assert manifest["added"] == ["d.jpg", "e.txt"]
+    assert manifest["removed"] == ["notes/c.txt"]
+    assert manifest["files"]["a.jpg"]["delivery"] == "day1"
+    assert manifest["files"]["a.jpg"]["mtime"] == MTIME + 60
+    assert manifest["files"]["b.png"]["delivery"] == "day1"
+    assert set(members(archives[0])) == {"d.jpg", "e.txt", "MANIFEST.json"}
+
+def test_parts_split_by_size(tmp_path):
+    source, out = tmp_path / "arabic", tmp_path / "deliveries"
+    for name, size in [("a.jpg", 400), ("b.jpg", 300), ("c.jpg", 200), ("d.jpg", 100)]:
+        write(source / name, b"x" * size)
+
+    manifest_path, archives = package_delivery(str(source), str(out), name="day1", parts=2)
+    assert [os.path.basename(p) for p in archives] == ["day1.part1of2.zip", "day1.part2of2.zip"]
+    assert [sorted(m for m in members(p) if m != "MANIFEST.json") for p in archives] == [
+        ["a.jpg", "d.jpg"], ["b.jpg", "c.jpg"]]
+
+def test_second_drop_on_a_day_gets_its_own_name(tmp_path):
+    source, out = tmp_path / "arabic", tmp_path / "deliveries"
+    write(source / "a.jpg", b"a")
+    first, _ = package_delivery(str(source), str(out))
+    second, archives = package_delivery(str(source), str(out))
+    assert first != second
+    assert os.path.basename(second).split(".")[0].endswith("_2")
+    # Nothing changed, so only the manifest is written
+    assert archives == []
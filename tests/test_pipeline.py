@@ -0,0 +1,28 @@
+import os
+import threading
+
+from pipeline import Pipeline, Stage
+
+# Runs in a spawned worker process; item 6 takes the whole process down
+def crash_on_six(item):
+    if item == 6:
+        os._exit(1)
+    return [item * 10]
+
+def double(item):
+    return [item * 2]
+
+def test_dead_process_worker_does_not_hang_the_pipeline():
+    crashing = Stage("crash", crash_on_six, executor="processes", workers=1)
+    pipeline = Pipeline([Stage("double", double), crashing], queue_size=2)
+    outputs = []
+    runner = threading.Thread(target=lambda: outputs.append(pipeline.run(range(1, 21), None)), daemon=True)
+    runner.start()
+    runner.join(60)
+
+    assert not runner.is_alive()
+    # The crashed item and whatever else was in flight fail; a new pool takes the rest
+    assert crashing.stats["errors"] >= 1
+    assert crashing.stats["in"] == 20
+    assert crashing.stats["out"] + crashing.stats["errors"] == 20
+    assert crashing.stats["out"] >= 15
@@ -0,0 +1,75 @@
+import io
+
+import pytest
+from urllib3.exceptions import ProtocolError
+
+from pmc_harvester import iter_batches, prefetch
+
+def article(pmc_id, figures):
+    figs = "".join(f'<fig id="f{n}"><label>Figure {n}</label><graphic xlink:href="img{n}"/></fig>'
+                   for n in range(1, figures + 1))
+    return f'<article><front><article-id pub-id-type="pmc">{pmc_id}</article-id></front><body>{figs}</body></article>'
+
+BODY = ('<pmc-articleset xmlns:xlink="http://www.w3.org/1999/xlink">'
+        + article("101", 2) + article("102", 1) + "</pmc-articleset>").encode("utf-8")
+
+# Body whose connection drops after `cut` bytes
+class DroppingStream(io.BytesIO):
+    def __init__(self, data, cut=None):
+        super().__init__(data)
+        self.cut = cut
+        self.decode_content = False
+
+    def read(self, size=-1):
+        if self.cut is not None and self.tell() >= self.cut:
+            raise ProtocolError("Connection broken: IncompleteRead")
+        if self.cut is not None and (size < 0 or self.tell() + size > self.cut):
+            size = self.cut - self.tell()
+        return super().read(size)
+
+class FakeResponse:
+    def __init__(self, raw):
+        self.raw = raw
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+class FakeSession:
+    def __init__(self, cuts):
+        self.cuts = list(cuts)
+
+    def get(self, url, params=None, stream=False, timeout=None):
+        return FakeResponse(DroppingStream(BODY, self.cuts.pop(0) if self.cuts else None))
+
+def test_dropped_batch_is_retried_without_duplicates(fast_rate):
+    fast_rate("entrez")
+    # The first attempt breaks off after the first figure of the first article
+    session = FakeSession([BODY.index(b'<fig id="f2"')])
+    counts = {"articles": 0}
+    figures = list(iter_batches(session, "env", "1", 2, 100, counts, retry_delay=0))
+    assert [(f["pmc_id"], f["figure_id"]) for f in figures] == [("101", "f1"), ("101", "f2"), ("102", "f1")]
+    assert counts["articles"] == 2
+    assert session.cuts == []
+
+def test_batch_gives_up_after_retries(capsys, fast_rate):
+    fast_rate("entrez")
+    session = FakeSession([10, 10, 10])
+    counts = {"articles": 0}
+    assert list(iter_batches(session, "env", "1", 2, 100, counts, retries=2, retry_delay=0)) == []
+    assert "efetch batch at 0 failed" in capsys.readouterr().out
+
+def test_prefetch_reraises_in_consumer():
+    def broken():
+        yield 1
+        raise ProtocolError("Connection broken")
+
+    items = prefetch(broken(), 10)
+    assert next(items) == 1
+    with pytest.raises(ProtocolError):
+        next(items)
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+from PIL import Image
+
+from qa_shards import QAShardDataset, iter_dataset, pack_qa_shards
+
+@pytest.fixture
+def shard_dir(tmp_path):
+    qa_dir, images = tmp_path / "qa_data", tmp_path / "raw_images"
+    qa_dir.mkdir()
+    images.mkdir()
+    with open(qa_dir / "medical.jsonl", "w", encoding="utf-8") as f:
+        for i in range(6):
+            Image.new("RGB", (8, 8), (i * 40, 0, 0)).save(images / f"{i}.png")
+            record = {"domain": "Medicine", "subdomain": f"S{i % 3}", "image_path": f"{i}.png", "question": f"q{i}"}
+            f.write(json.dumps(record) + "\n")
+    out = tmp_path / "shards"
+    pack_qa_shards(str(qa_dir), str(images), str(out), shard_bytes=4096, workers=2)
+    return str(out)
+
+def test_dataset_streams_every_sample(shard_dir):
+    dataset = QAShardDataset(shard_dir, shuffle=0, decode=True)
+    samples = list(dataset)
+    assert len(dataset) == 6
+    assert sorted(sample["record"]["question"] for sample in samples) == [f"q{i}" for i in range(6)]
+    assert samples[0]["image"].size == (8, 8)
+
+def test_ranks_split_the_shards(shard_dir):
+    seen = [
+        [sample["key"] for sample in QAShardDataset(shard_dir, rank=rank, world_size=2, shuffle=0)]
+        for rank in range(2)
+    ]
+    assert seen[0] and seen[1]
+    assert not set(seen[0]) & set(seen[1])
+    assert len(seen[0]) + len(seen[1]) == 6
+
+def test_len_counts_this_ranks_samples(shard_dir):
+    for epoch in range(3):
+        for rank in range(2):
+            dataset = QAShardDataset(shard_dir, rank=rank, world_size=2, shuffle=0)
+            dataset.set_epoch(epoch)
+            assert len(dataset) == len(list(dataset))
+            # Loader workers split the rank's shards without changing them
+            keys = [sample["key"] for worker in range(3)
+                    for sample in iter_dataset(shard_dir, rank, 2, worker, 3, seed=epoch)]
+            assert len(keys) == len(dataset)
+
+def test_is_a_torch_iterable_dataset(shard_dir):
+    torch_data = pytest.importorskip("torch.utils.data")
+    dataset = QAShardDataset(shard_dir, shuffle=0)
+    assert isinstance(dataset, torch_data.IterableDataset)
+    loader = torch_data.DataLoader(dataset, batch_size=None, num_workers=2)
+    assert len([sample["key"] for sample in loader]) == 6
@@ -0,0 +1,95 @@
+import time
+import asyncio
+import threading
+
+from response_cache import ResponseCache
+
+def test_async_calls_are_shared(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"answer": 42}
+
+    async def main():
+        return await asyncio.gather(*[
+            cache.get_or_call_async("openrouter", "model", "prompt", None, fetch) for _ in range(5)
+        ])
+
+    assert asyncio.run(main()) == [{"answer": 42}] * 5
+    assert len(calls) == 1
+    assert cache.get_or_call("openrouter", "model", "prompt", None, lambda: None) == {"answer": 42}
+
+def test_cancelled_owner_does_not_strand_waiters(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return "value"
+
+    async def main():
+        owner = asyncio.create_task(cache.get_or_call_async("serpapi", "google", "q", None, fetch))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_call_async("serpapi", "google", "q", None, fetch))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        result = await asyncio.wait_for(waiter, 2)
+        return owner, result
+
+    owner, result = asyncio.run(main())
+    assert owner.cancelled()
+    # The waiter took the call over instead of hanging on the abandoned future
+    assert result == "value"
+    assert len(calls) == 2
+    assert not cache._inflight_async
+
+def test_cancelled_waiter_stays_cancelled(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+
+    async def fetch():
+        await asyncio.sleep(0.1)
+        return "value"
+
+    async def main():
+        owner = asyncio.create_task(cache.get_or_call_async("serpapi", "google", "q", None, fetch))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_call_async("serpapi", "google", "q", None, fetch))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await owner, await asyncio.gather(waiter, return_exceptions=True)
+
+    value, (waited,) = asyncio.run(main())
+    assert value == "value"
+    assert isinstance(waited, asyncio.CancelledError)
+
+def test_interrupted_owner_lets_waiters_call(tmp_path):
+    cache = ResponseCache(str(tmp_path / "responses.sqlite"))
+    started = threading.Event()
+    outcomes = []
+
+    def interrupted():
+        started.set()
+        time.sleep(0.2)  # long enough for the waiter to queue up behind this call
+        raise KeyboardInterrupt
+
+    def owner():
+        try:
+            cache.get_or_call("openrouter", "model", "prompt", None, interrupted)
+        except KeyboardInterrupt:
+            outcomes.append("interrupted")
+
+    def waiter():
+        outcomes.append(cache.get_or_call("openrouter", "model", "prompt", None, lambda: "fresh"))
+
+    threads = [threading.Thread(target=owner), threading.Thread(target=waiter)]
+    threads[0].start()
+    started.wait(5)
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+    assert sorted(outcomes) == ["fresh", "interrupted"]
+    assert cache.get_or_call("openrouter", "model", "prompt", None, lambda: None) == "fresh"
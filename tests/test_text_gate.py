@@ -0,0 +1,43 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from text_gate import gate_paths, score_images
+
+def make_images(tmp_path):
+    paths = {}
+    paths["blank"] = str(tmp_path / "blank.png")
+    Image.new("RGB", (640, 480), "white").save(paths["blank"])
+    paths["gradient"] = str(tmp_path / "gradient.jpg")
+    Image.fromarray(np.tile(np.linspace(0, 255, 640, dtype=np.uint8), (480, 1))).save(paths["gradient"])
+    page = Image.new("RGB", (640, 480), "white")
+    draw = ImageDraw.Draw(page)
+    for y in range(40, 440, 30):
+        draw.text((20, y), "The quick brown fox jumps over the lazy dog 0123456789", fill="black")
+    paths["page"] = str(tmp_path / "page.png")
+    page.save(paths["page"])
+    # One short caption in a corner of an otherwise flat figure
+    figure = Image.new("RGB", (640, 480), (90, 140, 200))
+    ImageDraw.Draw(figure).text((10, 450), "Fig. 3 caption", fill="white")
+    paths["caption"] = str(tmp_path / "caption.png")
+    figure.save(paths["caption"])
+    paths["broken"] = str(tmp_path / "broken.jpg")
+    with open(paths["broken"], "wb") as f:
+        f.write(b"not an image")
+    return paths
+
+def test_scores_separate_text_from_plain_images(tmp_path):
+    paths = make_images(tmp_path)
+    scores = score_images(list(paths.values()))
+    assert scores[paths["blank"]] == 0.0
+    assert scores[paths["gradient"]] == 0.0
+    assert scores[paths["page"]] == 1.0
+    assert scores[paths["caption"]] > 0.2
+    assert scores[paths["broken"]] is None
+
+def test_gate_keeps_text_and_unreadable_files(tmp_path):
+    paths = make_images(tmp_path)
+    candidates, rejected = gate_paths(list(paths.values()), threshold=0.2)
+    assert candidates == [paths["page"], paths["caption"], paths["broken"]]
+    assert rejected == [paths["blank"], paths["gradient"]]
+    # A threshold of 0 lets everything through without scoring
+    assert gate_paths(list(paths.values()), threshold=0) == (list(paths.values()), [])
@@ -0,0 +1,72 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from validate_qa import QUESTION_TYPES, QAIndex, validate_file, validate_record
+
+def record(image_id, image_path="a.jpg", **changes):
+    rec = {
+        "image_id": image_id, "image_path": image_path, "domain": "Medicine", "subdomain": "Radiology",
+        "theme": "X-ray", "language": "ar",
+        "image_metadata": {"width": 640, "height": 480, "format": "JPEG"},
+        "questions": [{"type": t, "question": f"{t}?", "answer": "نعم", "difficulty": "easy"} for t in QUESTION_TYPES],
+    }
+    rec.update(changes)
+    return rec
+
+def write_jsonl(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line if isinstance(line, str) else json.dumps(line, ensure_ascii=False))
+            f.write("\n")
+    return str(path)
+
+def test_record_checks():
+    assert validate_record(record("1")) == []
+    rec = record("1", theme="", questions=record("1")["questions"][:4])
+    rec["image_metadata"]["width"] = 0
+    assert validate_record(rec) == [
+        "missing or empty theme",
+        "image_metadata.width must be a positive integer",
+        "missing question types: spatial_awareness",
+    ]
+    assert validate_record([]) == ["record is not an object"]
+
+def test_missing_image_is_reported(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"")
+    assert validate_record(record("1"), str(tmp_path)) == []
+    assert validate_record(record("1", "missing.jpg"), str(tmp_path)) == ["image not found: missing.jpg"]
+
+def test_file_is_checked_in_chunks_and_indexed(tmp_path):
+    lines = [record(str(i)) for i in range(40)]
+    lines[7] = "{not json"
+    lines[30] = record("3")
+    path = write_jsonl(tmp_path / "medicine.jsonl", lines)
+
+    # Small chunks so records are split across many ranges
+    with ThreadPoolExecutor(4) as pool:
+        count, errors = validate_file(path, pool, chunk_bytes=512)
+    assert count == 40
+    messages = [message for _, message in errors]
+    assert len(messages) == 2
+    assert messages[0].startswith("invalid JSON")
+    assert messages[1].startswith("duplicate image_id '3'")
+
+    with QAIndex(path) as index:
+        assert len(index) == 40
+        assert index[0]["image_id"] == "0"
+        assert index[-1]["image_id"] == "39"
+        assert index.by_id("12") == lines[12]
+        assert index.by_id("7") is None
+        with pytest.raises(IndexError):
+            index[40]
+
+def test_stale_index_is_refused(tmp_path):
+    path = write_jsonl(tmp_path / "medicine.jsonl", [record("1")])
+    with ThreadPoolExecutor(1) as pool:
+        validate_file(path, pool)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record("2")) + "\n")
+    with pytest.raises(ValueError, match="stale"):
+        QAIndex(path)
@@ -0,0 +1,60 @@
+import time
+import threading
+
+from image_downloader import DownloadResult
+from pipeline import Pipeline, Stage
+from url_frontier import url_host
+from vqa_pipeline import DownloadStage
+
+class FakeSeen:
+    def __init__(self):
+        self.marked = {}
+
+    def mark(self, key, url, status):
+        self.marked[key] = status
+
+    def close(self):
+        pass
+
+# Host "slow" answers in 0.2s, "fast" at once; records when each fetch started
+class FakeDownloader:
+    def __init__(self):
+        self.started = {}
+        self.active = {}
+        self.peak = {}
+        self.lock = threading.Lock()
+
+    def fetch(self, url):
+        host = url_host(url)
+        with self.lock:
+            self.started[url] = time.monotonic()
+            self.active[host] = self.active.get(host, 0) + 1
+            self.peak[host] = max(self.peak.get(host, 0), self.active[host])
+        time.sleep(0.2 if host == "slow.example" else 0.01)
+        with self.lock:
+            self.active[host] -= 1
+        return DownloadResult(url, b"img", "PNG", 400, 400)
+
+    def close(self):
+        pass
+
+def test_busy_host_does_not_block_other_hosts(tmp_path):
+    seen = FakeSeen()
+    stage = DownloadStage(seen, str(tmp_path), workers=4, per_host=1)
+    stage.downloader = FakeDownloader()
+    items = [{"url": f"https://slow.example/{i}.png", "host": "slow.example"} for i in range(4)]
+    items += [{"url": f"https://fast.example/{i}.png", "host": "fast.example"} for i in range(4)]
+    for item in items:
+        item.update(key=item["url"], path=["Physics"])
+
+    begun = time.monotonic()
+    pipeline = Pipeline([Stage("download", stage, workers=4, finish=stage.drain, close=stage.close)])
+    outputs = []
+    assert pipeline.run(items, outputs.append) == 8
+
+    downloader = stage.downloader
+    assert downloader.peak == {"slow.example": 1, "fast.example": 1}
+    # Every fast.example fetch starts while the first slow.example one is still running
+    assert max(downloader.started[item["url"]] for item in items[4:]) - begun < 0.2
+    assert sorted(o["url"] for o in outputs) == sorted(item["url"] for item in items)
+    assert set(seen.marked.values()) == {"saved"}